@@ -0,0 +1,173 @@
+import os
+import json
+import argparse
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+import audioFormats
+import util
+import database
+import instrument
+
+"""
+Acoustic parameters of the RIRs, computed for batches of RIRs at once:
+
+	edt     early decay time (0 to -10 dB of the energy decay curve, extrapolated to -60 dB) in seconds
+	t20     reverberation time from -5 to -25 dB, extrapolated to -60 dB, in seconds
+	t30     reverberation time from -5 to -35 dB, extrapolated to -60 dB, in seconds
+	rt60    t30, or t20 if the decay curve does not reach -35 dB
+	drr     direct-to-reverberant ratio in dB (direct sound: +-2.5 ms around the peak)
+	c50     clarity: ratio of the energy up to 50 ms after the direct sound and the energy after it, in dB
+	c80     same as c50 with 80 ms
+
+The energy decay curve is the Schroeder backward integral of the squared RIR. Parameters that cannot be determined
+(e.g. because the RIR is too short) are None.
+
+main() stores the parameters as fields of every RIR in the database. Results are cached per content hash of the RIR file,
+so running it again only analyzes new or changed RIRs.
+"""
+
+Parameters = ['edt', 't20', 't30', 'rt60', 'drr', 'c50', 'c80']
+BatchSize = 16
+DirectSoundWindow = 0.0025 # seconds
+CacheVersion = 2 # increased when the results change, caches of other versions are discarded
+
+def padBatch(signals):
+	"""Zero pad a list of 1-D signals to a 2-D array (float64). Returns the array and the lengths"""
+	lengths = np.array([len(x) for x in signals])
+	X = np.zeros((len(signals), lengths.max()))
+	for i, x in enumerate(signals):
+		X[i, :len(x)] = x
+	return X, lengths
+
+
+def energyDecayCurves(X, lengths):
+	"""Schroeder integral of every row of X, normalized to 0 dB at the beginning. The padding after the lengths is NaN, so
+	it does not count as decay (the decay curve of the zero padding is -inf)."""
+	edc = np.cumsum((X**2)[:, ::-1], axis=1)[:, ::-1]
+	with np.errstate(divide='ignore'):
+		edcDb = 10 * np.log10(edc / edc[:, :1])
+	edcDb[np.arange(X.shape[1])[None, :] >= lengths[:, None]] = np.nan
+	return edcDb
+
+
+def decayTimes(edcDb, fs, startDb, endDb):
+	"""Time for a decay by 60 dB, from a linear fit of the decay curves between startDb and endDb (per row)"""
+	t = np.arange(edcDb.shape[1])[None, :] / fs[:, None]
+	fit = (edcDb <= startDb) & (edcDb >= endDb)
+	n = fit.sum(axis=1)
+	st = np.where(fit, t, 0).sum(axis=1)
+	sy = np.where(fit, edcDb, 0).sum(axis=1)
+	stt = np.where(fit, t * t, 0).sum(axis=1)
+	sty = np.where(fit, t * edcDb, 0).sum(axis=1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		slope = (n * sty - st * sy) / (n * stt - st * st)
+		times = -60 / slope
+	reachesEnd = np.nanmin(edcDb, axis=1) < endDb
+	return np.where((n >= 2) & reachesEnd & (slope < 0), times, np.nan)
+
+
+def _energyRatioDb(cumulativeEnergy, start, end):
+	"""Ratio (dB) of the energy in [start, end) and the rest of every row"""
+	total = cumulativeEnergy[:, -1]
+	rows = np.arange(len(cumulativeEnergy))
+	# windows may end after the (padded) RIR, the energy does not change there
+	before = lambda i: np.where(i > 0, cumulativeEnergy[rows, np.clip(i - 1, 0, cumulativeEnergy.shape[1] - 1)], 0)
+	inside = before(end) - before(start)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return 10 * np.log10(inside / (total - inside))
+
+
+def analyze(signals, fs):
+	"""Acoustic parameters of a list of RIRs with the sampling rates fs (list or array). Returns one dictionary per RIR"""
+	X, lengths = padBatch(signals)
+	fs = np.asarray(fs, dtype=float)
+	edcDb = energyDecayCurves(X, lengths)
+
+	params = {
+		'edt': decayTimes(edcDb, fs, 0, -10),
+		't20': decayTimes(edcDb, fs, -5, -25),
+		't30': decayTimes(edcDb, fs, -5, -35),
+	}
+	params['rt60'] = np.where(np.isnan(params['t30']), params['t20'], params['t30'])
+
+	cumulativeEnergy = np.cumsum(X**2, axis=1)
+	peak = np.abs(X).argmax(axis=1)
+	window = np.round(DirectSoundWindow * fs).astype(int)
+	params['drr'] = _energyRatioDb(cumulativeEnergy, np.maximum(peak - window, 0), np.minimum(peak + window + 1, lengths))
+	for name, limit in [('c50', 0.05), ('c80', 0.08)]:
+		end = peak + np.round(limit * fs).astype(int)
+		params[name] = np.where(end < lengths, _energyRatioDb(cumulativeEnergy, np.zeros_like(peak), end), np.nan)
+
+	return [{name: (None if not np.isfinite(params[name][i]) else float(params[name][i])) for name in Parameters}
+		for i in range(len(signals))]
+
+
+def analyzeFiles(filenames):
+	"""Read and analyze a batch of RIR files (runs in the worker processes)"""
+	signals, rates = [], []
+	for filename in filenames:
+		x, fs = audioFormats.read(filename, dtype='float64')
+		if x.ndim > 1: # multichannel RIRs are analyzed with their first channel
+			x = x[:, 0]
+		signals.append(x)
+		rates.append(fs)
+	return analyze(signals, rates)
+
+
+def main(dbFilename, jobs=1, force=False):
+	rirDb = database.openDb(dbFilename)
+	cacheFilename = os.path.splitext(dbFilename)[0] + '.acoustics.json'
+	cache = {}
+	if os.path.isfile(cacheFilename) and not force:
+		with open(cacheFilename) as f:
+			data = json.load(f)
+		if data.get('version') == CacheVersion:
+			cache = data['rirs']
+
+	rirs = list(rirDb.values())
+	pool = Pool(jobs) if jobs > 1 else None
+	mapF = partial(pool.imap, chunksize=16) if pool else map
+	try:
+		hashes = list(mapF(util.fileChecksum, [rir['filename'] for rir in rirs]))
+
+		todo = {}
+		for rir, contentHash in zip(rirs, hashes):
+			if contentHash not in cache:
+				todo[contentHash] = rir['filename']
+		todo = list(todo.items())
+		batches = [todo[i:i + BatchSize] for i in range(0, len(todo), BatchSize)]
+
+		bar = util.ConsoleProgressBar()
+		bar.start('Analyze RIRs', len(todo), 'RIRs')
+		done = 0
+		for batch, results in zip(batches, mapF(analyzeFiles, [[filename for _, filename in batch] for batch in batches])):
+			for (contentHash, _), params in zip(batch, results):
+				cache[contentHash] = params
+			done += len(batch)
+			instrument.count('files_decoded', len(batch))
+			bar.progress(done / len(todo))
+		bar.end()
+	finally:
+		if pool:
+			pool.terminate()
+
+	for rir, contentHash in zip(rirs, hashes):
+		rir.update(cache[contentHash])
+		rirDb[rir['id']] = rir
+	rirDb.commit()
+
+	with util.atomicFile(cacheFilename) as tmpFilename, open(tmpFilename, 'w') as f:
+		json.dump({'version': CacheVersion, 'rirs': cache}, f, sort_keys=True, indent=4)
+	print('Analyzed {} of {} RIRs (the others were cached)'.format(len(todo), len(rirs)))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compute acoustic parameters (RT60, T20, T30, EDT, DRR, C50, C80) of all RIRs and store them in the database')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes (0: use all cores)')
+	parser.add_argument('-f', '--force', action='store_true', help='Ignore cached results')
+	instrument.addArguments(parser)
+	args = parser.parse_args()
+	with instrument.session(args, 'acoustics'):
+		main(args.database, args.jobs or os.cpu_count(), args.force)
@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import soundfile as sf
+import util
+
+"""
+Storage formats of the RIR files in wav.imported and wav.normalized.
+
+	filename = 'wav.normalized/air_0000_bi_booth' + audioFormats.extension('flac24')
+	audioFormats.write(filename, x, 16000, 'flac24')
+	x, fs = audioFormats.read('wav.normalized/air_0000_bi_booth.flac')
+
+wav and flac files are read and written with soundfile (FLAC is lossless, so flac16/flac24 have the resolution of
+wav16/wav24 in less space). float16 stores the samples as half precision floats in a .npz file together with the
+sampling rate (about 3 significant digits at any level, so unlike int16 the quiet end of the reverberation tail is not
+lost in quantization noise). read() decodes all of them, so code that reads RIRs does not have to know the format.
+"""
+
+# name -> (extension, soundfile subtype)
+Formats = {
+	'wav16': ('.wav', 'PCM_16'),
+	'wav24': ('.wav', 'PCM_24'),
+	'wavfloat': ('.wav', 'FLOAT'),
+	'flac16': ('.flac', 'PCM_16'),
+	'flac24': ('.flac', 'PCM_24'),
+	'float16': ('.npz', None),
+}
+DefaultFormat = 'wav16'
+Extensions = sorted(set(extension for extension, subtype in Formats.values()))
+
+def extension(format):
+	if format not in Formats:
+		raise ValueError('Unknown format {} (available: {})'.format(format, ', '.join(Formats)))
+	return Formats[format][0]
+
+
+def write(filename, x, fs, format=DefaultFormat):
+	"""Write the samples (1-D, or samples x channels); the filename has to have the extension of the format. The file is
+	written under a temporary name and renamed when it is complete."""
+	assert filename.endswith(extension(format)), '{} is not a {} file'.format(filename, format)
+	subtype = Formats[format][1]
+	with util.atomicFile(filename) as tmpFilename: # a killed run never leaves a truncated file behind
+		if subtype is None:
+			with open(tmpFilename, 'wb') as f: # np.savez would add .npz to a filename
+				np.savez(f, samples=np.asarray(x, dtype=np.float16), fs=fs)
+		else:
+			sf.write(tmpFilename, x, fs, subtype=subtype)
+
+
+def read(file, dtype='float32'):
+	"""Samples and sampling rate of a RIR file of any of the formats (file is a filename or a file object)"""
+	if isinstance(file, str) and file.endswith('.npz'):
+		with np.load(file) as data:
+			x = data['samples'].astype(np.float32)
+			fs = int(data['fs'])
+		if np.dtype(dtype) == np.int16:
+			return np.clip(np.round(x * 2**15), -2**15, 2**15 - 1).astype(np.int16), fs
+		return x.astype(dtype, copy=False), fs
+	return sf.read(file, dtype=dtype)
+
+
+def frames(filename):
+	"""Length of a RIR file in samples (without decoding it, except for .npz)"""
+	if filename.endswith('.npz'):
+		with np.load(filename) as data:
+			return len(data['samples'])
+	return sf.info(filename).frames
+
+
+def find(basename):
+	"""The existing file basename + any of the extensions, or None"""
+	for ext in Extensions:
+		if os.path.isfile(basename + ext):
+			return basename + ext
+	return None
@@ -0,0 +1,268 @@
+import os
+import time
+import random
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+import util
+import audioFormats
+import database
+import instrument
+
+"""
+Reverberation augmentation: convolve (speech) signals with RIRs of a list (lists/*.rirs).
+
+	augmenter = ReverbAugmenter('lists/train.rirs', fs=16000)
+	for reverberated, rirIds in augmenter.batches(speechSignals, batchSize=16, workers=4):
+		...
+
+The RIRs are taken from the normalized RIRs for the sampling rate fs (wav.normalized). A batch is convolved at once with
+overlap-add: all signals are cut into blocks of the same length, the blocks of all signals are transformed with one FFT
+call, multiplied with the spectra of the RIRs and transformed back. The RIR spectra are kept in an LRU cache per FFT size,
+so every RIR is only transformed once. batches() computes the batches in a thread pool (numpy releases the GIL in the
+FFT) and keeps a bounded number of batches prefetched.
+
+Multichannel RIRs result in multichannel signals (samples x channels). The reverberated signals have the length of the
+input signals unless tail=True, in which case the reverberation tail is kept.
+"""
+
+def nextPowerOf2(n):
+	return 1 << (int(n) - 1).bit_length()
+
+
+class SpectrumCache:
+	"""LRU cache for the spectra of the RIRs, keyed by the RIR id and the FFT size (thread-safe)"""
+	def __init__(self, maxBytes=1024**3):
+		self.maxBytes = maxBytes
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+
+	def get(self, rirId, nfft, loadF):
+		"""Spectrum (channels x nfft // 2 + 1, complex64) of a RIR; loadF(rirId) returns its samples if it is not cached"""
+		key = (rirId, nfft)
+		with self.lock:
+			H = self.entries.get(key)
+			if H is not None:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return H
+			self.misses += 1
+
+		H = rirSpectrum(loadF(rirId), nfft)
+
+		with self.lock:
+			if key not in self.entries:
+				self.entries[key] = H
+				self.size += H.nbytes
+			while self.size > self.maxBytes and len(self.entries) > 1:
+				_, evicted = self.entries.popitem(last=False)
+				self.size -= evicted.nbytes
+		return H
+
+
+def fftSize(rirLength):
+	"""FFT size for overlap-add with RIRs up to rirLength samples (blocks of at least rirLength samples)"""
+	return nextPowerOf2(2 * rirLength)
+
+
+def rirSpectrum(h, nfft):
+	"""Spectrum of a RIR (1-D, or samples x channels) as channels x (nfft // 2 + 1) array"""
+	return np.fft.rfft(h.reshape(len(h), -1).T, n=nfft).astype(np.complex64)
+
+
+def convolveBatch(signals, spectra, rirLengths, nfft, *, tail=False):
+	"""Convolve every 1-D signal with its RIR (given by its spectrum, see rirSpectrum, and length) with overlap-add"""
+	lengths = np.array([len(x) for x in signals])
+	block = nfft - max(rirLengths) + 1
+
+	# blocks of all signals, transformed at once
+	blocks = -(-lengths.max() // block)
+	X = np.zeros((len(signals), blocks * block), dtype=np.float32)
+	for i, x in enumerate(signals):
+		X[i, :len(x)] = x
+	X = np.fft.rfft(X.reshape(len(signals), blocks, block), n=nfft)
+
+	# one row per channel of the RIRs
+	channels = np.array([len(H) for H in spectra])
+	rows = np.repeat(np.arange(len(signals)), channels)
+	y = np.fft.irfft(X[rows] * np.concatenate(spectra)[:, None, :], n=nfft)
+
+	out = np.zeros((len(rows), blocks * block + nfft - block), dtype=np.float32)
+	for j in range(blocks):
+		out[:, j * block:j * block + nfft] += y[:, j]
+
+	results = []
+	first = 0
+	for n, m, c in zip(lengths, rirLengths, channels):
+		y = out[first:first + c, :n + m - 1 if tail else n].T
+		results.append(y[:, 0].copy() if c == 1 else y.copy())
+		first += c
+	return results
+
+
+def convolve(signals, rirs, *, tail=False):
+	"""Convolve every signal of a list with the RIR at the same position (without caching the spectra)"""
+	rirLengths = [len(h) for h in rirs]
+	nfft = fftSize(max(rirLengths))
+	return convolveBatch(signals, [rirSpectrum(h, nfft) for h in rirs], rirLengths, nfft, tail=tail)
+
+
+def rirFilename(rir, fs):
+	"""Filename of the RIR normalized to fs"""
+	normalized = rir.get('normalized', {}).get(str(fs))
+	if normalized is not None:
+		return normalized['filename']
+	if rir['fs'] != fs:
+		raise RuntimeError('RIR {} is not normalized to {} Hz (run normalize.py -fs {})'.format(rir['id'], fs, fs))
+	return rir['filename']
+
+
+class ReverbAugmenter:
+	def __init__(self, listFilename, dbFilename='db.json', fs=16000, seed=None, cacheBytes=1024**3, tail=False):
+		with open(listFilename) as f:
+			self.rirIds = [line.strip() for line in f if line.strip()]
+		rirDb = database.openDb(dbFilename)
+		self.filenames = {rirId: rirFilename(rirDb[rirId], fs) for rirId in self.rirIds}
+		self.lengths = {}
+		self.fs = fs
+		self.tail = tail
+		self.cache = SpectrumCache(cacheBytes)
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.samples = 0
+		self.seconds = 0.0
+
+
+	def _load(self, rirId):
+		h, fs = audioFormats.read(self.filenames[rirId], dtype='float32')
+		assert fs == self.fs, 'Sampling rate of {} is {} Hz, not {} Hz'.format(rirId, fs, self.fs)
+		self.lengths[rirId] = len(h)
+		return h
+
+
+	def _length(self, rirId):
+		if rirId not in self.lengths:
+			self.lengths[rirId] = audioFormats.frames(self.filenames[rirId])
+		return self.lengths[rirId]
+
+
+	def chooseRirs(self, n):
+		with self.lock:
+			return [self.random.choice(self.rirIds) for _ in range(n)]
+
+
+	def reverberate(self, signals, rirIds=None):
+		"""Convolve a batch of signals with random RIRs of the list (or the given ones). Returns the signals and the RIR ids"""
+		if rirIds is None:
+			rirIds = self.chooseRirs(len(signals))
+		start = time.perf_counter()
+		rirLengths = [self._length(rirId) for rirId in rirIds]
+		nfft = fftSize(max(rirLengths))
+		spectra = [self.cache.get(rirId, nfft, self._load) for rirId in rirIds]
+		results = convolveBatch(signals, spectra, rirLengths, nfft, tail=self.tail)
+		with self.lock:
+			self.samples += sum(len(x) for x in signals)
+			self.seconds += time.perf_counter() - start
+		return results, rirIds
+
+
+	def batches(self, signals, batchSize=16, workers=4, prefetch=8):
+		"""Yields (reverberated signals, RIR ids) for batches of the signals (any iterable, e.g. a generator reading files).
+
+		The batches are computed by a pool of worker threads, at most prefetch batches ahead of the consumer. The batches are
+		returned in the order of the signals.
+		"""
+		signals = iter(signals)
+		def nextBatch():
+			batch = [x for _, x in zip(range(batchSize), signals)]
+			return batch, self.chooseRirs(len(batch))
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			pending = deque()
+			while True:
+				while len(pending) < prefetch:
+					batch, rirIds = nextBatch()
+					if not batch:
+						break
+					pending.append(executor.submit(self.reverberate, batch, rirIds))
+				if not pending:
+					break
+				yield pending.popleft().result()
+
+
+	def samplesPerSecond(self):
+		"""Input samples processed per second of computation time (summed over all workers)"""
+		return self.samples / self.seconds if self.seconds else 0.0
+
+
+def readSignals(directory, fs):
+	"""Yields the signals of all wav files in a directory (must have the sampling rate fs)"""
+	for filename in sorted(os.listdir(directory)):
+		if filename.endswith('.wav'):
+			x, fs_x = sf.read(os.path.join(directory, filename), dtype='float32')
+			assert fs_x == fs, '{} has {} Hz, not {} Hz'.format(filename, fs_x, fs)
+			yield x if x.ndim == 1 else x[:, 0]
+
+
+def main(listFilename, dbFilename='db.json', fs=16000, speechDir=None, outDir=None, count=256, seconds=4.0,
+		batchSize=16, workers=4, prefetch=8, seed=None, tail=False):
+	"""Reverberate the wav files of speechDir (or count noise signals of the given length) and report the throughput"""
+	augmenter = ReverbAugmenter(listFilename, dbFilename, fs, seed=seed, tail=tail)
+	if speechDir:
+		signals = readSignals(speechDir, fs)
+		total = len([f for f in os.listdir(speechDir) if f.endswith('.wav')])
+	else:
+		rng = np.random.RandomState(0)
+		signals = (rng.randn(int(seconds * fs)).astype(np.float32) for _ in range(count))
+		total = count
+	if outDir:
+		util.createDirectory(outDir)
+
+	done = 0
+	samples = 0
+	start = time.perf_counter()
+	bar = util.ConsoleProgressBar()
+	bar.start('Reverberate', total, 'signals')
+	for reverberated, rirIds in augmenter.batches(signals, batchSize, workers, prefetch):
+		for y, rirId in zip(reverberated, rirIds):
+			if outDir:
+				with util.atomicFile(os.path.join(outDir, '{:06d}_{}.wav'.format(done, rirId))) as tmpFilename:
+					sf.write(tmpFilename, y, fs, subtype='FLOAT')
+			samples += len(y)
+			done += 1
+		bar.progress(done / max(total, 1))
+	bar.end()
+	elapsed = time.perf_counter() - start
+
+	print('{} signals, {:.1f} s of audio in {:.2f} s'.format(done, samples / fs, elapsed))
+	print('Throughput: {:.0f} samples/s ({:.1f} x real time), per worker: {:.0f} samples/s'.format(
+		samples / elapsed, samples / fs / elapsed, augmenter.samplesPerSecond()))
+	print('RIR spectrum cache: {} hits, {} misses, {:.1f} MB'.format(augmenter.cache.hits, augmenter.cache.misses, augmenter.cache.size / 1024**2))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convolve signals with the RIRs of a list and report the throughput (samples/s)')
+	parser.add_argument('-l', '--list', type=str, default='lists/train.rirs', help='List of RIRs (.rirs file)')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Sampling rate, the RIRs have to be normalized to it')
+	parser.add_argument('--speech', type=str, help='Directory with wav files to reverberate (default: white noise signals)')
+	parser.add_argument('-o', '--output', type=str, help='Write the reverberated signals to this directory')
+	parser.add_argument('-n', '--count', type=int, default=256, help='Number of noise signals if no speech directory is given')
+	parser.add_argument('-s', '--seconds', type=float, default=4.0, help='Length of the noise signals in seconds')
+	parser.add_argument('-b', '--batchSize', type=int, default=16)
+	parser.add_argument('-j', '--workers', type=int, default=4, help='Number of worker threads (0: number of cores)')
+	parser.add_argument('--prefetch', type=int, default=8, help='Maximum number of batches computed ahead')
+	parser.add_argument('--seed', type=int, help='Seed for the choice of the RIRs')
+	parser.add_argument('--tail', action='store_true', help='Keep the reverberation tail instead of cutting the signals to their original length')
+	instrument.addArguments(parser)
+	args = parser.parse_args()
+	with instrument.session(args, 'augment'):
+		main(args.list, args.database, args.samplingrate, args.speech, args.output, args.count, args.seconds,
+			args.batchSize, args.workers or os.cpu_count(), args.prefetch, args.seed, args.tail)
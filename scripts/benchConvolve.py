@@ -0,0 +1,105 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import audioFormats
+import database
+import augment
+import spectrumBank
+from benchResample import syntheticRirs
+
+"""
+Throughput of the convolution of signals with RIRs (one thread):
+
+- time domain: numpy.convolve per signal (only for the first --timeDomainSignals signals, it is slow for long RIRs)
+- FFT per call: augment.convolve, which transforms the RIRs of every batch again (overlap-add with one FFT size per batch)
+- spectrum bank B=<block size>: SpectrumBank.convolve with the precomputed partition spectra (uniformly partitioned
+  overlap-save), read from a bank in a temporary directory
+
+Uses the RIRs of a database normalized to fs, or synthetic RIRs. The signals are white noise; the RIRs are assigned to the
+signals in turn. The error is the maximum absolute difference to the time domain result on the signals computed with it.
+Reported is the minimum time of --repetitions runs (the time domain convolution runs once).
+"""
+
+def main(dbFilename=None, fs=16000, count=50, maxRirs=200, signals=64, seconds=4.0, batchSize=16, blockSizes=[128, 512, 2048],
+		timeDomainSignals=8, tmpDir=None, repetitions=3):
+	if dbFilename:
+		rirDb = database.openDb(dbFilename)
+		rirs = [audioFormats.read(augment.rirFilename(rirDb[rirId], fs), dtype='float32')[0] for rirId in sorted(rirDb.keys())[:maxRirs]]
+	else:
+		rirs = [x / np.abs(x).max() for x, _ in syntheticRirs(count, fs)]
+	rirIds = ['{:05d}'.format(i) for i in range(len(rirs))]
+	rng = np.random.default_rng(0)
+	xs = [rng.standard_normal(int(seconds * fs)).astype(np.float32) for _ in range(signals)]
+	assigned = [i % len(rirs) for i in range(signals)]
+	batches = [range(start, min(start + batchSize, signals)) for start in range(0, signals, batchSize)]
+	print('{} RIRs ({:.2f} s on average), {} signals of {:.1f} s at {} Hz, batches of {}'.format(len(rirs),
+		np.mean([len(h) for h in rirs]) / fs, signals, seconds, fs, batchSize))
+
+	reference = {}
+	def timeDomain(batch):
+		results = []
+		for i in batch:
+			h = rirs[assigned[i]]
+			y = np.stack([np.convolve(xs[i], h[:, c])[:len(xs[i])] for c in range(h.shape[1])], axis=1) if h.ndim > 1 else np.convolve(xs[i], h)[:len(xs[i])]
+			reference[i] = y
+			results.append(y)
+		return results
+
+	def fftPerCall(batch):
+		return augment.convolve([xs[i] for i in batch], [rirs[assigned[i]] for i in batch])
+
+	directory = tempfile.mkdtemp(dir=tmpDir)
+	try:
+		filenames = [os.path.join(directory, 'bench.b{}.spectra'.format(blockSize)) for blockSize in blockSizes]
+		spectrumBank.writeBanks(filenames, blockSizes, ((rirId, h, fs) for rirId, h in zip(rirIds, rirs)))
+		samplesSize = sum(h.nbytes for h in rirs)
+		methods = [('time domain', timeDomain, [range(min(timeDomainSignals, signals))], samplesSize), ('FFT per call', fftPerCall, batches, samplesSize)]
+		for blockSize, filename in zip(blockSizes, filenames):
+			bank = spectrumBank.SpectrumBank(filename)
+			convolve = lambda batch, bank=bank: bank.convolve([xs[i] for i in batch], [rirIds[assigned[i]] for i in batch])
+			methods.append(('spectrum bank B={}'.format(blockSize), convolve, batches, os.path.getsize(filename)))
+
+		print('{:22s} {:>10s} {:>22s} {:>12s} {:>12s} {:>10s} {:>10s}'.format('method', 'time (s)', 'throughput (M samples/s)', 'x real time',
+			'max error', 'RIRs (MB)', 'speedup'))
+		fftThroughput = None
+		for name, convolve, methodBatches, size in methods:
+			error = 0.0
+			elapsed = []
+			for repetition in range(1 if convolve is timeDomain else repetitions): # the minimum time of the repetitions
+				samples = 0
+				start = time.perf_counter()
+				for batch in methodBatches:
+					for i, y in zip(batch, convolve(batch)):
+						samples += len(xs[i])
+						if i in reference and convolve is not timeDomain:
+							error = max(error, float(np.abs(y - reference[i]).max()))
+				elapsed.append(time.perf_counter() - start)
+			throughput = samples / min(elapsed)
+			if convolve is fftPerCall:
+				fftThroughput = throughput
+			print('{:22s} {:10.2f} {:22.2f} {:12.0f} {:12.2e} {:10.1f} {:>10s}'.format(name, min(elapsed), throughput / 1e6, throughput / fs,
+				error, size / 1024**2, '{:.2f}x'.format(throughput / fftThroughput) if fftThroughput else ''))
+	finally:
+		shutil.rmtree(directory)
+	print('RIRs (MB): float32 samples, or the size of the spectrum bank; speedup: throughput relative to FFT per call')
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare the throughput of time domain, per call FFT and spectrum bank convolution')
+	parser.add_argument('-db', '--database', type=str, help='Use the RIRs of this database instead of synthetic ones')
+	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Sampling rate, the RIRs of the database have to be normalized to it')
+	parser.add_argument('-n', '--count', type=int, default=50, help='Number of synthetic RIRs')
+	parser.add_argument('--maxRirs', type=int, default=200, help='Maximum number of RIRs taken from the database')
+	parser.add_argument('--signals', type=int, default=64, help='Number of signals')
+	parser.add_argument('-s', '--seconds', type=float, default=4.0, help='Length of the signals in seconds')
+	parser.add_argument('-b', '--batchSize', type=int, default=16)
+	parser.add_argument('--blockSizes', type=str, default='128,512,2048', help='Comma separated list of block sizes of the spectrum banks')
+	parser.add_argument('--timeDomainSignals', type=int, default=8, help='Number of signals convolved in the time domain (the reference for the error)')
+	parser.add_argument('--tmpDir', type=str, help='Directory for the banks (default: the system temp directory)')
+	parser.add_argument('-r', '--repetitions', type=int, default=3, help='The minimum time of this many runs is reported')
+	args = parser.parse_args()
+	main(args.database, args.samplingrate, args.count, args.maxRirs, args.signals, args.seconds, args.batchSize,
+		[int(b) for b in args.blockSizes.split(',')], args.timeDomainSignals, args.tmpDir, args.repetitions)
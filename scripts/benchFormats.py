@@ -0,0 +1,70 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import audioFormats
+import database
+from benchResample import syntheticRirs
+
+"""
+Comparison of the storage formats (see audioFormats): disk size, encode time, decode throughput and the error of the
+stored samples. Uses the RIRs of a database (rir['filename'], i.e. the normalized RIRs after normalize.py) or synthetic
+RIRs. The files are written to a temporary directory, use --tmpDir to measure on the file system that stores the RIRs
+(e.g. NFS); the decode time then includes reading the files, but they are likely in the page cache.
+"""
+
+def snr(x, y):
+	"""SNR of the stored samples y relative to the original ones x in dB (inf for lossless)"""
+	error = np.sum((y.astype(np.float64) - x)**2)
+	if error == 0:
+		return float('inf')
+	return 10 * np.log10(np.sum(x.astype(np.float64)**2) / error)
+
+
+def main(dbFilename=None, count=50, maxRirs=200, formats=list(audioFormats.Formats), tmpDir=None):
+	if dbFilename:
+		rirDb = database.openDb(dbFilename)
+		rirs = [audioFormats.read(rirDb[rirId]['filename'], dtype='float32') for rirId in sorted(rirDb.keys())[:maxRirs]]
+	else:
+		rirs = [(x / np.abs(x).max(), fs) for x, fs in syntheticRirs(count)]
+	samples = sum(x.size for x, fs in rirs)
+	print('{} RIRs, {:.1f} M samples'.format(len(rirs), samples / 1e6))
+
+	directory = tempfile.mkdtemp(dir=tmpDir)
+	try:
+		print('{:10s} {:>10s} {:>7s} {:>10s} {:>20s} {:>10s}'.format('format', 'size (MB)', 'ratio', 'encode (s)', 'decode (M samples/s)', 'SNR'))
+		reference = None
+		for format in formats:
+			filenames = [os.path.join(directory, '{:05d}{}'.format(i, audioFormats.extension(format))) for i in range(len(rirs))]
+			start = time.perf_counter()
+			for filename, (x, fs) in zip(filenames, rirs):
+				audioFormats.write(filename, x, fs, format)
+			encodeTime = time.perf_counter() - start
+			size = sum(os.path.getsize(filename) for filename in filenames)
+			reference = reference or size
+
+			start = time.perf_counter()
+			decoded = [audioFormats.read(filename, dtype='float32')[0] for filename in filenames]
+			decodeTime = time.perf_counter() - start
+
+			quality = np.median([snr(x, y) for (x, fs), y in zip(rirs, decoded)])
+			print('{:10s} {:10.2f} {:7.2f} {:10.2f} {:20.1f} {:>10s}'.format(format, size / 1024**2, size / reference, encodeTime,
+				samples / decodeTime / 1e6, 'lossless' if quality == float('inf') else '{:.1f} dB'.format(quality)))
+			for filename in filenames:
+				os.remove(filename)
+	finally:
+		shutil.rmtree(directory)
+	print('ratio: size relative to {}; SNR: median over the RIRs, relative to the float32 samples'.format(formats[0]))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare the storage formats of the RIRs (size, encode time, decode throughput, error)')
+	parser.add_argument('-db', '--database', type=str, help='Use the RIRs of this database instead of synthetic ones')
+	parser.add_argument('-n', '--count', type=int, default=50, help='Number of synthetic RIRs')
+	parser.add_argument('--maxRirs', type=int, default=200, help='Maximum number of RIRs taken from the database')
+	parser.add_argument('--formats', type=str, default=','.join(audioFormats.Formats), help='Comma separated list of the formats to compare')
+	parser.add_argument('--tmpDir', type=str, help='Directory for the test files (default: the system temp directory)')
+	args = parser.parse_args()
+	main(args.database, args.count, args.maxRirs, args.formats.split(','), args.tmpDir)
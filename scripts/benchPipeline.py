@@ -0,0 +1,273 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tarfile
+import zipfile
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import numpy as np
+import soundfile as sf
+
+"""
+End-to-end benchmark of the pipeline (createDb, normalize, splitIntoSets) on synthetic corpora.
+
+For every source an archive with the layout of the original is generated (ACE *_RIR.wav trees, AIR .mat files with h_air
+and air_info, MARDY ir_<distance>_<position>_<mic>.wav, OMNI zips, RWCP raw float files imp<no>.<mic>) and served by a
+local HTTP server; the importers download from it instead of the original sites. rar archives cannot be created here, so
+the MARDY files are put into the extracted folder (download/mardy), next to a dummy download/mardy.rar and the marker
+of a completed extraction (see util.FileDownloader.unpackTo), so createDb neither downloads nor extracts it.
+
+Every stage runs in its own process, so the peak RSS (of the process and its workers) can be measured per stage. The
+results (wall time, peak RSS, files/s) are appended to a JSON history file and compared with the last run that used the
+same configuration.
+"""
+
+HistoryFilename = 'benchPipeline.history.json'
+Sources = ['ace', 'air', 'mardy', 'omni', 'rwcp']
+AceRooms = ['Building_Lobby', 'Lecture_1', 'Meeting_1', 'Office_1']
+AirBinauralRooms = ['booth', 'office', 'meeting', 'lecture', 'stairway']
+AirPhoneRooms = ['office', 'meeting', 'lecture']
+OmniRooms = ['greathall', 'octagon', 'classroom']
+RwcpRooms = ['e1a', 'e1b', 'e2a', 'e2b']
+RwcpMicrophones = 8
+Regression = 1.2 # a stage is reported as regression if it is this much slower than in the last comparable run
+MinRegressionSeconds = 0.1 # ... and at least this much slower (timing noise of very short stages)
+
+class Corpus:
+	"""Writes synthetic RIRs in the formats of the sources"""
+	def __init__(self, seconds, seed=0):
+		self.seconds = seconds
+		self.rng = np.random.default_rng(seed)
+
+
+	def rir(self, fs):
+		n = int(self.seconds * fs)
+		x = self.rng.standard_normal(n) * np.exp(-np.arange(n) / (fs * self.rng.uniform(0.05, 0.3)))
+		x[:int(self.rng.uniform(0.001, 0.01) * fs)] = 0
+		return (x / np.abs(x).max()).astype(np.float32)
+
+
+	def wav(self, fs):
+		f = io.BytesIO()
+		sf.write(f, self.rir(fs), fs, format='WAV')
+		return f.getvalue()
+
+
+	def mat(self, fs, **info):
+		import scipy.io
+		f = io.BytesIO()
+		scipy.io.savemat(f, {'h_air': self.rir(fs)[None, :].astype(np.float64), 'air_info': dict(fs=fs, **info)})
+		return f.getvalue()
+
+
+def _addToTar(archive, name, data):
+	info = tarfile.TarInfo(name)
+	info.size = len(data)
+	info.mtime = 1
+	archive.addfile(info, io.BytesIO(data))
+
+
+def generateCorpora(serveDir, downloadDir, scale=1, seconds=0.5, seed=0):
+	"""Write the archives of all sources to serveDir (named like the original downloads) and the MARDY archive and files
+	to downloadDir.
+	Returns the number of RIRs that createDb imports (one per measurement)"""
+	from onlinedbs import Air
+	corpus = Corpus(seconds, seed)
+	os.makedirs(serveDir, exist_ok=True)
+	count = 0
+
+	with tarfile.open(os.path.join(serveDir, 'ACE_Corpus_RIRN_Single.tbz2'), 'w:bz2') as archive:
+		for room in AceRooms:
+			for m in range(1, 2 * scale + 1):
+				prefix = 'ACE_Corpus_RIRN_Single/Single/{0}/{1}/Single_{0}_{1}'.format(room, m)
+				_addToTar(archive, prefix + '_RIR.wav', corpus.wav(48000))
+				_addToTar(archive, prefix + '_RIR_Noise.wav', corpus.wav(48000))
+				count += 1
+
+	with zipfile.ZipFile(os.path.join(serveDir, 'air_database_release_1_4.zip'), 'w') as archive:
+		for room in AirBinauralRooms:
+			azimuths = [str(a) for a in range(0, 181, 15)][:scale] if room == 'stairway' else ['']
+			for rirNo in range(1, len(Air.Distances[room]) + 1):
+				for azimuth in azimuths:
+					for channel in [0, 1]:
+						name = 'AIR_1_4/air_binaural_{}_{}_1_{}{}.mat'.format(room, channel, rirNo, '_' + azimuth if azimuth else '')
+						archive.writestr(name, corpus.mat(48000, room=room, channel=channel, head=1))
+						count += 1
+		for room in AirPhoneRooms:
+			for position in ['hhp', 'hfrp']:
+				for channel in [0, 1]:
+					name = 'AIR_1_4/air_phone_{}_{}_{}.mat'.format(room, position, channel)
+					archive.writestr(name, corpus.mat(48000, room=room, channel=channel, head=0, phone_pos=position))
+					count += 1
+
+	# the marker has to match the archive in the download cache, a downloaded copy would have another mtime
+	os.makedirs(downloadDir, exist_ok=True)
+	archiveFilename = os.path.join(downloadDir, 'mardy.rar')
+	open(archiveFilename, 'wb').write(b'Rar!')
+	st = os.stat(archiveFilename)
+	with open(os.path.join(downloadDir, 'mardy.extracted'), 'w') as f:
+		json.dump({'archive': os.path.basename(archiveFilename), 'size': st.st_size, 'mtime': int(st.st_mtime)}, f)
+	mardyDir = os.path.join(downloadDir, 'mardy')
+	os.makedirs(mardyDir, exist_ok=True)
+	for distance in [1, 2, 3]:
+		for position in 'LCR':
+			for mic in range(1, 9):
+				sf.write(os.path.join(mardyDir, 'ir_{}_{}_{}.wav'.format(distance, position, mic)), corpus.rir(48000), 48000)
+			count += 1
+
+	for room in OmniRooms:
+		with zipfile.ZipFile(os.path.join(serveDir, '{}Omni.zip'.format(room)), 'w') as archive:
+			for x in range(2 * scale):
+				for y in range(2):
+					archive.writestr('Omni/x{:02d}y{:02d}.wav'.format(x, y), corpus.wav(96000))
+					count += 1
+
+	with tarfile.open(os.path.join(serveDir, 'RWCP.tar.gz'), 'w:gz') as archive:
+		for room in RwcpRooms:
+			for imp in range(2 * scale):
+				for mic in range(1, RwcpMicrophones + 1):
+					name = 'RWCP/micarray/MICARRAY/data1/circle/{}/imp{:03d}.{}'.format(room, 100 + 10 * imp, mic)
+					_addToTar(archive, name, corpus.rir(48000).astype('<f4').tobytes())
+				count += 1
+	return count
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+
+def serve(directory):
+	"""Serve a directory on a free local port in a background thread, returns the server"""
+	server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+def mirror(baseUrl):
+	"""Let the importers download from baseUrl (a file with the same name as on the original site)"""
+	import createDb
+	for name in createDb.Importers:
+		importer = createDb.loadImporter(name)
+		importer.Url = baseUrl + '/' + importer.Url.rsplit('/', 1)[1]
+
+
+def _runStage(stage, workDir, baseUrl, config, queue):
+	"""Runs in a new process: execute the stage and report its wall time and peak RSS"""
+	os.chdir(workDir)
+	sys.stdout = open(os.devnull, 'w')
+	start = time.perf_counter()
+	if stage == 'createDb':
+		import createDb
+		mirror(baseUrl)
+		createDb.main(config['db'], deleteBefore=True, sources=Sources, parallelDownloads=config['parallelDownloads'],
+			stream=config['stream'], incremental=False)
+	elif stage == 'normalize':
+		import normalize
+		normalize.main(config['db'], [config['fs']], force=True, jobs=config['jobs'])
+	elif stage == 'split':
+		import splitIntoSets
+		splitIntoSets.createLists(config['db'])
+	wallTime = time.perf_counter() - start
+
+	import database
+	files = len(database.openDb(config['db']))
+	# ru_maxrss is in KB on Linux; the workers of normalize are children of this process
+	peakRss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+	queue.put({'wallTime': wallTime, 'peakRssMB': peakRss / 1024, 'files': files, 'filesPerSecond': files / wallTime})
+
+
+def runStage(stage, workDir, baseUrl, config):
+	context = multiprocessing.get_context('spawn') # a clean process, so the RSS of the benchmark itself is not counted
+	queue = context.Queue()
+	process = context.Process(target=_runStage, args=(stage, workDir, baseUrl, config, queue))
+	process.start()
+	process.join()
+	if process.exitcode != 0:
+		raise RuntimeError('Stage {} failed (exit code {})'.format(stage, process.exitcode))
+	return queue.get()
+
+
+def compare(history, record):
+	"""Print the change to the last run with the same configuration. Returns the stages that got slower"""
+	previous = [r for r in history if r['config'] == record['config']]
+	if not previous:
+		print('No previous run with the same configuration')
+		return []
+	regressions = []
+	for stage, result in record['stages'].items():
+		before = previous[-1]['stages'].get(stage)
+		if before is None:
+			continue
+		ratio = result['wallTime'] / before['wallTime']
+		print('{:10s} {:6.2f} x wall time, {:6.2f} x peak RSS compared to {}'.format(stage, ratio,
+			result['peakRssMB'] / before['peakRssMB'], previous[-1]['date']))
+		if ratio > Regression and result['wallTime'] - before['wallTime'] > MinRegressionSeconds:
+			regressions.append(stage)
+	return regressions
+
+
+def main(scale=1, seconds=0.5, fs=16000, jobs=1, parallelDownloads=1, stream=False, dbFilename='db.json',
+		historyFilename=HistoryFilename, keep=False):
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))) # for the spawned stage processes
+	config = {'scale': scale, 'seconds': seconds, 'fs': fs, 'jobs': jobs, 'parallelDownloads': parallelDownloads,
+		'stream': stream, 'db': dbFilename}
+	workDir = tempfile.mkdtemp(prefix='benchPipeline.')
+	server = None
+	try:
+		print('Generate synthetic corpora in {}'.format(workDir))
+		count = generateCorpora(os.path.join(workDir, 'serve'), os.path.join(workDir, 'download'), scale, seconds)
+		server = serve(os.path.join(workDir, 'serve'))
+		baseUrl = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+		record = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': config, 'rirs': count, 'cpus': os.cpu_count(), 'stages': {}}
+		print('{:10s} {:>10s} {:>12s} {:>8s} {:>10s}'.format('stage', 'wall time', 'peak RSS', 'files', 'files/s'))
+		for stage in ['createDb', 'normalize', 'split']:
+			result = runStage(stage, workDir, baseUrl, config)
+			record['stages'][stage] = result
+			print('{:10s} {:8.2f} s {:9.1f} MB {:8d} {:10.1f}'.format(stage, result['wallTime'], result['peakRssMB'],
+				result['files'], result['filesPerSecond']))
+	finally:
+		if server:
+			server.shutdown()
+		if not keep:
+			shutil.rmtree(workDir, ignore_errors=True)
+
+	history = []
+	if os.path.isfile(historyFilename):
+		with open(historyFilename) as f:
+			history = json.load(f)
+	regressions = compare(history, record)
+	if regressions:
+		print('Regression: {} took more than {:.0f} % longer than in the last run'.format(', '.join(regressions), 100 * (Regression - 1)))
+	history.append(record)
+	with open(historyFilename, 'w') as f:
+		json.dump(history, f, indent=4)
+	return regressions
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark createDb, normalize and splitIntoSets on synthetic corpora served from a local HTTP server')
+	parser.add_argument('--scale', type=int, default=1, help='Size of the synthetic corpora (number of measurements per room)')
+	parser.add_argument('--seconds', type=float, default=0.5, help='Length of the synthetic RIRs in seconds')
+	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Target sampling rate of normalize')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes of normalize (0: use all cores)')
+	parser.add_argument('--parallelDownloads', type=int, default=1)
+	parser.add_argument('--stream', action='store_true', help='Import directly from the archives')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file name (.json or .sqlite) in the work directory')
+	parser.add_argument('--history', type=str, default=HistoryFilename, help='JSON file the results are appended to')
+	parser.add_argument('--keep', action='store_true', help='Do not delete the work directory')
+	parser.add_argument('--failOnRegression', action='store_true', help='Exit with an error if a stage got slower')
+	args = parser.parse_args()
+	regressions = main(args.scale, args.seconds, args.samplingrate, args.jobs or os.cpu_count(), args.parallelDownloads,
+		args.stream, args.database, args.history, args.keep)
+	if regressions and args.failOnRegression:
+		sys.exit(1)
@@ -0,0 +1,72 @@
+import os
+import time
+import argparse
+import numpy as np
+import audioFormats
+import resamplers
+import database
+
+"""
+Benchmark of the resampler backends and quality tiers: throughput and reconstruction error.
+
+The error is measured with a round trip: every RIR is resampled to the target rate and back to its original rate. The
+content above the target Nyquist frequency is lost in any case, so the SNR only considers the band below 90 % of it.
+Uses the imported RIRs of a database (with their original sampling rate) or synthetic RIRs at 48 kHz.
+"""
+
+ImportDir = 'wav.imported'
+
+def syntheticRirs(count, fs=48000, seed=0):
+	rng = np.random.default_rng(seed)
+	rirs = []
+	for i in range(count):
+		length = int(fs * rng.uniform(0.2, 1))
+		x = rng.standard_normal(length) * np.exp(-np.arange(length) / (fs * rng.uniform(0.05, 0.3)))
+		rirs.append((x.astype(np.float32), fs))
+	return rirs
+
+
+def roundTripSnr(x, y, fs, targetFs):
+	n = min(len(x), len(y))
+	X = np.fft.rfft(x[:n])
+	E = np.fft.rfft(y[:n] - x[:n])
+	band = np.fft.rfftfreq(n, 1 / fs) < 0.9 * targetFs / 2
+	return 10 * np.log10(np.sum(np.abs(X[band])**2) / max(np.sum(np.abs(E[band])**2), 1e-30))
+
+
+def main(dbFilename=None, count=50, targetFs=16000, maxRirs=200):
+	if dbFilename:
+		rirDb = database.openDb(dbFilename)
+		rirs = [audioFormats.read(audioFormats.find(os.path.join(ImportDir, rirId)), dtype='float32') for rirId in sorted(rirDb.keys())[:maxRirs]]
+	else:
+		rirs = syntheticRirs(count)
+	rirs = [(x, fs) for x, fs in rirs if fs != targetFs]
+	samples = sum(len(x) for x, fs in rirs)
+	print('{} RIRs, {:.1f} M samples, target rate {} Hz'.format(len(rirs), samples / 1e6, targetFs))
+
+	print('{:14s} {:7s} {:>12s} {:>14s}'.format('backend', 'quality', 'M samples/s', 'round trip SNR'))
+	for backend in resamplers.Backends:
+		for quality in resamplers.Qualities:
+			try:
+				resamplers.resample(rirs[0][0][:1000], rirs[0][1], targetFs, backend, quality) # imports the backend
+				start = time.perf_counter()
+				resampled = [resamplers.resample(x, fs, targetFs, backend, quality) for x, fs in rirs]
+				t = time.perf_counter() - start
+			except ImportError as e:
+				print('{:14s} {:7s} not available ({})'.format(backend, quality, e))
+				break
+			snr = np.median([roundTripSnr(x, resamplers.resample(y, targetFs, fs, backend, quality), fs, targetFs)
+				for (x, fs), y in zip(rirs, resampled)])
+			print('{:14s} {:7s} {:12.2f} {:11.1f} dB'.format(backend, quality if backend != 'fft' else '-', samples / t / 1e6, snr))
+			if backend == 'fft':
+				break # fft has no quality tiers
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the resampler backends (throughput and reconstruction error)')
+	parser.add_argument('-db', '--database', type=str, help='Use the imported RIRs of this database instead of synthetic ones')
+	parser.add_argument('-n', '--count', type=int, default=50, help='Number of synthetic RIRs')
+	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Target sampling rate in Hz')
+	parser.add_argument('--maxRirs', type=int, default=200, help='Maximum number of RIRs taken from the database')
+	args = parser.parse_args()
+	main(args.database, args.count, args.samplingrate, args.maxRirs)
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from rirdb import Commands
+
+"""
+Cold start time of the rirdb subcommands: every subcommand is started with --help in a new interpreter (so nothing is
+done but importing and parsing the arguments). Reports the median wall time, the time spent importing modules (python
+-X importtime) and the modules that take the most time to import. The first line is the bare interpreter.
+"""
+
+Rirdb = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rirdb.py')
+
+def importTimes(stderr):
+	"""Cumulative import time (in seconds) of the modules imported at the top level, from the output of -X importtime"""
+	times = {}
+	for line in stderr.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		if name.startswith('  '): # imported by another module
+			continue
+		times[name.strip()] = times.get(name.strip(), 0) + int(cumulative) / 1e6
+	return times
+
+
+def measure(args, repeats):
+	wallTimes = []
+	for _ in range(repeats):
+		start = time.perf_counter()
+		result = subprocess.run([sys.executable, '-X', 'importtime'] + args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+		wallTimes.append(time.perf_counter() - start)
+		if result.returncode != 0:
+			raise RuntimeError('{} failed: {}'.format(' '.join(args), result.stderr.strip().splitlines()[-1]))
+	return statistics.median(wallTimes), importTimes(result.stderr)
+
+
+def main(repeats=5, top=3):
+	print('{:12s} {:>10s} {:>12s}  {}'.format('subcommand', 'wall (ms)', 'imports (ms)', 'slowest imports'))
+	for name, args in [('(python)', ['-c', 'pass']), ('(rirdb)', [Rirdb, '--help'])] + [(command, [Rirdb, command, '--help']) for command in Commands]:
+		wallTime, times = measure(args, repeats)
+		slowest = sorted(times.items(), key=lambda item: -item[1])[:top]
+		print('{:12s} {:10.0f} {:12.0f}  {}'.format(name, 1000 * wallTime, 1000 * sum(times.values()),
+			', '.join('{} {:.0f}'.format(module, 1000 * t) for module, t in slowest)))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measure the cold start time of the rirdb subcommands')
+	parser.add_argument('-n', '--repeats', type=int, default=5, help='Number of starts per subcommand (the median is reported)')
+	parser.add_argument('--top', type=int, default=3, help='Number of slowest imports that are shown')
+	args = parser.parse_args()
+	main(args.repeats, args.top)
@@ -0,0 +1,100 @@
+import time
+import argparse
+from functools import partial
+import numpy as np
+import audioFormats
+import util
+import database
+
+"""
+Benchmark of util.trimSilence/util.normalizeAmplitude (one RIR at a time) against the batch version util.trimSilenceBatch
+as used by normalize.py, and against the former implementation with the builtin max/abs. Uses the RIRs of a database or
+synthetic RIRs.
+
+The batches are formed by util.paddedBatches (RIRs of similar length, at most util.BatchSamples samples per padded batch).
+'batch' includes the copy of the RIRs into the padded batches, 'batch, padded input' gets the batches
+(e.g. RIRs decoded into a batch). The batch version saves the per call overhead and reads the samples fewer times; the copy
+into the batch is one more pass over the samples, so the gain is largest for short RIRs (synthetic RIRs, -l 0.25: about
+2x, -l 1: about 1.2-1.5x, -l 2 and longer: on par; 1.5-3x with padded input).
+"""
+
+def trimSilenceBuiltin(x, relMaxSilentAmplitude=0.005):
+	"""The former implementation of util.trimSilence using the builtin max/abs, for comparison"""
+	maxSilentAmplitude = max(abs(x)) * relMaxSilentAmplitude
+	indices = np.where(abs(x) > maxSilentAmplitude)[0]
+	assert len(indices) > 1
+	return x[indices[0]:len(x) - 1]
+
+
+def normalizeAmplitudeBuiltin(x):
+	return x / max(abs(x))
+
+
+def syntheticRirs(count, fs=16000, maxLength=2, seed=0):
+	rng = np.random.default_rng(seed)
+	rirs = []
+	for i in range(count):
+		length = int(fs * rng.uniform(0.1, 1) * maxLength)
+		x = rng.standard_normal(length) * np.exp(-np.arange(length) / (fs * rng.uniform(0.05, 0.3)))
+		x[:rng.integers(1, length // 10)] = 0
+		rirs.append(x.astype(np.float32))
+	return rirs
+
+
+def measure(implementations, repetitions):
+	"""Minimum time of every implementation; they take turns, so all are measured under the same conditions"""
+	times = [[] for _ in implementations]
+	for _ in range(repetitions):
+		for (name, f), t in zip(implementations, times):
+			start = time.perf_counter()
+			f()
+			t.append(time.perf_counter() - start)
+	return [min(t) for t in times]
+
+
+def trimNormalizeScalar(rirs):
+	for x in rirs: # the results are dropped right away, like normalize.py writes them
+		util.normalizeAmplitude(util.trimSilence(x, 0.001, trimRight=False))
+
+
+def trimNormalizeBatch(batches):
+	for batch, X, lengths in batches:
+		left, right, gains = util.trimSilenceBatch(X, lengths, 0.001, trimRight=False)
+		for k, (l, r, gain) in enumerate(zip(left, right, gains)):
+			util.normalizeAmplitude(X[k, l:r], gain)
+
+
+def main(dbFilename=None, count=1000, maxLength=2, maxSamples=util.BatchSamples, repetitions=10):
+	if dbFilename:
+		rirs = [audioFormats.read(rir['filename'], dtype='float32')[0] for rir in database.openDb(dbFilename).values()]
+	else:
+		rirs = syntheticRirs(count, maxLength=maxLength)
+	samples = sum(len(x) for x in rirs)
+	print('{} RIRs, {:.1f} M samples'.format(len(rirs), samples / 1e6))
+
+	implementations = [
+		('builtin max (former)', lambda: [normalizeAmplitudeBuiltin(trimSilenceBuiltin(x, 0.001)) for x in rirs]),
+		('scalar', lambda: trimNormalizeScalar(rirs)),
+		('batch', lambda: trimNormalizeBatch(util.paddedBatches(rirs, maxSamples))),
+		('batch, padded input', partial(trimNormalizeBatch, [(batch,) + util.padSignals([rirs[i] for i in batch])
+			for batch in util.signalBatches(rirs, maxSamples)])),
+	]
+	if len(rirs) > 200: # the former implementation takes ages
+		implementations = implementations[1:]
+		print('(former implementation skipped for more than 200 RIRs)')
+
+	reference = None
+	for (name, _), t in zip(implementations, measure(implementations, repetitions)):
+		reference = reference or t
+		print('{:22s} {:8.3f} s  {:8.1f} M samples/s  speedup {:6.1f}x'.format(name, t, samples / t / 1e6, reference / t))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark scalar against batch trimming and normalization')
+	parser.add_argument('-db', '--database', type=str, help='Use the RIRs of this database instead of synthetic ones')
+	parser.add_argument('-n', '--count', type=int, default=1000, help='Number of synthetic RIRs')
+	parser.add_argument('-l', '--maxLength', type=float, default=2, help='Maximum length of the synthetic RIRs in seconds')
+	parser.add_argument('--maxSamples', type=int, default=util.BatchSamples, help='Samples per channel of a padded batch')
+	parser.add_argument('-r', '--repetitions', type=int, default=10)
+	args = parser.parse_args()
+	main(args.database, args.count, args.maxLength, args.maxSamples, args.repetitions)
@@ -1,72 +1,183 @@
 import os
 import re
 import argparse
-import json
 import shutil
 import util
-import soundfile as sf
-from onlinedbs import Ace, Air, Mardy, Omni, Rwcp
+import database
+import instrument
+import importlib
+import numpy as np
+import audioFormats
+import resamplers
+from manifest import ImportManifest
 
 DownloadDir = 'download'
 ImportDir = 'wav.imported'
+# the importers (modules in onlinedbs) are only loaded for the sources that are used
+Importers = {
+	'ace': 'Ace',
+	'air': 'Air',
+	'mardy': 'Mardy',
+	'omni': 'Omni',
+	'rwcp': 'Rwcp',
+}
 
-def main(dbFilename='db.json', deleteBefore=False, sources=[]):
+def loadImporter(name):
+	return importlib.import_module('onlinedbs.' + Importers[name])
+
+
+def main(dbFilename='db.json', deleteBefore=False, sources=[], parallelDownloads=1, maxBandwidth=None, stream=False, incremental=True, multichannel=False, jobs=1,
+		normalizeRates=None, importCopy=True, resampler=('libsamplerate', 'best'), outputFormat=None, checkpointInterval=database.CheckpointInterval):
+	"""With multichannel all channels of a measurement are imported as one RIR (samples x channels) with the fields
+	channels and array (type, channelNames and, if known, micPositionsInMeter), instead of a single microphone per measurement.
+	jobs is the number of worker processes the importers use to parse the RIR files.
+
+	With normalizeRates the RIRs are normalized (see normalize.py) right after they are decoded by the importer, so they are
+	decoded and written only once, and the database is the same as after running normalize.py. The copy in wav.imported
+	is only needed to normalize to other rates later and can be left out with importCopy=False.
+
+	outputFormat (see audioFormats) is the format of the files in wav.imported and wav.normalized. By default wav files
+	are copied as they are, RIRs decoded by the importers are written as float wav files and normalized RIRs as wav16.
+
+	Files are written under a temporary name and renamed when complete, and the database and the manifest are saved every
+	checkpointInterval seconds, so a killed import continues with the RIRs that were added after the last checkpoint."""
 	# open db
-	if os.path.isfile(dbFilename) and not deleteBefore:
-		rirDb = json.load(open(dbFilename))
-	else:
-		rirDb = {}
+	rirDb = database.openDb(dbFilename, deleteBefore=deleteBefore)
 
 	util.createDirectory(ImportDir, deleteBefore=deleteBefore)
 	util.createDirectory(DownloadDir)
+	if normalizeRates:
+		import normalize
+		normalize.createDirectories(normalizeRates)
+
+	def removeFromDb(id):
+		rir = rirDb.pop(id, None)
+		if rir is None:
+			return
+		filenames = {audioFormats.find(os.path.join(ImportDir, id)), rir['filename']} - {None}
+		filenames.update(normalized['filename'] for normalized in rir.get('normalized', {}).values())
+		for filename in filenames:
+			if os.path.isfile(filename):
+				os.remove(filename)
+
+	manifest = None
+	if incremental:
+		manifestFilename = os.path.splitext(dbFilename)[0] + '.manifest.json'
+		if deleteBefore and os.path.isfile(manifestFilename):
+			os.remove(manifestFilename)
+		# members imported in another mode are imported again
+		mode = {'multichannel': multichannel, 'normalize': normalizeRates, 'format': outputFormat}
+		manifest = ImportManifest(manifestFilename, lambda id: id in rirDb, removeFromDb, mode)
 
 	def insertIntoDb(file, identifier, info):
+		"""file is a filename, a file object, a tuple (samples, fs) or a function that returns one of these"""
 		onlineDbId = info['source'].lower()
 		id = '{}_{}'.format(onlineDbId, identifier)
+		if manifest: manifest.addId(id)
 		if id in rirDb:
 			return False
 		
 		info['id'] = id
-		info['filename'] = os.path.join(ImportDir, id + '.wav')
-		rirDb[id] = info
 
-		# copy file (or write as wav file)
-		if isinstance(file, str):
-			shutil.copyfile(file, info['filename'])
+		if callable(file): # loaded only now that it is clear that the RIR is new
+			file = file()
+		if outputFormat and (isinstance(file, str) or hasattr(file, 'read')): # files are converted instead of copied
+			file = audioFormats.read(file, dtype='float32')
+			instrument.count('files_decoded')
+
+		if isinstance(file, str) or hasattr(file, 'read'):
+			importedFilename = os.path.join(ImportDir, id + '.wav')
 		else:
 			assert len(file) == 2
 			x, fs = file
-			sf.write(info['filename'], x, fs)
+			# float data (e.g. RWCP, AIR) is written as float by default, so it is not quantized before normalizing
+			importFormat = outputFormat or ('wavfloat' if np.issubdtype(x.dtype, np.floating) else 'wav16')
+			importedFilename = os.path.join(ImportDir, id + audioFormats.extension(importFormat))
+		info['filename'] = importedFilename
+
+		if normalizeRates:
+			normalizeImported(file, info)
 
+		# copy file (from disk or from an archive member), or write it in the import format
+		if importCopy:
+			with instrument.timed('write_seconds'):
+				if isinstance(file, str):
+					with util.atomicFile(importedFilename) as tmpFilename:
+						shutil.copyfile(file, tmpFilename)
+				elif hasattr(file, 'read'):
+					with util.atomicFile(importedFilename) as tmpFilename, open(tmpFilename, 'wb') as f:
+						shutil.copyfileobj(file, f)
+				else:
+					audioFormats.write(importedFilename, x, fs, importFormat)
+			instrument.count('files_written')
+
+		rirDb[id] = info
+		checkpoint()
 		return True
 
-	if 'ace' in sources:
-		Ace.importRirs(DownloadDir, insertIntoDb)
-	if 'air' in sources:
-		Air.importRirs(DownloadDir, insertIntoDb)
-	if 'mardy' in sources:
-		Mardy.importRirs(DownloadDir, insertIntoDb)
-	if 'omni' in sources:
-		Omni.importRirs(DownloadDir, insertIntoDb)
-	if 'rwcp' in sources:
-		Rwcp.importRirs(DownloadDir, insertIntoDb)
+	def normalizeImported(file, info):
+		"""Normalize the RIR to the normalizeRates and add the results to its info (as normalize.py does)"""
+		if isinstance(file, str) or hasattr(file, 'read'):
+			x, fs = audioFormats.read(file, dtype='float32')
+			instrument.count('files_decoded')
+			if hasattr(file, 'seek'):
+				file.seek(0) # for the copy in ImportDir
+		else:
+			x, fs = file
+			x = x.astype(np.float32) # importers pass float data in [-1, 1]
+		import normalize
+		normalized = normalize.normalizeSignal(x, fs, info, normalizeRates, len(normalizeRates) > 1, resampler=resampler,
+			outputFormat=outputFormat or audioFormats.DefaultFormat)
+		normalize.updateRir(info, normalized, normalizeRates[0])
+
+	importers = [loadImporter(name) for name in Importers if name in sources]
+
+	# fetch all archives first, so the downloads can run at the same time (the importers then use the cached files)
+	util.downloadAll([dl for importer in importers for dl in importer.downloads(DownloadDir)],
+		maxConnections=parallelDownloads, bytesPerSecond=maxBandwidth)
+
+	# the database is committed before the manifest is saved, a member is only skipped if its RIRs are in the database
+	with database.Checkpoint(rirDb, checkpointInterval, manifest.save if manifest else None) as checkpoint:
+		for importer in importers:
+			importer.importRirs(DownloadDir, insertIntoDb, stream=stream, manifest=manifest, multichannel=multichannel, jobs=jobs)
 
 	# more sources could be found here: http://www.dreams-itn.eu/index.php/dissemination/science-blogs/24-rir-databases
 
-	# save db
-	with open(dbFilename, 'w') as dbFile:
-		json.dump(rirDb, dbFile, sort_keys=True, indent=4)
+	if manifest:
+		manifest.report()
 
 	print('Database size: {}'.format(len(rirDb)))
 
 
-if __name__ == '__main__':
-	parser = argparse.ArgumentParser(description='Create RIR database by importing all RIRs from the known databases')
-	parser.add_argument('-db', '--database', type=str, default='db.json')
+def cli(argv=None, prog=None):
+	parser = argparse.ArgumentParser(prog=prog, description='Create RIR database by importing all RIRs from the known databases')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
 	parser.add_argument('--deleteBefore', action='store_true', help='Whether to delete old database (and imported data) before')
 	parser.add_argument('--sources', type=str, default='mardy,omni', help='Comma separated list of the sources to use (available: ACE, AIR, MARDY, OMNI, RWCP)')
-	args = parser.parse_args()
+	parser.add_argument('--parallelDownloads', type=int, default=1, help='Number of archives to download at the same time')
+	parser.add_argument('--maxBandwidth', type=float, help='Limit for the total download bandwidth in MB/s')
+	parser.add_argument('--stream', action='store_true', help='Read the RIRs directly from tar and zip archives instead of extracting them first')
+	parser.add_argument('--noManifest', action='store_true', help='Do not use the import manifest to skip archives and files that were already imported')
+	parser.add_argument('--multichannel', action='store_true', help='Import all channels of a measurement (microphone array, binaural) as one multichannel RIR')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes for parsing the RIR files (AIR; 0: use all cores)')
+	parser.add_argument('--normalize', type=str, help='Normalize the RIRs to this sampling rate (or comma separated rates) while importing them, like normalize.py -fs')
+	parser.add_argument('--noImportCopy', action='store_true', help='With --normalize: do not keep a copy of the imported RIRs in wav.imported')
+	parser.add_argument('--resampler', type=str, default='libsamplerate', choices=resamplers.Backends, help='Resampling backend for --normalize')
+	parser.add_argument('--quality', type=str, default='best', choices=resamplers.Qualities, help='Quality of the resampler for --normalize')
+	parser.add_argument('--format', type=str, choices=list(audioFormats.Formats), help='Convert the imported (and normalized) RIRs to this format (default: copy wav files, write other RIRs as float wav)')
+	parser.add_argument('--checkpointInterval', type=float, default=database.CheckpointInterval, help='Seconds between saves of the database and the manifest; a killed run continues after the last save')
+	instrument.addArguments(parser)
+	args = parser.parse_args(argv)
+	if args.noImportCopy and not args.normalize:
+		parser.error('--noImportCopy requires --normalize')
 	if args.sources == 'all':
 		args.sources = 'ace,air,mardy,omni,rwcp'
-	main(args.database, args.deleteBefore, args.sources.lower().split(','))
+	maxBandwidth = int(args.maxBandwidth * 1024**2) if args.maxBandwidth else None
+	with instrument.session(args, 'createDb'):
+		main(args.database, args.deleteBefore, args.sources.lower().split(','), args.parallelDownloads, maxBandwidth, args.stream, not args.noManifest, args.multichannel, args.jobs or os.cpu_count(),
+			[int(fs) for fs in args.normalize.split(',')] if args.normalize else None, not args.noImportCopy, (args.resampler, args.quality), args.format,
+			args.checkpointInterval)
 
+
+if __name__ == '__main__':
+	cli()
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+
+"""
+Storage backends for the RIR metadata.
+
+Both backends behave like a dictionary that maps the RIR id to a dictionary with the information about the RIR. Changes
+of a RIR have to be written back with db[id] = rir. They are persisted with commit() (the SQLite backend additionally
+commits automatically every batchSize changes).
+
+- JsonDb: the whole database is one JSON file (db.json) that is rewritten on every commit.
+- SqliteDb: one row per RIR with indexed columns for the most common fields, so single RIRs can be updated atomically and
+  subsets can be selected without loading the whole database.
+
+openDb() selects the backend by the file extension. Long running stages commit periodically with a Checkpoint, so a killed
+run only has to redo the work of the last interval.
+"""
+
+SqliteExtensions = ['.sqlite', '.sqlite3', '.db']
+CheckpointInterval = 60 # seconds between the commits of long running stages
+
+def openDb(filename, deleteBefore=False, batchSize=1000):
+	if os.path.splitext(filename)[1].lower() in SqliteExtensions:
+		return SqliteDb(filename, deleteBefore=deleteBefore, batchSize=batchSize)
+	return JsonDb(filename, deleteBefore=deleteBefore)
+
+
+def copyDb(source, target):
+	"""Copy all RIRs from one database to another one (e.g. to migrate from JSON to SQLite)"""
+	for rirId, rir in source.items():
+		target[rirId] = rir
+	target.commit()
+
+
+class Checkpoint:
+	"""Commits the database (and calls saveF, e.g. to save the import manifest) at most every interval seconds when it is
+	called, and always at the end of the with block, also when the stage fails or is interrupted"""
+	def __init__(self, rirDb, interval=CheckpointInterval, saveF=None):
+		self.rirDb = rirDb
+		self.interval = interval
+		self.saveF = saveF
+		self.last = time.monotonic()
+
+
+	def __call__(self):
+		if time.monotonic() - self.last >= self.interval:
+			self.save()
+
+
+	def save(self):
+		self.rirDb.commit()
+		if self.saveF: self.saveF()
+		self.last = time.monotonic()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *exc):
+		self.save()
+
+
+class JsonDb:
+	def __init__(self, filename, deleteBefore=False):
+		self.filename = filename
+		if os.path.isfile(filename) and not deleteBefore:
+			with open(filename) as f:
+				self.rirs = json.load(f)
+		else:
+			self.rirs = {}
+
+
+	def __getitem__(self, rirId):
+		return self.rirs[rirId]
+
+
+	def __setitem__(self, rirId, rir):
+		self.rirs[rirId] = rir
+
+
+	def __delitem__(self, rirId):
+		del self.rirs[rirId]
+
+
+	def __contains__(self, rirId):
+		return rirId in self.rirs
+
+
+	def __len__(self):
+		return len(self.rirs)
+
+
+	def __iter__(self):
+		return iter(self.rirs)
+
+
+	def get(self, rirId, default=None):
+		return self.rirs.get(rirId, default)
+
+
+	def pop(self, rirId, default=None):
+		return self.rirs.pop(rirId, default)
+
+
+	def keys(self):
+		return self.rirs.keys()
+
+
+	def items(self):
+		return self.rirs.items()
+
+
+	def values(self):
+		return self.rirs.values()
+
+
+	def commit(self):
+		# written to a temporary file that replaces the database, so a killed commit leaves the previous version
+		tmpFilename = '{}.{}.partial'.format(self.filename, os.getpid())
+		with open(tmpFilename, 'w') as dbFile:
+			json.dump(self.rirs, dbFile, sort_keys=True, indent=4)
+		os.replace(tmpFilename, self.filename)
+
+
+	def close(self):
+		self.commit()
+
+
+class SqliteDb:
+	# fields of the RIR info that get their own (indexed) column, all other fields are only stored in the info column
+	IndexedFields = {
+		'source': 'TEXT',
+		'room': 'TEXT',
+		'fs': 'INTEGER',
+		'rir_type': 'TEXT',
+		'distanceInMeter': 'REAL',
+		# acoustic parameters (see acoustics.py)
+		'rt60': 'REAL',
+		't20': 'REAL',
+		't30': 'REAL',
+		'edt': 'REAL',
+		'drr': 'REAL',
+		'c50': 'REAL',
+		'c80': 'REAL',
+		# duplicates (see dedup.py)
+		'contentHash': 'TEXT',
+		'duplicateCluster': 'TEXT',
+	}
+
+	def __init__(self, filename, deleteBefore=False, batchSize=1000):
+		if deleteBefore:
+			# also the write-ahead log of a killed run, it would be applied to the new database
+			for f in [filename, filename + '-wal', filename + '-shm']:
+				if os.path.isfile(f):
+					os.remove(f)
+		self.filename = filename
+		self.batchSize = batchSize
+		self.pending = 0
+		self.connection = sqlite3.connect(filename)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self._createSchema()
+
+
+	def _createSchema(self):
+		c = self.connection
+		c.execute('CREATE TABLE IF NOT EXISTS rirs (id TEXT PRIMARY KEY, info TEXT NOT NULL)')
+		columns = [row[1] for row in c.execute('PRAGMA table_info(rirs)')]
+		missing = [field for field in self.IndexedFields if field not in columns]
+		for field in missing:
+			c.execute('ALTER TABLE rirs ADD COLUMN "{}" {}'.format(field, self.IndexedFields[field]))
+			c.execute('CREATE INDEX IF NOT EXISTS "rirs_{0}" ON rirs ("{0}")'.format(field))
+		if missing and len(columns) > 2: # fill new columns of an existing database
+			for rirId, rir in list(self.items()):
+				self[rirId] = rir
+		c.commit()
+
+
+	def __getitem__(self, rirId):
+		row = self.connection.execute('SELECT info FROM rirs WHERE id = ?', (rirId,)).fetchone()
+		if row is None:
+			raise KeyError(rirId)
+		return json.loads(row[0])
+
+
+	def __setitem__(self, rirId, rir):
+		fields = list(self.IndexedFields)
+		self.connection.execute('INSERT OR REPLACE INTO rirs (id, info, {}) VALUES (?, ?, {})'.format(
+				', '.join('"{}"'.format(field) for field in fields), ', '.join('?' * len(fields))),
+			[rirId, json.dumps(rir, sort_keys=True)] + [rir.get(field) for field in fields])
+		self._changed()
+
+
+	def __delitem__(self, rirId):
+		if self.connection.execute('DELETE FROM rirs WHERE id = ?', (rirId,)).rowcount == 0:
+			raise KeyError(rirId)
+		self._changed()
+
+
+	def __contains__(self, rirId):
+		return self.connection.execute('SELECT 1 FROM rirs WHERE id = ?', (rirId,)).fetchone() is not None
+
+
+	def __len__(self):
+		return self.connection.execute('SELECT COUNT(*) FROM rirs').fetchone()[0]
+
+
+	def __iter__(self):
+		return iter(self.keys())
+
+
+	def get(self, rirId, default=None):
+		try:
+			return self[rirId]
+		except KeyError:
+			return default
+
+
+	def pop(self, rirId, default=None):
+		rir = self.get(rirId)
+		if rir is None:
+			return default
+		del self[rirId]
+		return rir
+
+
+	def keys(self):
+		return [row[0] for row in self.connection.execute('SELECT id FROM rirs ORDER BY id')]
+
+
+	def items(self):
+		for rirId, info in self.connection.execute('SELECT id, info FROM rirs ORDER BY id'):
+			yield rirId, json.loads(info)
+
+
+	def values(self):
+		for rirId, rir in self.items():
+			yield rir
+
+
+	def select(self, where='1', params=()):
+		"""Ids of the RIRs matching an SQL condition on the indexed columns, e.g. select('source = ? AND fs = ?', ('AIR', 16000))"""
+		return [row[0] for row in self.connection.execute('SELECT id FROM rirs WHERE {} ORDER BY id'.format(where), params)]
+
+
+	def _changed(self):
+		self.pending += 1
+		if self.pending >= self.batchSize:
+			self.commit()
+
+
+	def commit(self):
+		self.connection.commit()
+		self.pending = 0
+
+
+	def close(self):
+		self.commit()
+		self.connection.close()
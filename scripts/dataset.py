@@ -0,0 +1,167 @@
+import os
+import time
+import random
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import audioFormats
+import util
+import database
+import instrument
+
+"""
+Iterate over the RIRs of a list (lists/*.rirs, see splitIntoSets.py) for training, e.g. on node rank of worldSize nodes:
+
+	dataset = RirDataset('train', 'db.sqlite', fs=16000, rank=rank, worldSize=worldSize)
+	for epoch in range(epochs):
+		for rirIds, rirs in dataset.batches(epoch, batchSize=32):
+			...
+
+Sharding: the RIRs of the list are distributed round-robin to the worldSize shards. The shards are disjoint, the same on
+every node and in every epoch, and have the same size (the remaining RIRs are left out, so all nodes take the same number
+of steps). Only the metadata of the RIRs of the own shard is read from the database, so with a SQLite database no node has
+to load the metadata of all RIRs (a JSON database is always read completely).
+
+Every epoch the shard is shuffled with a random generator seeded with the seed and the epoch, so the order is reproducible
+(every purpose, seed and epoch has its own string key, so the generators of different epochs or seeds never coincide).
+With length bucketing the shuffled RIRs are taken in pools of BucketBatches batches, sorted by length within a pool and
+cut into batches, and the batches are shuffled again: a batch contains RIRs of similar length (less padding) and the
+batches are still in random order. The batches are read by a pool of threads, at most prefetch batches ahead.
+"""
+
+ListDir = 'lists'
+BucketBatches = 50 # batches per pool of RIRs that are sorted by length
+
+def listFilename(name):
+	"""Filename of a list: a path, or the name of a list in the lists directory (e.g. train or omni/classroom.train)"""
+	if name.endswith('.rirs'):
+		return name
+	return os.path.join(ListDir, name + '.rirs')
+
+
+class RirDataset:
+	def __init__(self, listName, dbFilename='db.json', fs=16000, rank=0, worldSize=1, seed=0, shuffle=True, evenShards=True):
+		if not 0 <= rank < worldSize:
+			raise ValueError('rank {} is not in [0, {})'.format(rank, worldSize))
+		with open(listFilename(listName)) as f:
+			rirIds = [line.strip() for line in f if line.strip()]
+		shardSize = len(rirIds) // worldSize if evenShards else None
+		self.rirIds = rirIds[rank::worldSize][:shardSize]
+		self.fs = fs
+		self.seed = seed
+		self.shuffle = shuffle
+
+		rirDb = database.openDb(dbFilename)
+		self.filenames = {}
+		self.lengths = {} # seconds
+		for rirId in self.rirIds:
+			rir = rirDb[rirId]
+			normalized = rir.get('normalized', {}).get(str(fs))
+			if normalized is None and rir['fs'] != fs:
+				raise RuntimeError('RIR {} is not normalized to {} Hz (run normalize.py -fs {})'.format(rirId, fs, fs))
+			entry = normalized or rir
+			self.filenames[rirId] = entry['filename']
+			self.lengths[rirId] = entry.get('length', 0)
+
+
+	def __len__(self):
+		return len(self.rirIds)
+
+
+	def __getitem__(self, rirId):
+		"""Samples of a RIR of the shard (float32)"""
+		x, fs = audioFormats.read(self.filenames[rirId], dtype='float32')
+		assert fs == self.fs, 'Sampling rate of {} is {} Hz, not {} Hz'.format(rirId, fs, self.fs)
+		instrument.count('files_decoded')
+		return x
+
+
+	def order(self, epoch):
+		"""Ids of the shard in the order of the epoch"""
+		rirIds = list(self.rirIds)
+		if self.shuffle:
+			random.Random('order:{}:{}'.format(self.seed, epoch)).shuffle(rirIds)
+		return rirIds
+
+
+	def batchIds(self, epoch, batchSize, bucketByLength=True, dropLast=False):
+		"""Ids of the batches of an epoch"""
+		rirIds = self.order(epoch)
+		if bucketByLength:
+			rng = random.Random('buckets:{}:{}'.format(self.seed, epoch))
+			poolSize = batchSize * BucketBatches
+			batches = []
+			for start in range(0, len(rirIds), poolSize):
+				pool = sorted(rirIds[start:start + poolSize], key=lambda rirId: self.lengths[rirId])
+				batches += [pool[i:i + batchSize] for i in range(0, len(pool), batchSize)]
+			if self.shuffle:
+				rng.shuffle(batches)
+		else:
+			batches = [rirIds[i:i + batchSize] for i in range(0, len(rirIds), batchSize)]
+		if dropLast:
+			batches = [batch for batch in batches if len(batch) == batchSize]
+		return batches
+
+
+	def readBatch(self, rirIds):
+		return rirIds, [self[rirId] for rirId in rirIds]
+
+
+	def batches(self, epoch=0, batchSize=32, bucketByLength=True, dropLast=False, workers=4, prefetch=8):
+		"""Yields (ids, list of samples) for the batches of an epoch, read by worker threads at most prefetch batches ahead"""
+		batches = iter(self.batchIds(epoch, batchSize, bucketByLength, dropLast))
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			pending = deque()
+			while True:
+				for batch in batches:
+					pending.append(executor.submit(self.readBatch, batch))
+					if len(pending) >= prefetch:
+						break
+				if not pending:
+					break
+				yield pending.popleft().result()
+
+
+	def __iter__(self):
+		"""(id, samples) of the RIRs of the shard in the order of epoch 0"""
+		for rirIds, rirs in self.batches(0, batchSize=1, bucketByLength=False):
+			yield rirIds[0], rirs[0]
+
+
+def main(listName, dbFilename='db.json', fs=16000, worldSize=1, epochs=1, batchSize=32, workers=4, prefetch=8, seed=0):
+	"""Iterate over all shards (as the nodes would) and report the shard sizes, the padding and the throughput"""
+	for rank in range(worldSize):
+		dataset = RirDataset(listName, dbFilename, fs, rank, worldSize, seed)
+		for epoch in range(epochs):
+			rirs = 0
+			samples = 0
+			padded = 0
+			start = time.perf_counter()
+			bar = util.ConsoleProgressBar()
+			bar.start('Rank {} epoch {}'.format(rank, epoch), len(dataset), 'RIRs')
+			for rirIds, batch in dataset.batches(epoch, batchSize, workers=workers, prefetch=prefetch):
+				rirs += len(batch)
+				samples += sum(len(x) for x in batch)
+				padded += len(batch) * max(len(x) for x in batch)
+				bar.progress(rirs / max(len(dataset), 1))
+			bar.end()
+			elapsed = time.perf_counter() - start
+			print('Rank {} epoch {}: {} RIRs, {:.0f} RIRs/s, {:.1f} % padding'.format(rank, epoch, rirs, rirs / elapsed if elapsed else 0,
+				100 * (1 - samples / padded) if padded else 0))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Iterate over the shards of a list of RIRs as the training nodes would and report the throughput')
+	parser.add_argument('-l', '--list', type=str, default='train', help='Name of a list in lists (e.g. train, omni/classroom.train) or a .rirs file')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Sampling rate, the RIRs have to be normalized to it')
+	parser.add_argument('--worldSize', type=int, default=1, help='Number of shards')
+	parser.add_argument('--epochs', type=int, default=1)
+	parser.add_argument('-b', '--batchSize', type=int, default=32)
+	parser.add_argument('-j', '--workers', type=int, default=4, help='Number of reader threads')
+	parser.add_argument('--prefetch', type=int, default=8, help='Maximum number of batches read ahead')
+	parser.add_argument('--seed', type=int, default=0)
+	instrument.addArguments(parser)
+	args = parser.parse_args()
+	with instrument.session(args, 'dataset'):
+		main(args.list, args.database, args.samplingrate, args.worldSize, args.epochs, args.batchSize, args.workers, args.prefetch, args.seed)
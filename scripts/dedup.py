@@ -0,0 +1,216 @@
+import os
+import json
+import hashlib
+import argparse
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+import audioFormats
+import util
+import database
+import instrument
+
+"""
+Detection of duplicate and near-duplicate RIRs (e.g. repeated measurements, or the same response in several sources).
+
+Every RIR gets two fingerprints:
+
+	contentHash   SHA-256 of the samples (float32, first channel) and the sampling rate: identical responses
+	sketch        80 values in dB: the energy envelope (energy in 64 windows of 5 ms after the direct sound, relative to
+	              the peak) and the spectrum (energy in 16 logarithmic bands from 100 Hz to 8 kHz, relative to the
+	              strongest band)
+
+RIRs with the same contentHash are duplicates. RIRs whose sketches differ by at most the threshold (RMS difference in dB)
+are near-duplicates. These are found with locality sensitive hashing for the Euclidean distance: every sketch is put
+into a bucket of LshTables tables (by LshProjections quantized random projections each), and only RIRs that share a
+bucket in at least one table are compared instead of all pairs. Duplicates and near-duplicates are merged into clusters
+(union-find).
+
+main() stores contentHash in every RIR, and for RIRs in a cluster duplicateCluster: the id of the cluster's
+representative (its first id). splitIntoSets.py keeps the RIRs of a cluster in the same set (or only the representative,
+with --duplicates collapse), rirBank.py can leave out the other RIRs of a cluster with --collapseDuplicates. The sketches
+are cached per content hash of the RIR file, like the acoustic parameters.
+"""
+
+BatchSize = 16
+EnvelopeWindow = 0.005 # seconds
+EnvelopeWindows = 64
+SpectrumBands = 16
+SpectrumRange = (100, 8000) # Hz
+SpectrumLength = 0.5 # seconds of the RIR used for the spectrum
+FloorDb = -80
+LshTables = 8
+LshProjections = 4 # per table
+BucketWidth = 4 # width of the buckets of the projections, relative to the threshold (scaled to the sketch length)
+DefaultThreshold = 0.5 # dB
+Seed = 0 # of the random projections
+
+def sketch(x, fs):
+	"""Energy envelope and band energies of a RIR (1-D) as vector of floats"""
+	peak = int(np.argmax(np.abs(x)))
+	window = max(1, int(round(EnvelopeWindow * fs)))
+	segment = x[peak:peak + window * EnvelopeWindows].astype(np.float64)
+	segment = np.pad(segment, (0, window * EnvelopeWindows - len(segment)))
+	energy = np.sum(segment.reshape(EnvelopeWindows, window)**2, axis=1)
+	envelope = 10 * np.log10(np.maximum(energy / max(energy.max(), 1e-30), 1e-30))
+
+	n = int(SpectrumLength * fs)
+	power = np.abs(np.fft.rfft(x[peak:peak + n].astype(np.float64), n=n))**2
+	frequencies = np.fft.rfftfreq(n, 1 / fs)
+	edges = np.geomspace(SpectrumRange[0], SpectrumRange[1], SpectrumBands + 1)
+	bands = np.array([power[(frequencies >= low) & (frequencies < high)].sum() for low, high in zip(edges[:-1], edges[1:])])
+	spectrum = 10 * np.log10(np.maximum(bands / max(bands.max(), 1e-30), 1e-30))
+
+	return np.maximum(np.concatenate([envelope, spectrum]), FloorDb)
+
+
+def fingerprintFiles(filenames):
+	"""Content hash and sketch of a batch of RIR files (runs in the worker processes)"""
+	results = []
+	for filename in filenames:
+		x, fs = audioFormats.read(filename, dtype='float32')
+		if x.ndim > 1: # multichannel RIRs are compared with their first channel
+			x = np.ascontiguousarray(x[:, 0])
+		contentHash = hashlib.sha256(x.tobytes() + str(fs).encode()).hexdigest()
+		results.append({'contentHash': contentHash, 'sketch': [round(float(v), 3) for v in sketch(x, fs)]})
+	return results
+
+
+def lshBuckets(S, threshold, seed=Seed):
+	"""Bucket of every sketch (rows of S) in every LSH table: LshTables x LshProjections quantized random projections"""
+	rng = np.random.RandomState(seed)
+	width = BucketWidth * threshold * np.sqrt(S.shape[1])
+	A = rng.standard_normal((S.shape[1], LshTables * LshProjections))
+	offsets = rng.uniform(0, width, LshTables * LshProjections)
+	return np.floor((S @ A + offsets) / width).astype(np.int64).reshape(len(S), LshTables, LshProjections)
+
+
+def candidatePairs(S, threshold):
+	"""Pairs of indices (i < j) of sketches that are in the same bucket in at least one LSH table"""
+	buckets = lshBuckets(S, threshold)
+	pairs = set()
+	for table in range(LshTables):
+		members = {}
+		for i in range(len(S)):
+			members.setdefault(buckets[i, table].tobytes(), []).append(i)
+		for bucket in members.values():
+			for a in range(len(bucket)):
+				for b in range(a + 1, len(bucket)):
+					pairs.add((bucket[a], bucket[b]))
+	return pairs
+
+
+def distance(u, v):
+	"""RMS difference of two sketches in dB"""
+	return float(np.sqrt(np.mean((u - v)**2)))
+
+
+def find(parent, i):
+	while parent[i] != i:
+		parent[i] = parent[parent[i]]
+		i = parent[i]
+	return i
+
+
+def union(parent, i, j):
+	i, j = find(parent, i), find(parent, j)
+	if i != j:
+		parent[max(i, j)] = min(i, j)
+
+
+def clusters(contentHashes, sketches, threshold=DefaultThreshold):
+	"""Clusters (lists of indices, at least 2) of identical RIRs or similar sketches, and the number of compared pairs"""
+	parent = list(range(len(contentHashes)))
+	first = {}
+	for i, contentHash in enumerate(contentHashes):
+		union(parent, first.setdefault(contentHash, i), i)
+
+	S = np.asarray(sketches, dtype=np.float64)
+	pairs = candidatePairs(S, threshold) if len(S) else set()
+	for i, j in pairs:
+		if find(parent, i) != find(parent, j) and distance(S[i], S[j]) <= threshold:
+			union(parent, i, j)
+
+	members = {}
+	for i in range(len(parent)):
+		members.setdefault(find(parent, i), []).append(i)
+	return [m for m in members.values() if len(m) > 1], len(pairs)
+
+
+def main(dbFilename, jobs=1, force=False, threshold=DefaultThreshold):
+	rirDb = database.openDb(dbFilename)
+	cacheFilename = os.path.splitext(dbFilename)[0] + '.dedup.json'
+	cache = {}
+	if os.path.isfile(cacheFilename) and not force:
+		with open(cacheFilename) as f:
+			cache = json.load(f)
+
+	rirs = sorted(rirDb.values(), key=lambda rir: rir['id'])
+	pool = Pool(jobs) if jobs > 1 else None
+	mapF = partial(pool.imap, chunksize=16) if pool else map
+	try:
+		fileHashes = list(mapF(util.fileChecksum, [rir['filename'] for rir in rirs]))
+
+		todo = {}
+		for rir, fileHash in zip(rirs, fileHashes):
+			if fileHash not in cache:
+				todo[fileHash] = rir['filename']
+		todo = list(todo.items())
+		batches = [todo[i:i + BatchSize] for i in range(0, len(todo), BatchSize)]
+
+		bar = util.ConsoleProgressBar()
+		bar.start('Fingerprint RIRs', len(todo), 'RIRs')
+		done = 0
+		for batch, results in zip(batches, mapF(fingerprintFiles, [[filename for _, filename in batch] for batch in batches])):
+			for (fileHash, _), fingerprint in zip(batch, results):
+				cache[fileHash] = fingerprint
+			done += len(batch)
+			instrument.count('files_decoded', len(batch))
+			bar.progress(done / len(todo))
+		bar.end()
+	finally:
+		if pool:
+			pool.terminate()
+
+	fingerprints = [cache[fileHash] for fileHash in fileHashes]
+	contentHashes = [fingerprint['contentHash'] for fingerprint in fingerprints]
+	sketches = [fingerprint['sketch'] for fingerprint in fingerprints]
+	with instrument.stage('Find duplicates', render=False):
+		found, compared = clusters(contentHashes, sketches, threshold)
+		instrument.count('pairs_compared', compared)
+
+	representative = {}
+	for members in found:
+		for i in members:
+			representative[i] = rirs[members[0]]['id']
+	for i, rir in enumerate(rirs):
+		rir['contentHash'] = contentHashes[i]
+		if i in representative:
+			rir['duplicateCluster'] = representative[i]
+		else:
+			rir.pop('duplicateCluster', None)
+		rirDb[rir['id']] = rir
+	rirDb.commit()
+
+	with util.atomicFile(cacheFilename) as tmpFilename, open(tmpFilename, 'w') as f:
+		json.dump(cache, f, sort_keys=True, indent=4)
+
+	exact = sum(1 for members in found if len(set(contentHashes[i] for i in members)) == 1)
+	print('Fingerprinted {} of {} RIRs (the others were cached), compared {} candidate pairs ({} pairs in total)'.format(
+		len(todo), len(rirs), compared, len(rirs) * (len(rirs) - 1) // 2))
+	print('{} clusters with {} RIRs ({} of them only identical RIRs); {} RIRs would remain after collapsing them'.format(
+		len(found), sum(len(members) for members in found), exact, len(rirs) - sum(len(members) - 1 for members in found)))
+	for members in sorted(found, key=len, reverse=True)[:10]:
+		print('  ' + ', '.join(rirs[i]['id'] for i in members[:6]) + (' ...' if len(members) > 6 else ''))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Find duplicate and near-duplicate RIRs and store their clusters in the database')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes (0: use all cores)')
+	parser.add_argument('-f', '--force', action='store_true', help='Ignore cached fingerprints')
+	parser.add_argument('-t', '--threshold', type=float, default=DefaultThreshold, help='Maximum RMS difference of the sketches of near-duplicates in dB')
+	instrument.addArguments(parser)
+	args = parser.parse_args()
+	with instrument.session(args, 'dedup'):
+		main(args.database, args.jobs or os.cpu_count(), args.force, args.threshold)
@@ -0,0 +1,366 @@
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+"""
+Instrumentation of the pipeline: named stages, counters, progress and profiling.
+
+	with instrument.stage('Import ACE', total=len(files), unit='files'):
+		for ...:
+			with instrument.timed('write_seconds'):
+				...
+			instrument.count('files_written')
+			instrument.progress(i / len(files))
+
+Stages can be nested (their names are joined with '/'). Counters are global and are also attributed to all stages that
+are running. Progress is shown by a renderer: a progress bar with rate and ETA on a terminal, or a log line every few
+seconds if the output is not a terminal (e.g. in job logs). All events can additionally be written as JSON lines to a
+metrics file, and at the end a summary with the time and the counters of every stage is printed.
+
+Worker processes have their own counters: they return takeCounters() with their results and the main process adds them
+with addCounters().
+
+The command line scripts get the options --progress, --metrics and --profile with addArguments() and run their main
+function inside session().
+"""
+
+Renderers = ['auto', 'bar', 'log', 'none']
+LogInterval = 10 # seconds between the progress lines of the log renderer
+
+def formatSeconds(seconds):
+	seconds = int(round(seconds))
+	if seconds >= 3600:
+		return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+	return '{}:{:02d}'.format(seconds // 60, seconds % 60)
+
+
+class Stage:
+	def __init__(self, name, total=None, unit=None, render=True):
+		self.name = name
+		self.render = render
+		self.total = total
+		self.unit = unit
+		self.start = time.perf_counter()
+		self.fraction = 0.0
+		self.counters = {}
+		self.profiled = False
+
+
+	def elapsed(self):
+		return time.perf_counter() - self.start
+
+
+	def rate(self):
+		"""Items (total * progress) per second, or None"""
+		elapsed = self.elapsed()
+		if self.total is None or elapsed <= 0:
+			return None
+		return self.total * self.fraction / elapsed
+
+
+	def eta(self):
+		if self.fraction <= 0:
+			return None
+		return self.elapsed() * (1 - self.fraction) / self.fraction
+
+
+	def status(self):
+		"""e.g. '1234/5000 files, 56.7 files/s, ETA 1:06'"""
+		parts = []
+		if self.total is not None:
+			parts.append('{}/{} {}'.format(int(round(self.total * self.fraction)), self.total, self.unit or '').rstrip())
+			rate = self.rate()
+			if rate is not None:
+				parts.append('{:.1f} {}/s'.format(rate, self.unit or 'items'))
+		eta = self.eta()
+		if eta is not None and self.fraction < 1:
+			parts.append('ETA ' + formatSeconds(eta))
+		return ', '.join(parts)
+
+
+class BarRenderer:
+	"""The progress bar for terminals: 50 chars long, redrawn in place with backspaces"""
+	def __init__(self, stream=None):
+		self.stream = stream or sys.stdout
+		self.lastMsgLength = 0
+		self.lastLength = 0
+		self.lastDraw = 0
+
+
+	def start(self, stage):
+		self.lastMsgLength = 0
+		self.lastLength = 52
+		self.stream.write(stage.name.rsplit('/', 1)[-1] + ' [' + ' ' * 50 + ']' + chr(8) * 52)
+		self.stream.flush()
+
+
+	def progress(self, stage, msg=None):
+		now = time.monotonic()
+		if stage.fraction < 1 and now - self.lastDraw < 0.05: # drawing is expensive for very fast loops
+			return
+		self.lastDraw = now
+		x = int(50 * stage.fraction)
+		y = 50 - x - 1
+		s = '[{}>{}] {:.1f} %'.format('=' * x, ' ' * y, 100 * stage.fraction)
+		status = stage.status()
+		msg = ' '.join(str(m) for m in [status, msg] if m)
+		if msg or self.lastMsgLength:
+			if len(msg) > self.lastMsgLength:
+				self.lastMsgLength = len(msg)
+			else:
+				msg = msg + ' ' * (self.lastMsgLength - len(msg))
+			s += ' ' + msg
+		self.lastLength = len(s)
+		self.stream.write(s + chr(8) * len(s))
+		self.stream.flush()
+
+
+	def end(self, stage):
+		"""Write full bar, then move to next line"""
+		s = '[' + '=' * 50 + '] 100.0 %  ' + formatSeconds(stage.elapsed())
+		self.stream.write(s + ' ' * max(0, self.lastLength - len(s)) + '\n')
+		self.stream.flush()
+
+
+class LogRenderer:
+	"""One line per stage start and end and at most one progress line every LogInterval seconds (for logs)"""
+	def __init__(self, stream=None):
+		self.stream = stream or sys.stdout
+		self.lastLine = {}
+
+
+	def start(self, stage):
+		self.lastLine[stage.name] = time.monotonic()
+		self._write('{}: started'.format(stage.name))
+
+
+	def progress(self, stage, msg=None):
+		now = time.monotonic()
+		if now - self.lastLine.get(stage.name, 0) < LogInterval:
+			return
+		self.lastLine[stage.name] = now
+		status = stage.status()
+		self._write('{}: {:.1f} %{}{}'.format(stage.name, 100 * stage.fraction, ' (' + status + ')' if status else '', ' ' + str(msg) if msg else ''))
+
+
+	def end(self, stage):
+		self.lastLine.pop(stage.name, None)
+		self._write('{}: done in {}'.format(stage.name, formatSeconds(stage.elapsed())))
+
+
+	def _write(self, line):
+		self.stream.write(line + '\n')
+		self.stream.flush()
+
+
+class Instrumentation:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.stages = [] # running stages, outermost first
+		self.finished = [] # (name, seconds, counters) of the finished stages
+		self.counters = {}
+		self.renderer = None
+		self.rendererName = 'auto'
+		self.metricsFile = None
+		self.profileStages = None # stages whose name contains this are profiled, '*' for the outermost stage
+		self.profile = None # the running Profile (only one at a time)
+
+
+	def configure(self, renderer='auto', metricsFilename=None, profile=None):
+		if renderer not in Renderers:
+			raise ValueError('Unknown renderer {} (available: {})'.format(renderer, ', '.join(Renderers)))
+		self.rendererName = renderer
+		self.renderer = None
+		if self.metricsFile:
+			self.metricsFile.close()
+		self.metricsFile = open(metricsFilename, 'a') if metricsFilename else None
+		self.profileStages = profile
+
+
+	def _renderer(self):
+		if self.renderer is None and self.rendererName != 'none':
+			isTty = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
+			useBar = self.rendererName == 'bar' or (self.rendererName == 'auto' and isTty)
+			self.renderer = BarRenderer() if useBar else LogRenderer()
+		return self.renderer
+
+
+	def emit(self, event, **fields):
+		if self.metricsFile is None:
+			return
+		record = {'event': event, 'time': time.time()}
+		record.update(fields)
+		with self.lock:
+			self.metricsFile.write(json.dumps(record, sort_keys=True) + '\n')
+			self.metricsFile.flush()
+
+
+	def beginStage(self, name, total=None, unit=None, render=True):
+		if self.stages:
+			name = self.stages[-1].name + '/' + name
+		stage = Stage(name, total, unit, render)
+		self.stages.append(stage)
+		self.emit('stage_start', stage=name, total=total)
+		if render and self._renderer():
+			self.renderer.start(stage)
+		if self.profileStages is not None and self.profile is None and (
+				self.profileStages in name or (self.profileStages == '*' and len(self.stages) == 1)):
+			self.profile = Profile(name)
+			stage.profiled = True
+		return stage
+
+
+	def endStage(self):
+		stage = self.stages.pop()
+		stage.fraction = 1.0
+		if stage.render and self.renderer:
+			self.renderer.end(stage)
+		seconds = stage.elapsed()
+		if stage.profiled:
+			filename, peak = self.profile.stop()
+			self.profile = None
+			self.emit('profile', stage=stage.name, filename=filename, peakTracedBytes=peak)
+		with self.lock:
+			self.finished.append((stage.name, seconds, dict(stage.counters)))
+		self.emit('stage_end', stage=stage.name, seconds=seconds, counters=stage.counters)
+
+
+	def progress(self, fraction, msg=None):
+		if not self.stages:
+			return
+		stage = self.stages[-1]
+		stage.fraction = min(max(fraction, 0.0), 1.0)
+		if stage.render and self.renderer:
+			self.renderer.progress(stage, msg)
+
+
+	def count(self, name, value=1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + value
+			for stage in self.stages:
+				stage.counters[name] = stage.counters.get(name, 0) + value
+
+
+	def takeCounters(self):
+		"""Returns the counters of a worker process and resets them. In the main process the counters are already counted
+		and an empty dictionary is returned, so the results of map() can be treated the same in both cases."""
+		if multiprocessing.parent_process() is None:
+			return {}
+		with self.lock:
+			counters = self.counters
+			self.counters = {}
+		return counters
+
+
+	def addCounters(self, counters):
+		for name, value in counters.items():
+			self.count(name, value)
+
+
+	def summary(self, stream=None):
+		"""Print the time and the counters of every finished stage"""
+		stream = stream or sys.stdout
+		if not self.finished:
+			return
+		stream.write('{:50s} {:>10s}  {}\n'.format('stage', 'time', 'counters'))
+		for name, seconds, counters in self.finished:
+			stream.write('{:50s} {:>10s}  {}\n'.format(name[-50:], formatSeconds(seconds) if seconds >= 1 else '{:.2f} s'.format(seconds),
+				', '.join('{}={}'.format(k, formatCounter(v)) for k, v in sorted(counters.items()))))
+		self.emit('summary', stages=[{'stage': name, 'seconds': seconds, 'counters': counters} for name, seconds, counters in self.finished],
+			counters=self.counters)
+
+
+def formatCounter(value):
+	if isinstance(value, float):
+		return '{:.2f}'.format(value)
+	return str(value)
+
+
+Default = Instrumentation()
+
+def configure(renderer='auto', metricsFilename=None, profile=None):
+	Default.configure(renderer, metricsFilename, profile)
+
+
+@contextmanager
+def stage(name, total=None, unit=None, render=True):
+	"""Run a named stage (nested in the running stage)"""
+	s = Default.beginStage(name, total, unit, render)
+	try:
+		yield s
+	finally:
+		Default.endStage()
+
+
+def progress(fraction, msg=None):
+	Default.progress(fraction, msg)
+
+
+def count(name, value=1):
+	Default.count(name, value)
+
+
+@contextmanager
+def timed(name):
+	"""Add the time spent in the block to the counter name (e.g. 'write_seconds')"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		Default.count(name, time.perf_counter() - start)
+
+
+def takeCounters():
+	return Default.takeCounters()
+
+
+def addCounters(counters):
+	Default.addCounters(counters)
+
+
+class Profile:
+	"""Profiles a stage with cProfile (time) and tracemalloc (memory). The cProfile data is written to profile.<stage>.prof"""
+	def __init__(self, name, top=20):
+		import cProfile
+		import tracemalloc
+		self.name = name
+		self.top = top
+		self.profiler = cProfile.Profile()
+		tracemalloc.start()
+		self.profiler.enable()
+
+
+	def stop(self):
+		import pstats
+		import tracemalloc
+		self.profiler.disable()
+		snapshot = tracemalloc.take_snapshot()
+		current, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+
+		filename = 'profile.{}.prof'.format(''.join(c if c.isalnum() else '_' for c in self.name))
+		self.profiler.dump_stats(filename)
+		print('\nProfile of {} (written to {}, view with python3 -m pstats {}):'.format(self.name, filename, filename))
+		pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(self.top)
+		print('Memory: peak {:.1f} MB traced by tracemalloc; top allocations:'.format(peak / 1024**2))
+		for statistic in snapshot.statistics('lineno')[:10]:
+			print('  ' + str(statistic))
+		return filename, peak
+
+
+def addArguments(parser):
+	parser.add_argument('--progress', type=str, default='auto', choices=Renderers, help='Progress output: bar (terminal), log (a line every few seconds, default if the output is not a terminal) or none')
+	parser.add_argument('--metrics', type=str, help='Append stage timings and counters as JSON lines to this file')
+	parser.add_argument('--profile', type=str, nargs='?', const='*', help='Profile the command (or the stages whose name contains the argument) with cProfile and tracemalloc')
+
+
+@contextmanager
+def session(args, name):
+	"""Configure the instrumentation from the command line arguments, run the command as stage and print the summary"""
+	configure(args.progress, args.metrics, args.profile)
+	with stage(name, render=False): # the stages of the command show their progress
+		yield
+	Default.summary()
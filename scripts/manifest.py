@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+import contextlib
+import util
+
+class ImportManifest:
+	"""Remembers which archives and archive members were already imported, so createDb only has to process new or changed ones.
+
+	For every archive the size, mtime and SHA-256 checksum are stored, and for every imported member its size, mtime,
+	content hash, the import mode and the ids of the RIRs that were created from it. A member is skipped if it is unchanged,
+	was imported in the same mode and all of its RIRs are still in the database. If the content of a member or the mode
+	changed (or the member was removed from the archive) its old RIRs are invalidated, i.e. removed with removeF.
+
+	mode is a JSON serializable value that describes how the RIRs are created from the members (e.g. multichannel or not).
+	"""
+	def __init__(self, filename, containsF, removeF, mode=None):
+		self.filename = filename
+		self.containsF = containsF
+		self.removeF = removeF
+		self.mode = mode
+		if os.path.isfile(filename):
+			with open(filename) as f:
+				data = json.load(f)
+		else:
+			data = {}
+		self.archives = data.get('archives', {})
+		self.members = data.get('members', {})
+		self.currentMembers = []
+		self.skipped = 0
+		self.added = 0
+		self.invalidated = 0
+
+
+	def track(self, archiveFilename, makeReader):
+		return ManifestReader(self, archiveFilename, makeReader)
+
+
+	def archiveUnchanged(self, archiveFilename):
+		"""Whether the archive is the same as in the last run and all its members were imported then"""
+		entry = self.archives.get(archiveFilename)
+		if entry is None or not entry.get('complete'):
+			return False
+		st = os.stat(archiveFilename)
+		if (st.st_size, int(st.st_mtime)) != (entry['size'], entry['mtime']):
+			if st.st_size != entry['size'] or util.fileChecksum(archiveFilename) != entry['sha256']:
+				return False
+			entry['mtime'] = int(st.st_mtime) # same content, just touched
+		return all(self._imported(m) for m in self.members.get(archiveFilename, {}).values())
+
+
+	def beginArchive(self, archiveFilename):
+		st = os.stat(archiveFilename)
+		entry = self.archives.get(archiveFilename, {})
+		if (st.st_size, int(st.st_mtime)) != (entry.get('size'), entry.get('mtime')):
+			entry = {'size': st.st_size, 'mtime': int(st.st_mtime), 'sha256': util.fileChecksum(archiveFilename)}
+		entry['complete'] = False
+		self.archives[archiveFilename] = entry
+		return self.members.setdefault(archiveFilename, {})
+
+
+	def endArchive(self, archiveFilename, names):
+		members = self.members[archiveFilename]
+		for name in set(members.keys()) - set(names):
+			self.invalidate(members.pop(name))
+		self.archives[archiveFilename]['complete'] = True
+
+
+	def invalidate(self, member):
+		for id in member['ids']:
+			self.removeF(id)
+		self.invalidated += 1
+
+
+	def addId(self, id):
+		"""Record that the member that is imported at the moment (and the other members of its group) created the RIR id"""
+		for member in self.currentMembers:
+			if id not in member['ids']:
+				member['ids'].append(id)
+
+
+	def current(self):
+		"""The members that are imported at the moment. Importers that create the RIRs later (e.g. after parsing several
+		members in parallel) pass them to attributing() when they insert the RIRs."""
+		return self.currentMembers
+
+
+	@contextlib.contextmanager
+	def attributing(self, members):
+		"""RIR ids added within the block are recorded for the given members"""
+		previous = self.currentMembers
+		self.currentMembers = members
+		try:
+			yield
+		finally:
+			self.currentMembers = previous
+
+
+	def _imported(self, member):
+		"""Whether the member was imported in the current mode and all its RIRs are in the database"""
+		return member.get('mode') == self.mode and len(member['ids']) > 0 and all(self.containsF(id) for id in member['ids'])
+
+
+	def save(self):
+		with util.atomicFile(self.filename) as tmpFilename, open(tmpFilename, 'w') as f:
+			json.dump({'archives': self.archives, 'members': self.members}, f, sort_keys=True, indent=4)
+
+
+	def report(self):
+		print('Members skipped: {}, added: {}, invalidated: {}'.format(self.skipped, self.added, self.invalidated))
+
+
+class ManifestReader:
+	"""Wraps a DirectoryReader or ArchiveReader and only returns members that have to be imported"""
+	def __init__(self, manifest, archiveFilename, makeReader):
+		self.manifest = manifest
+		self.archiveFilename = archiveFilename
+		self.makeReader = makeReader
+		self.unchanged = manifest.archiveUnchanged(archiveFilename)
+		self._reader = None
+
+
+	@property
+	def reader(self):
+		if self._reader is None:
+			self._reader = self.makeReader()
+		return self._reader
+
+
+	def names(self):
+		if self.unchanged: # no need to look into the archive at all
+			return list(self.manifest.members[self.archiveFilename].keys())
+		return self.reader.names()
+
+
+	def stat(self, name):
+		return self.reader.stat(name)
+
+
+	def open(self, names, groups=None):
+		"""Yields the members that have to be imported.
+
+		groups optionally maps the names to a group key, e.g. for the channels of a multichannel measurement that are combined
+		to one RIR. A group is imported again as a whole if one of its members changed.
+		"""
+		names = list(names)
+		if self.unchanged:
+			self.manifest.skipped += len(names)
+			return
+
+		manifest = self.manifest
+		members = manifest.beginArchive(self.archiveFilename)
+		changed = []
+		for name in names:
+			size, mtime = self.reader.stat(name)
+			member = members.get(name)
+			if member is None or (member['size'], member['mtime']) != (size, mtime) or not manifest._imported(member):
+				changed.append(name)
+		if groups is not None:
+			changedGroups = set(groups[name] for name in changed)
+			changed = [name for name in names if groups[name] in changedGroups]
+		manifest.skipped += len(names) - len(changed)
+
+		groupMembers = {}
+		for name, file in self.reader.open(changed, groups):
+			size, mtime = self.reader.stat(name)
+			contentHash = ManifestReader._contentHash(file)
+			member = members.get(name)
+			if groups is None and member is not None and member['sha256'] == contentHash and manifest._imported(member):
+				member['size'], member['mtime'] = size, mtime # same content, just touched
+				manifest.skipped += 1
+				continue
+			if member is not None:
+				manifest.invalidate(member)
+
+			member = {'size': size, 'mtime': mtime, 'sha256': contentHash, 'mode': manifest.mode, 'ids': []}
+			members[name] = member
+			if groups is None:
+				manifest.currentMembers = [member]
+			else:
+				manifest.currentMembers = groupMembers.setdefault(groups[name], [])
+				manifest.currentMembers.append(member)
+			yield name, file
+			manifest.currentMembers = []
+			manifest.added += 1
+
+		manifest.endArchive(self.archiveFilename, self.names())
+
+
+	@staticmethod
+	def _contentHash(file):
+		if isinstance(file, str):
+			return util.fileChecksum(file)
+		return hashlib.sha256(file.getvalue()).hexdigest()
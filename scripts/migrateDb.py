@@ -0,0 +1,22 @@
+import os
+import argparse
+import database
+
+def main(sourceFilename, targetFilename, force=False):
+	if os.path.isfile(targetFilename) and not force:
+		raise RuntimeError('{} already exists (use --force to overwrite it)'.format(targetFilename))
+
+	source = database.openDb(sourceFilename)
+	target = database.openDb(targetFilename, deleteBefore=True)
+	database.copyDb(source, target)
+	print('Copied {} RIRs from {} to {}'.format(len(target), sourceFilename, targetFilename))
+	target.close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert the RIR database between the storage formats (JSON: .json, SQLite: .sqlite/.sqlite3/.db), e.g. to migrate an existing db.json to SQLite or to export a SQLite database as JSON')
+	parser.add_argument('source', type=str, help='Database to read from')
+	parser.add_argument('target', type=str, help='Database to create')
+	parser.add_argument('-f', '--force', action='store_true', help='Overwrite the target if it exists')
+	args = parser.parse_args()
+	main(args.source, args.target, args.force)
@@ -1,60 +1,212 @@
 from os.path import join, isfile
+from functools import partial
+from multiprocessing import Pool
+import os
 import argparse
-import json
 import numpy as np
 import soundfile as sf
 import shutil
-from scikits.samplerate import resample
+import resamplers
+import audioFormats
 import util
+import instrument
+import database
+from resampleCache import ResampleCache
 
 ImportDir = 'wav.imported'
 NormalizeDir = 'wav.normalized'
+BatchSize = 16 # RIRs per job, their signals are trimmed and normalized together (see normalizeSignals)
 
-def main(dbFilename, targetFs, force=False):
-	util.createDirectory(NormalizeDir)
+def normalizedFilename(rir, targetFs, multiRate, outputFormat=audioFormats.DefaultFormat):
+	"""With several target rates every rate gets its own directory (e.g. wav.normalized/16000)"""
+	if multiRate:
+		return join(NormalizeDir, str(targetFs), rir['id'] + audioFormats.extension(outputFormat))
+	return join(NormalizeDir, rir['id'] + audioFormats.extension(outputFormat))
 
-	rirDb = json.load(open(dbFilename))
 
-	bar = util.ConsoleProgressBar()
-	bar.start('Normalize RIRs')
-	i = 0
-	for rirId, rir in rirDb.items():
-		targetFilename = join(NormalizeDir, rir['id'] + '.wav')
-		if not force:
-			if rir['filename'] == targetFilename and \
-				rir['fs'] == targetFs and \
-				targetFilename:
-				continue
+def isNormalized(rir, targetFs, multiRate, outputFormat=audioFormats.DefaultFormat):
+	targetFilename = normalizedFilename(rir, targetFs, multiRate, outputFormat)
+	normalized = rir.get('normalized', {}).get(str(targetFs))
+	if normalized is not None:
+		return normalized['filename'] == targetFilename and isfile(targetFilename)
+	# databases normalized before the per-rate entries existed
+	return rir['filename'] == targetFilename and rir['fs'] == targetFs and isfile(targetFilename)
+
+
+def normalizeRir(rir, targetRates, multiRate=False, cache=None, resampler=('libsamplerate', 'best'), outputFormat=audioFormats.DefaultFormat):
+	"""Resample, trim and normalize a single RIR to all target sampling rates and write the results to the NormalizeDir.
+
+	The imported RIR is read only once. The rates are processed from high to low, so a lower rate is resampled from an
+	already resampled signal if its rate is a multiple of the lower one (e.g. 8 kHz from 16 kHz instead of from 48 kHz).
+	resampler is the (backend, quality) used by resamplers.resample. If a ResampleCache is given, resampled signals are
+	taken from / stored in the cache. The results are written in the outputFormat (see audioFormats).
+
+	This runs in the worker processes when normalizing in parallel (as normalizeRirs for a batch of RIRs), so it only gets
+	and returns plain data:
+	The returned dictionary contains the entries per rate that have to be updated in rir['normalized'].
+	"""
+	return normalizeRirs([(rir, targetRates)], multiRate, cache, resampler, outputFormat)[0]
+
+
+def normalizeRirs(jobs, multiRate=False, cache=None, resampler=('libsamplerate', 'best'), outputFormat=audioFormats.DefaultFormat):
+	"""normalizeRir for a list of (rir, targetRates), returns the list of the results"""
+	signals = []
+	for rir, targetRates in jobs:
+		importedFilename = audioFormats.find(join(ImportDir, rir['id']))
+		if importedFilename is None:
+			raise RuntimeError('{} was imported without a copy in {} (createDb.py --noImportCopy), import it again to normalize it to other rates'.format(rir['id'], ImportDir))
+		x, fs_x = audioFormats.read(importedFilename, dtype='float32')
+		instrument.count('files_decoded')
+		signals.append((x, fs_x, rir, targetRates))
+	return normalizeSignals(signals, multiRate, cache, resampler, outputFormat)
 
-		x, fs_x = sf.read(join(ImportDir, rir['id'] + '.wav'), dtype='float32')
-		y, fs_y = x, fs_x
+
+def normalizeSignal(x, fs_x, rir, targetRates, multiRate=False, cache=None, resampler=('libsamplerate', 'best'), outputFormat=audioFormats.DefaultFormat):
+	"""normalizeRir for a signal (float32) that is already decoded, e.g. by an importer (createDb.py --normalize)"""
+	return normalizeSignals([(x, fs_x, rir, targetRates)], multiRate, cache, resampler, outputFormat)[0]
+
+
+def resampleRates(x, fs_x, targetRates, cache=None, resampler=('libsamplerate', 'best')):
+	"""Yields (targetFs, x resampled to targetFs) for all target rates, from high to low (see normalizeRir)"""
+	resampled = {fs_x: x}
+	for targetFs in sorted(targetRates, reverse=True):
+		fs_y = min((fs for fs in resampled if fs % targetFs == 0), default=fs_x)
+		y = resampled[fs_y]
 
 		if fs_y != targetFs:
-			y = resample(y, targetFs / fs_y, 'sinc_best')
-			fs_y = targetFs
+			resampleF = lambda x: resamplers.resample(x, fs_y, targetFs, *resampler)
+			with instrument.timed('resample_seconds'):
+				if cache:
+					y = cache.resample(y, fs_y, targetFs, resamplers.converterName(*resampler), resampleF)
+				else:
+					y = resampleF(y)
+			resampled[targetFs] = y
+		yield targetFs, y
+
+
+def normalizeSignals(signals, multiRate=False, cache=None, resampler=('libsamplerate', 'best'), outputFormat=audioFormats.DefaultFormat):
+	"""normalizeSignal for a list of (x, fs_x, rir, targetRates), returns the list of the results.
+
+	The resampled signals of all RIRs are trimmed and normalized in batches (util.trimSilenceBatch), which saves the
+	overhead of processing short RIRs one at a time.
+	"""
+	resampled = [(i, targetFs, y) for i, (x, fs_x, rir, targetRates) in enumerate(signals)
+		for targetFs, y in resampleRates(x, fs_x, targetRates, cache, resampler)]
+
+	entries = {}
+	for batch, X, lengths in util.paddedBatches([y for _, _, y in resampled]):
+		left, right, gains = util.trimSilenceBatch(X, lengths, 0.001, trimRight=False)
+		for k, (j, l, r, gain) in enumerate(zip(batch, left, right, gains)):
+			i, targetFs, y = resampled[j]
+			length_org = len(y) / targetFs
+			y = util.normalizeAmplitude(X[k, l:r], gain)
+
+			targetFilename = normalizedFilename(signals[i][2], targetFs, multiRate, outputFormat)
+			with instrument.timed('write_seconds'):
+				audioFormats.write(targetFilename, y, targetFs, outputFormat)
+			instrument.count('files_written')
+
+			entries[j] = {
+				'filename': targetFilename,
+				'length': len(y) / targetFs,
+				'length_org': length_org,
+			}
 
-		rir['length_org'] = len(y) / fs_y
-		y = util.trimSilence(y, 0.001, trimRight=False)
-		y = util.normalizeAmplitude(y)
+	normalized = [{} for _ in signals]
+	for j, (i, targetFs, y) in enumerate(resampled): # in the order of the rates, as without batches
+		normalized[i][str(targetFs)] = entries[j]
+	return normalized
 
-		sf.write(targetFilename, y, fs_y)
-		
-		rir['filename'] = targetFilename
-		rir['fs'] = fs_y
-		rir['length'] = len(y) / fs_y
 
-		i += 1
-		bar.progress(i / len(rirDb))
+def createDirectories(targetRates):
+	util.createDirectory(NormalizeDir)
+	if len(targetRates) > 1:
+		for targetFs in targetRates:
+			util.createDirectory(join(NormalizeDir, str(targetFs)))
+
+
+def updateRir(rir, normalized, primaryFs):
+	"""Add the result of normalizeRir to the RIR; filename, fs, length and length_org refer to the primary rate"""
+	rir.setdefault('normalized', {}).update(normalized)
+	primary = rir['normalized'].get(str(primaryFs))
+	if primary is not None:
+		rir.update(primary)
+		rir['fs'] = primaryFs
+
+
+def normalizeJob(job, multiRate, cache, resampler, outputFormat):
+	"""Returns the results of normalizeRirs for a list of (rir, rates) and the counters of the instrumentation (which are
+	per process)"""
+	return normalizeRirs(job, multiRate, cache, resampler, outputFormat), instrument.takeCounters()
+
+
+def main(dbFilename, targetRates, force=False, jobs=1, cacheDir=None, cacheSize=4 * 1024**3, resampler='libsamplerate', quality='best',
+		outputFormat=audioFormats.DefaultFormat, checkpointInterval=database.CheckpointInterval):
+	"""Normalize all RIRs to the target sampling rate(s).
+
+	The results for every rate are stored in rir['normalized'][str(fs)]. The entries filename, fs, length and length_org
+	of the RIR itself refer to the first of the target rates.
+	"""
+	if isinstance(targetRates, int):
+		targetRates = [targetRates]
+	multiRate = len(targetRates) > 1
+
+	rirDb = database.openDb(dbFilename)
+	createDirectories(targetRates)
+
+	todo = []
+	for rirId, rir in rirDb.items():
+		rates = [fs for fs in targetRates if force or not isNormalized(rir, fs, multiRate, outputFormat)]
+		if rates:
+			todo.append((rir, rates))
+
+	cache = ResampleCache(cacheDir, cacheSize) if cacheDir else None
+	worker = partial(normalizeJob, multiRate=multiRate, cache=cache, resampler=(resampler, quality), outputFormat=outputFormat)
+	pool = Pool(jobs) if jobs > 1 else None
+	# a job is a batch of RIRs; imap keeps their order, so the database is updated in the same order as in the serial case
+	jobs = [todo[i:i + BatchSize] for i in range(0, len(todo), BatchSize)]
+	results = pool.imap(worker, jobs) if pool else map(worker, jobs)
+
+	primaryFs = targetRates[0]
+	bar = util.ConsoleProgressBar()
+	bar.start('Normalize RIRs', len(todo), 'RIRs')
+	# the files are complete when they are renamed into place, and the database is committed every checkpointInterval
+	# seconds, so a killed run continues with the RIRs normalized after the last checkpoint
+	try:
+		with database.Checkpoint(rirDb, checkpointInterval) as checkpoint:
+			done = 0
+			for job, (normalized, counters) in zip(jobs, results):
+				instrument.addCounters(counters)
+				for (rir, rates), entries in zip(job, normalized):
+					updateRir(rir, entries, primaryFs)
+					rirDb[rir['id']] = rir
+					checkpoint()
+					done += 1
+				bar.progress(done / len(todo))
+	finally:
+		if pool:
+			pool.terminate()
 	bar.end()
 
-	with open(dbFilename, 'w') as dbFile:
-		json.dump(rirDb, dbFile, sort_keys=True, indent=4)
+
+def cli(argv=None, prog=None):
+	parser = argparse.ArgumentParser(prog=prog, description='Create normalized versions of all RIRs in the database')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('-fs', '--samplingrate', type=str, default='16000', help='Target sampling rate in Hz, or a comma separated list of rates (e.g. 8000,16000,48000) which are written to wav.normalized/<rate>')
+	parser.add_argument('-f', '--force', action='store_true', help='By default this script will skip RIRs that were already normalized.')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes (0: use all cores)')
+	parser.add_argument('--cacheDir', type=str, help='Keep the resampled RIRs in this directory, so they do not have to be resampled again (e.g. when switching between sampling rates)')
+	parser.add_argument('--cacheSize', type=float, default=4, help='Maximum size of the cache in GB; least recently used entries are deleted')
+	parser.add_argument('--resampler', type=str, default='libsamplerate', choices=resamplers.Backends, help='Resampling backend')
+	parser.add_argument('--quality', type=str, default='best', choices=resamplers.Qualities, help='Quality (and speed) tier of the resampler (not used by fft)')
+	parser.add_argument('--format', type=str, default=audioFormats.DefaultFormat, choices=list(audioFormats.Formats), help='Format of the normalized files (compare them with benchFormats.py)')
+	parser.add_argument('--checkpointInterval', type=float, default=database.CheckpointInterval, help='Seconds between commits of the database; a killed run continues after the last commit')
+	instrument.addArguments(parser)
+	args = parser.parse_args(argv)
+	with instrument.session(args, 'normalize'):
+		main(args.database, [int(fs) for fs in args.samplingrate.split(',')], args.force, args.jobs or os.cpu_count(), args.cacheDir, int(args.cacheSize * 1024**3), args.resampler, args.quality, args.format,
+			args.checkpointInterval)
 
 
 if __name__ == '__main__':
-	parser = argparse.ArgumentParser(description='Create normalized versions of all RIRs in the database')
-	parser.add_argument('-db', '--database', type=str, default='db.json')
-	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Target sampling rate in Hz')
-	parser.add_argument('-f', '--force', action='store_true', help='By default this script will skip RIRs that were already normalized.')
-	args = parser.parse_args()
-	main(args.database, args.samplingrate, args.force)
+	cli()
@@ -2,7 +2,7 @@ import os
 import re
 import util
 import fnmatch
-from os.path import join, split
+from os.path import join, split, basename
 
 """
 Name: Acoustic Characterisation of Environments (ACE) Corpus
@@ -14,28 +14,32 @@ License: Creative Commons Attribution-NoDerivatives 4.0 International License
 Paper: J. Eaton, A. H. Moore, N. D. Gaubitch, and P. A. Naylor, “The ACE challenge – corpus description and performance evaluation,” Proc. IEEE Workshop on Applications of Signal Processing to Audio and Acoustics (WASPAA) , New Paltz, NY, USA, Oct. 2015
 """
 
-def importRirs(downloadDir, insertIntoDbF):
-	url = 'http://www.commsp.ee.ic.ac.uk/~sap/uploads/data/ACE/ACE_Corpus_RIRN_Single.tbz2'
-	filename = join(downloadDir, 'ace.tbz2')
-	unpackDir = join(downloadDir, 'ace')
+Url = 'http://www.commsp.ee.ic.ac.uk/~sap/uploads/data/ACE/ACE_Corpus_RIRN_Single.tbz2'
 
-	dl = util.FileDownloader(url, filename)
+def downloads(downloadDir):
+	return [util.FileDownloader(Url, join(downloadDir, 'ace.tbz2'))]
+
+
+def importRirs(downloadDir, insertIntoDbF, *, stream=False, manifest=None, multichannel=False, jobs=1):
+	# the single microphone corpus has one channel per RIR, so multichannel does not change anything
+	dl, = downloads(downloadDir)
 	dl.download()
-	dl.unpackTo(unpackDir)
+	reader = dl.open(join(downloadDir, 'ace'), stream=stream, manifest=manifest)
 
-	files = []
-	for root, dirnames, filenames in os.walk(unpackDir):
-		for filename in fnmatch.filter(filenames, '*_RIR.wav'):
-			files.append(join(root, filename))
+	files = [name for name in reader.names() if fnmatch.fnmatch(basename(name), '*_RIR.wav')]
 
-	bar = util.ConsoleProgressBar()
-	bar.start('Import ACE')
+	rirs = {}
 	for i, file in enumerate(sorted(files)): # we sort to get same identifiers cross-platform
 		try:
 			*_, room, measurement, _ = util.pathParts(file)
 		except:
 			raise RuntimeError('Could not get room from %s' % file)
-		identifier = '{:04d}_{}_{}'.format(i, room.lower(), measurement)
+		rirs[file] = ('{:04d}_{}_{}'.format(i, room.lower(), measurement), room)
+
+	bar = util.ConsoleProgressBar()
+	bar.start('Import ACE', len(files), 'files')
+	for i, (name, file) in enumerate(reader.open(files)):
+		identifier, room = rirs[name]
 		insertIntoDbF(file, identifier, {
 			'source': 'ACE',
 			'room': room,
@@ -1,6 +1,13 @@
 import re
 import os
+import io
+import json
+import hashlib
+import contextlib
+from functools import partial
+from multiprocessing import Pool
 import util
+import instrument
 from os.path import join
 import numpy as np
 import soundfile as sf
@@ -23,6 +30,8 @@ Jeub, M., Schäfer, M. und Vary, P.:
 in: Proceedings of International Conference on Digital Signal Processing (DSP), (Santorini, Greece), IEEE, Juli 2009, S. 1–4, ISBN: 978-1-42443-298-1.
 """
 
+ParseBatchSize = 32 # files per worker that are read from the archive before they are parsed
+
 RirTypes = {
 	'1': 'binaural',
 	'2': 'phone',
@@ -36,9 +45,11 @@ Distances = {
 	'aula_carolina': [1, 2, 3, 5, 10, 15, 20],
 }
 
-def loadAirRir(filename):
+def loadAirRir(file, filename=None):
 	"""Load a RIR struct from AIR database format. Returns the RIR itself and a dictionary with information about it.
 
+	file can be a filename or a file object; in the latter case filename is the name of the file to parse the information from.
+
 	Possible Dictionary entries (not all must be available)
 		fs          Sampling frequency
 		rir_type    Type of impulse response
@@ -76,9 +87,18 @@ def loadAirRir(filename):
 		                for 'rir_type=1' & 'room=5' -> 0:15:180
 		                for 'rir_type=1' & 'room=11'& distance=3 ->0:45:180
 	"""
-	dic = scipy.io.loadmat(filename, struct_as_record = False)
+	if filename is None: filename = file
+	dic = scipy.io.loadmat(file, struct_as_record=False, variable_names=['h_air', 'air_info'])
 	x = dic['h_air'][0]
-	air_info = dic['air_info'][0][0] # air_info contains some more infos about the RIR
+	return x, parseAirInfo(dic['air_info'][0][0], filename) # air_info contains some more infos about the RIR
+
+
+RirTypePattern = re.compile(r'air_([^_]+)_')
+PhonePattern = re.compile(r'air_phone_(.+)_(\w{3,4})_(\d+).mat')
+BinauralPatterns = {} # room -> compiled pattern
+
+def parseAirInfo(air_info, filename):
+	"""Information about a RIR from its air_info struct and its filename (see loadAirRir)"""
 	info = {
 		'fs': int(air_info.fs[0][0]),
 		'room': str(air_info.room[0]),
@@ -88,21 +108,24 @@ def loadAirRir(filename):
 
 	# Apparently the struct is no complete and we have to parse further information from the filename
 	# rir_type
-	m = re.search(r'air_([^_]+)_', filename)
+	m = RirTypePattern.search(filename)
 	assert m, 'Could not parse rir_type from filename {}'.format(filename)
-	info['rir_type'] = 'binaural' if 'binaural' in util.baseFilename(filename) else 'phone'
+	info['rir_type'] = 'binaural' if m.group(1) == 'binaural' else 'phone'
 
 	# further parsing depending on rir_type
-	if info['rir_type'] == 'binaural': 
-		m = re.search(r'air_binaural_' + info['room'] + r'_(\d+)_(\d+)_(\d+)_?([\d_]*).mat', filename)
+	if info['rir_type'] == 'binaural':
+		pattern = BinauralPatterns.get(info['room'])
+		if pattern is None:
+			pattern = BinauralPatterns[info['room']] = re.compile(r'air_binaural_' + info['room'] + r'_(\d+)_(\d+)_(\d+)_?([\d_]*).mat')
+		m = pattern.search(filename)
 		assert m, 'Could not parse filename {} (info: {})'.format(filename, info)
 		assert int(m.group(1)) == info['channel']
 		assert int(m.group(2)) == info['head']
 		info['rir_no'] = int(m.group(3))
 		if m.group(4): info['azimuth'] = str(m.group(4))
 		info['distanceInMeter'] = Distances[info['room']][info['rir_no'] - 1]
-	elif info['rir_type'] == 'phone':
-		m = re.search(r'air_phone_(.+)_(\w{3,4})_(\d+).mat', filename)
+	else:
+		m = PhonePattern.search(filename)
 		assert m, 'Could not parse filename {} (info: {})'.format(filename, info)
 		
 		info['mock_up_type'] = 'BT' if '_BT_' in filename else 'BB'
@@ -110,34 +133,138 @@ def loadAirRir(filename):
 
 		info['phone_pos'] = str(air_info.phone_pos[0])
 		assert m.group(2) == info['phone_pos']
-	else:
-		raise RuntimeError('Unknown rir_type {}'.format(info['rir_type']))
 
-	return x, info
+	return info
 
 
-def importRirs(downloadDir, insertIntoDbF):
-	url = 'https://www2.iks.rwth-aachen.de/air/air_database_release_1_4.zip'
-	filename = join(downloadDir, 'air_1_4.zip')
-	unpackDir = join(downloadDir, 'air_1_4')
+def parseMember(member):
+	"""Load a RIR from (name, path or file content); runs in the worker processes"""
+	name, data = member
+	return loadAirRir(data if isinstance(data, str) else io.BytesIO(data), name)
 
-	dl = util.FileDownloader(url, filename)
+
+def loadKnownMember(name, data, fs):
+	"""Load only the RIR of a file whose information is already known"""
+	instrument.count('files_decoded')
+	x = scipy.io.loadmat(data if isinstance(data, str) else io.BytesIO(data), variable_names=['h_air'])['h_air'][0]
+	return x, fs
+
+
+Url = 'https://www2.iks.rwth-aachen.de/air/air_database_release_1_4.zip'
+
+def downloads(downloadDir):
+	return [util.FileDownloader(Url, join(downloadDir, 'air_1_4.zip'))]
+
+
+def importRirs(downloadDir, insertIntoDbF, *, stream=False, manifest=None, multichannel=False, jobs=1):
+	"""The .mat files are parsed by jobs worker processes. The information about every file is cached per name and content
+	hash (in download/air_1_4.metadata.json), so files whose RIR is already in the database do not have to be parsed again."""
+	dl, = downloads(downloadDir)
 	dl.download()
-	dl.unpackTo(unpackDir)
+	reader = dl.open(join(downloadDir, 'air_1_4'), stream=stream, manifest=manifest)
+
+	files = [name for name in reader.names() if name.startswith('AIR_1_4/') and os.path.splitext(name)[1] == '.mat']
+	if multichannel:
+		importMultichannelRirs(reader, files, insertIntoDbF)
+		return
+	index = {file: i for i, file in enumerate(sorted(files))} # we sort to get same identifiers cross-platform
 
-	files = []
-	for root, dirnames, filenames in os.walk(join(unpackDir, 'AIR_1_4')):
-		for filename in filenames:
-			if os.path.splitext(filename)[1] != '.mat': continue
-			files.append(join(root, filename))
+	metadataFilename = join(downloadDir, 'air_1_4.metadata.json')
+	metadata = {}
+	if os.path.isfile(metadataFilename):
+		with open(metadataFilename) as f:
+			metadata = json.load(f)
+
+	def insert(name, x, info, members):
+		identifier = '{:04d}_{}_{}'.format(index[name], info['rir_type'][:2], info['room'])
+		with manifest.attributing(members) if manifest else contextlib.nullcontext():
+			insertIntoDbF(x, identifier, dict(info, source='AIR'))
 
 	bar = util.ConsoleProgressBar()
-	bar.start('Import AIR')
-	for i, file in enumerate(sorted(files)): # we sort to get same identifiers cross-platform
-		x, info = loadAirRir(file)
-		info['source'] = 'AIR'
-		identifier = '{:04d}_{}_{}'.format(i, info['rir_type'][:2], info['room'])
-		insertIntoDbF((x, int(info['fs'])), identifier, info)
-		bar.progress(i / len(files))
+	bar.start('Import AIR', len(files), 'files')
+	pool = Pool(jobs) if jobs > 1 else None
+	pending = [] # (name, data, cache key, manifest members) of the files that have to be parsed
+	done = 0
+	def parsePending():
+		nonlocal done
+		members = [(name, data) for name, data, _, _ in pending]
+		for (name, _, key, manifestMembers), (x, info) in zip(pending, pool.imap(parseMember, members) if pool else map(parseMember, members)):
+			instrument.count('files_decoded')
+			metadata[key] = info
+			insert(name, (x, info['fs']), info, manifestMembers)
+			done += 1
+			bar.progress(done / len(files))
+		pending.clear()
+
+	try:
+		for name, file in reader.open(files):
+			data = file if isinstance(file, str) else file.getvalue()
+			# the information depends on the name as well (e.g. rir_no), so identical files with different names are different
+			key = '{}:{}'.format(name, util.fileChecksum(data) if isinstance(data, str) else hashlib.sha256(data).hexdigest())
+			manifestMembers = manifest.current() if manifest else None
+			info = metadata.get(key)
+			if info is not None: # known file: the RIR is only loaded if it has to be inserted
+				insert(name, partial(loadKnownMember, name, data, info['fs']), info, manifestMembers)
+				done += 1
+				bar.progress(done / len(files))
+			else:
+				pending.append((name, data, key, manifestMembers))
+				if len(pending) >= ParseBatchSize * max(jobs, 1):
+					parsePending()
+		parsePending()
+	finally:
+		if pool:
+			pool.terminate()
 	bar.end()
 
+	with util.atomicFile(metadataFilename) as tmpFilename, open(tmpFilename, 'w') as f:
+		json.dump(metadata, f, sort_keys=True, indent=4)
+
+
+
+# the channel is part of the filename, e.g. air_binaural_office_<channel>_1_3.mat, air_phone_BT_office_hhp_<channel>.mat
+ChannelPatterns = [
+	re.compile(r'^(.*air_binaural_[a-z_]+?)_(\d+)(_\d+_\d+_?[\d_]*\.mat)$'),
+	re.compile(r'^(.*air_phone_.+)_(\d+)(\.mat)$'),
+]
+ChannelNames = {
+	'binaural': ['right', 'left'],
+}
+
+def channelOfFile(filename):
+	"""Returns the name of the measurement (filename without the channel) and the channel"""
+	for pattern in ChannelPatterns:
+		m = pattern.match(filename)
+		if m:
+			return m.group(1) + m.group(3), int(m.group(2))
+	raise RuntimeError('Could not parse channel from filename {}'.format(filename))
+
+
+def importMultichannelRirs(reader, files, insertIntoDbF):
+	"""Import the channels of a measurement (left and right of the binaural RIRs, both microphones of the phone) as one RIR"""
+	groups = {}
+	for file in files:
+		measurement, channel = channelOfFile(file)
+		groups.setdefault(measurement, []).append((channel, file))
+	channelNumbers = {key: [channel for channel, _ in sorted(channels)] for key, channels in groups.items()}
+	groups = {key: [file for _, file in sorted(channels)] for key, channels in groups.items()}
+	index = {key: i for i, key in enumerate(sorted(groups))} # we sort to get same identifiers cross-platform
+
+	bar = util.ConsoleProgressBar()
+	bar.start('Import AIR (multichannel)', len(groups), 'RIRs')
+	for j, (key, channels) in enumerate(util.readChannelGroups(reader, groups, lambda name, file: loadAirRir(file, name))):
+		info = channels[0][1]
+		for (_, channelInfo), channel in zip(channels, channelNumbers[key]):
+			assert channelInfo['channel'] == channel, 'Channel of {} does not match its filename'.format(key)
+		del info['channel']
+		info['source'] = 'AIR'
+		info['channels'] = len(channels)
+		names = ChannelNames.get(info['rir_type'], [])
+		info['array'] = {
+			'type': info['rir_type'],
+			'channelNames': [names[c] if c < len(names) else str(c) for c in channelNumbers[key]],
+		}
+		identifier = '{:04d}_{}_{}_{}ch'.format(index[key], info['rir_type'][:2], info['room'], len(channels))
+		insertIntoDbF((util.stackChannels([x for x, _ in channels]), int(info['fs'])), identifier, info)
+		bar.progress(j / len(groups))
+	bar.end()
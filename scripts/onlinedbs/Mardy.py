@@ -1,7 +1,7 @@
 import re
 import util
-from glob import glob
-from os.path import join, basename
+import soundfile as sf
+from os.path import join
 
 """
 Name: Multichannel Acoustic Reverberation Database at York (MARDY) Database
@@ -19,35 +19,78 @@ Positions = {
 	'R': 'right',
 }
 
-def importRirs(downloadDir, insertIntoDbF):
-	url = 'http://www.commsp.ee.ic.ac.uk/~sap/uploads/data/MARDY.rar'
-	filename = join(downloadDir, 'mardy.rar')
-	unpackDir = join(downloadDir, 'mardy')
-	
-	dl = util.FileDownloader(url, filename)
+# spacing of the microphones in the linear array (8 microphones)
+ArraySpacingInMeter = 0.05
+
+Url = 'http://www.commsp.ee.ic.ac.uk/~sap/uploads/data/MARDY.rar'
+
+def downloads(downloadDir):
+	return [util.FileDownloader(Url, join(downloadDir, 'mardy.rar'))]
+
+
+def importRirs(downloadDir, insertIntoDbF, *, stream=False, manifest=None, multichannel=False, jobs=1):
+	dl, = downloads(downloadDir)
 	dl.download()
-	dl.unpackTo(unpackDir)
+	reader = dl.open(join(downloadDir, 'mardy'), stream=stream, manifest=manifest) # rar archives are always extracted
 
-	fileSelector = join(unpackDir, '*.wav')
-	files = list(glob(fileSelector))
+	files = [name for name in reader.names() if '/' not in name and name.endswith('.wav')]
+	if multichannel:
+		importArrayRirs(reader, files, insertIntoDbF)
+		return
 
-	bar = util.ConsoleProgressBar()
-	bar.start('Import MARDY')
+	rirs = {}
 	for i, file in enumerate(sorted(files)): # we sort to get same identifiers cross-platform
-		filename = basename(file)
-		m = re.search(r'ir_(\d)_([LCR])_(\d).wav', filename)
-		assert m, 'Could not parse rir info from filename {}'.format(filename)
+		m = re.search(r'ir_(\d)_([LCR])_(\d).wav', file)
+		assert m, 'Could not parse rir info from filename {}'.format(file)
 		assert m.group(2) in Positions, 'invalid position {}'.format(m.groups(2))
 		distanceInMeter = int(m.group(1))
 		position = Positions[m.group(2)]
 		microphoneIndexInArray = int(m.group(3))
 		if microphoneIndexInArray == 4:
 			identifier = '{:04d}_{}_{}'.format(i, distanceInMeter, position[0])
-			insertIntoDbF(file, identifier, {
-				'source': 'MARDY',
-				'distanceInMeter': distanceInMeter,
-				'position': position,
-			})
-		bar.progress(i / len(files))
+			rirs[file] = (identifier, distanceInMeter, position)
+
+	bar = util.ConsoleProgressBar()
+	bar.start('Import MARDY', len(rirs), 'files')
+	for i, (name, file) in enumerate(reader.open(rirs)):
+		identifier, distanceInMeter, position = rirs[name]
+		insertIntoDbF(file, identifier, {
+			'source': 'MARDY',
+			'distanceInMeter': distanceInMeter,
+			'position': position,
+		})
+		bar.progress(i / len(rirs))
 	bar.end()
 
+
+def importArrayRirs(reader, files, insertIntoDbF):
+	"""Import all microphones of the array for each loudspeaker position as one multichannel RIR"""
+	groups = {}
+	for file in files:
+		m = re.search(r'ir_(\d)_([LCR])_(\d).wav', file)
+		assert m, 'Could not parse rir info from filename {}'.format(file)
+		groups.setdefault((int(m.group(1)), m.group(2)), []).append((int(m.group(3)), file))
+	groups = {key: [file for _, file in sorted(channels)] for key, channels in groups.items()}
+	index = {key: i for i, key in enumerate(sorted(groups))} # we sort to get same identifiers cross-platform
+
+	loadF = lambda name, file: sf.read(file, dtype='float32')
+	bar = util.ConsoleProgressBar()
+	bar.start('Import MARDY arrays', len(groups), 'RIRs')
+	for i, (key, channels) in enumerate(util.readChannelGroups(reader, groups, loadF)):
+		distanceInMeter, position = key
+		assert position in Positions, 'invalid position {}'.format(position)
+		microphones = [int(re.search(r'_(\d).wav', file).group(1)) for file in groups[key]]
+		identifier = '{:04d}_{}_{}_{}ch'.format(index[key], distanceInMeter, Positions[position][0], len(channels))
+		insertIntoDbF((util.stackChannels([x for x, fs in channels]), channels[0][1]), identifier, {
+			'source': 'MARDY',
+			'distanceInMeter': distanceInMeter,
+			'position': Positions[position],
+			'channels': len(channels),
+			'array': {
+				'type': 'linear',
+				'channelNames': [str(mic) for mic in microphones],
+				'micPositionsInMeter': [[round((mic - 1) * ArraySpacingInMeter, 3), 0, 0] for mic in microphones],
+			},
+		})
+		bar.progress(i / len(groups))
+	bar.end()
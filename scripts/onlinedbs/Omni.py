@@ -1,5 +1,4 @@
 import util
-from glob import glob
 from os.path import join
 
 """
@@ -15,27 +14,29 @@ Paper: Stewart, Rebecca and Sandler, Mark. "Database of Omnidirectional and B-Fo
 """
 
 OmniRooms = ['greathall', 'octagon', 'classroom']
+Url = 'http://kakapo.dcs.qmul.ac.uk/irs/{}Omni.zip'
+
+def downloads(downloadDir):
+	return [util.FileDownloader(Url.format(room), join(downloadDir, 'omni.{}.zip'.format(room))) for room in OmniRooms]
 
-def importRirs(downloadDir, insertIntoDbF):
-	j = 0
-	for room in OmniRooms:
-		url = 'http://kakapo.dcs.qmul.ac.uk/irs/{}Omni.zip'.format(room)
-		filename = join(downloadDir, 'omni.{}.zip'.format(room))
-		unpackDir = join(downloadDir, 'omni.{}'.format(room))
 
-		dl = util.FileDownloader(url, filename)
+def importRirs(downloadDir, insertIntoDbF, *, stream=False, manifest=None, multichannel=False, jobs=1):
+	# only the omnidirectional version is imported (one channel per RIR), also with multichannel
+	j = 0
+	for room, dl in zip(OmniRooms, downloads(downloadDir)):
 		dl.download()
-		dl.unpackTo(unpackDir)
+		reader = dl.open(join(downloadDir, 'omni.{}'.format(room)), stream=stream, manifest=manifest)
 
-		fileSelector = join(unpackDir, 'Omni', '*.wav')
-		files = list(glob(fileSelector))
+		files = [name for name in reader.names() if name.startswith('Omni/') and name.count('/') == 1 and name.endswith('.wav')]
+		identifiers = {}
+		for file in sorted(files): # we sort to get same identifiers cross-platform
+			identifiers[file] = '{:04d}_{}_{}'.format(j, room, util.baseFilename(file))
+			j += 1
 
 		bar = util.ConsoleProgressBar()
-		bar.start('Import OMNI %s' % room)
-		for i, file in enumerate(sorted(files)): # we sort to get same identifiers cross-platform
-			identifier = '{:04d}_{}_{}'.format(j, room, util.baseFilename(file))
-			j += 1
-			insertIntoDbF(file, identifier, {
+		bar.start('Import OMNI %s' % room, len(files), 'files')
+		for i, (name, file) in enumerate(reader.open(files)):
+			insertIntoDbF(file, identifiers[name], {
 				'source': 'OMNI',
 				'room': room,
 			})
@@ -1,10 +1,10 @@
 import re
 import os
+import contextlib
 from os.path import join
-import numpy as np
 import soundfile as sf
 import util
-import matplotlib.pyplot as plt
+import instrument
 
 """
 Name: RWCP Sound Scene Database
@@ -31,45 +31,103 @@ RawFormat = {
 	'subtype': 'FLOAT' # 32 bit float (= 4 byte)
 }
 
-def importRirs(downloadDir, insertIntoDbF):
-	url = 'http://www.openslr.org/resources/13/RWCP.tar.gz'
-	filename = join(downloadDir, 'rwcp.tar.gz')
-	unpackDir = join(downloadDir, 'rwcp')
-	
-	dl = util.FileDownloader(url, filename)
+Url = 'http://www.openslr.org/resources/13/RWCP.tar.gz'
+BatchSize = 16 # RIRs that are normalized together (see util.normalizeAmplitudes), they are inserted after the batch
+
+def downloads(downloadDir):
+	return [util.FileDownloader(Url, join(downloadDir, 'rwcp.tar.gz'))]
+
+
+def importRirs(downloadDir, insertIntoDbF, *, stream=False, manifest=None, multichannel=False, jobs=1):
+	dl, = downloads(downloadDir)
 	dl.download()
-	dl.unpackTo(unpackDir)
+	reader = dl.open(join(downloadDir, 'rwcp'), stream=stream, manifest=manifest)
+
+	if multichannel:
+		importArrayRirs(reader, insertIntoDbF, manifest)
+		return
 
 	files = []
-	for root, dirnames, filenames in os.walk(join(unpackDir, 'RWCP/micarray/MICARRAY/data1')):
-		for filename in filenames:
-			if filename[-2:] != '.1': continue # we only use the front microphone
-			files.append(join(root, filename))
+	for name in reader.names():
+		if not name.startswith('RWCP/micarray/MICARRAY/data1/'): continue
+		if name[-2:] != '.1': continue # we only use the front microphone
+		files.append(name)
 
 	pattern = re.compile('(circle|cirline)\/(\w{3})\/imp(\d{3})')
 
-	bar = util.ConsoleProgressBar()
-	bar.start('Import RWCP')
+	rirs = {}
 	for i, file in enumerate(sorted(files)): # we sort to get same identifiers cross-platform
 		m = pattern.search(file)
 		assert m, 'Could parse room from path ({})'.format(file)
 		room = m.group(2)
-		identifier = '{:04d}_{}_{}'.format(i, room.lower(), m.group(3))
+		rirs[file] = ('{:04d}_{}_{}'.format(i, room.lower(), m.group(3)), room)
 
+	def insertBatch(batch):
+		# the RIRs stay float, they are written as float (no int16 quantization)
+		for (name, _, fs, members), x in zip(batch, util.normalizeAmplitudes([x for _, x, _, _ in batch])):
+			identifier, room = rirs[name]
+			with manifest.attributing(members) if manifest else contextlib.nullcontext():
+				insertIntoDbF((x, fs), identifier, {
+					'source': 'RWCP',
+					'room': room,
+				})
 
-		#plt.figure(1)
+	bar = util.ConsoleProgressBar()
+	bar.start('Import RWCP', len(files), 'files')
+	batch = []
+	for i, (name, file) in enumerate(reader.open(files)):
 		x, fs = sf.read(file, dtype='float32', **RawFormat)
-		#plt.plot(x)
-		x /= max(abs(x))
-		x = (2**16 * x).astype(np.int16)
-		
-		#plt.plot(x)
-		#plt.show()
-
-		insertIntoDbF((x, fs), identifier, {
-			'source': 'RWCP',
-			'room': room,
-		})
+		instrument.count('files_decoded')
+		batch.append((name, x, fs, manifest.current() if manifest else None))
+		if len(batch) == BatchSize:
+			insertBatch(batch)
+			batch = []
 		bar.progress(i / len(files))
+	insertBatch(batch)
 	bar.end()
 
+
+def importArrayRirs(reader, insertIntoDbF, manifest=None):
+	"""Import all microphones of a measurement (files imp<no>.<microphone>) as one multichannel RIR"""
+	pattern = re.compile(r'(circle|cirline)\/(\w{3})\/imp(\d{3})\.(\d+)$')
+
+	groups = {}
+	for name in reader.names():
+		if not name.startswith('RWCP/micarray/MICARRAY/data1/'): continue
+		m = pattern.search(name)
+		if not m: continue
+		groups.setdefault(name[:name.rindex('.')], []).append((int(m.group(4)), name))
+	groups = {key: [name for _, name in sorted(channels)] for key, channels in groups.items()}
+
+	rirs = {}
+	for i, key in enumerate(sorted(groups)): # we sort to get same identifiers cross-platform
+		m = pattern.search(groups[key][0])
+		room = m.group(2)
+		rirs[key] = ('{:04d}_{}_{}_{}ch'.format(i, room.lower(), m.group(3), len(groups[key])), room)
+
+	loadF = lambda name, file: sf.read(file, dtype='float32', **RawFormat)
+
+	def insertBatch(batch):
+		# same gain for all channels of a RIR
+		for (key, _, fs, members), x in zip(batch, util.normalizeAmplitudes([x for _, x, _, _ in batch])):
+			identifier, room = rirs[key]
+			with manifest.attributing(members) if manifest else contextlib.nullcontext():
+				insertIntoDbF((x, fs), identifier, {
+					'source': 'RWCP',
+					'room': room,
+					'channels': x.shape[1],
+					# microphone numbers of the channels, their positions are described in RWCP/micarray/indexe.htm
+					'array': {'type': 'micarray', 'channelNames': [name[name.rindex('.') + 1:] for name in groups[key]]},
+				})
+
+	bar = util.ConsoleProgressBar()
+	bar.start('Import RWCP arrays', len(groups), 'RIRs')
+	batch = []
+	for i, (key, channels) in enumerate(util.readChannelGroups(reader, groups, loadF)):
+		batch.append((key, util.stackChannels([x for x, fs in channels]), channels[0][1], manifest.current() if manifest else None))
+		if len(batch) == BatchSize:
+			insertBatch(batch)
+			batch = []
+		bar.progress(i / len(groups))
+	insertBatch(batch)
+	bar.end()
@@ -0,0 +1,164 @@
+import os
+import re
+import sys
+import bisect
+import pickle
+import argparse
+import util
+import database
+
+"""
+Select RIRs by their metadata, e.g.
+
+	python3 scripts/query.py "source=AIR and rir_type=binaural and distanceInMeter>=3"
+
+A query is a list of conditions combined with 'and'. A condition is <field><operator><value> with the operators
+=, != (equality), <, <=, >, >= (numeric fields) and ~ (regular expression, e.g. "id~omni_\\d+_classroom").
+
+The queries are answered with an inverted index (value -> ids) for every field and a sorted index for every numeric field.
+The index is built once and stored next to the database; it is rebuilt automatically when the database changed.
+"""
+
+Operators = ['<=', '>=', '!=', '=', '<', '>', '~']
+ConditionPattern = re.compile(r'^\s*([A-Za-z_][\w]*)\s*(' + '|'.join(re.escape(op) for op in Operators) + r')\s*(.*?)\s*$')
+
+class RirIndex:
+	def __init__(self, rirDb):
+		self.ids = set()
+		self.filenames = {}
+		self.values = {} # field -> value -> set of ids
+		numeric = {} # field -> [(value, id)]
+		for rirId, rir in rirDb.items():
+			self.ids.add(rirId)
+			self.filenames[rirId] = rir.get('filename')
+			for field, value in list(rir.items()) + [('id', rirId)]:
+				if not isinstance(value, (str, int, float, bool)) or value is None:
+					continue
+				self.values.setdefault(field, {}).setdefault(value, set()).add(rirId)
+				if isinstance(value, (int, float)) and not isinstance(value, bool):
+					numeric.setdefault(field, []).append((value, rirId))
+
+		self.sorted = {} # field -> (sorted values, ids in the same order)
+		for field, pairs in numeric.items():
+			pairs.sort()
+			self.sorted[field] = ([value for value, _ in pairs], [rirId for _, rirId in pairs])
+
+
+	def select(self, field, operator, value):
+		"""Ids of the RIRs for which the condition holds"""
+		if operator in ['=', '!=']:
+			matches = set()
+			for v in RirIndex._candidates(value):
+				matches |= self.values.get(field, {}).get(v, set())
+			return matches if operator == '=' else self.ids - matches
+
+		if operator == '~':
+			pattern = re.compile(value)
+			matches = set()
+			for v, ids in self.values.get(field, {}).items():
+				if pattern.search(str(v)):
+					matches |= ids
+			return matches
+
+		try:
+			value = float(value)
+		except ValueError:
+			raise ValueError('{} needs a number, got {}'.format(operator, value))
+		values, ids = self.sorted.get(field, ([], []))
+		if operator == '<':
+			return set(ids[:bisect.bisect_left(values, value)])
+		if operator == '<=':
+			return set(ids[:bisect.bisect_right(values, value)])
+		if operator == '>':
+			return set(ids[bisect.bisect_right(values, value):])
+		return set(ids[bisect.bisect_left(values, value):])
+
+
+	def query(self, query):
+		"""Sorted list of the ids of the RIRs matching all conditions of the query"""
+		result = None
+		for condition in parseQuery(query):
+			matches = self.select(*condition)
+			result = matches if result is None else result & matches
+		return sorted(self.ids if result is None else result)
+
+
+	@staticmethod
+	def _candidates(value):
+		"""Values a string from a query can stand for: itself and the number it represents"""
+		candidates = [value]
+		try:
+			candidates.append(float(value))
+		except ValueError:
+			pass
+		return candidates
+
+
+def parseQuery(query):
+	"""List of (field, operator, value) tuples"""
+	conditions = []
+	if not query.strip():
+		return conditions
+	for part in re.split(r'\s+and\s+', query.strip(), flags=re.IGNORECASE):
+		m = ConditionPattern.match(part)
+		if not m:
+			raise ValueError('Could not parse condition "{}"'.format(part))
+		field, operator, value = m.groups()
+		if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+			value = value[1:-1]
+		conditions.append((field, operator, value))
+	return conditions
+
+
+def _dbSignature(dbFilename):
+	signature = []
+	for filename in [dbFilename, dbFilename + '-wal']:
+		if os.path.isfile(filename):
+			st = os.stat(filename)
+			signature.append((st.st_size, st.st_mtime_ns))
+	return signature
+
+
+def loadIndex(dbFilename, rebuild=False):
+	"""The index of a database, from the index file if it is up to date"""
+	indexFilename = os.path.splitext(dbFilename)[0] + '.index.pickle'
+	signature = _dbSignature(dbFilename)
+	if not rebuild and os.path.isfile(indexFilename):
+		with open(indexFilename, 'rb') as f:
+			storedSignature, index = pickle.load(f)
+		if storedSignature == signature:
+			return index
+
+	index = RirIndex(database.openDb(dbFilename))
+	with util.atomicFile(indexFilename) as tmpFilename, open(tmpFilename, 'wb') as f:
+		pickle.dump((signature, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+	return index
+
+
+def main(dbFilename, query, output='ids', outFilename=None, rebuild=False):
+	index = loadIndex(dbFilename, rebuild)
+	rirIds = index.query(query)
+
+	if output == 'paths':
+		lines = [index.filenames[rirId] for rirId in rirIds]
+	else:
+		lines = rirIds
+
+	if outFilename:
+		with open(outFilename, 'w') as f:
+			f.write('\n'.join(lines))
+		print('{} RIRs written to {}'.format(len(lines), outFilename), file=sys.stderr)
+	else:
+		for line in lines:
+			print(line)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Select RIRs by their metadata, e.g. "source=AIR and rir_type=binaural and distanceInMeter>=3"')
+	parser.add_argument('query', type=str, nargs='?', default='', help='Conditions combined with "and" (operators: = != < <= > >= ~)')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('--paths', action='store_true', help='Print the filenames instead of the ids')
+	parser.add_argument('-o', '--output', type=str, help='Write the result to this file (e.g. lists/far.rirs to use it like the other lists)')
+	parser.add_argument('--rebuild', action='store_true', help='Rebuild the index even if the database did not change')
+	args = parser.parse_args()
+	main(args.database, args.query, 'paths' if args.paths else 'ids', args.output, args.rebuild)
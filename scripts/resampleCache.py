@@ -0,0 +1,112 @@
+import os
+import time
+import hashlib
+import tempfile
+import numpy as np
+
+class ResampleCache:
+	"""On-disk cache for resampled signals.
+
+	Entries are keyed by the hash of the input samples, the source and target sampling rate and the converter, and stored
+	as .npy files in the cache directory. Reading an entry updates its mtime, and if the cache grows larger than maxBytes
+	the least recently used entries are deleted. Several processes can use the same directory at the same time.
+	"""
+	StaleSeconds = 3600 # temporary files older than this were left behind by a killed process
+
+	def __init__(self, directory, maxBytes=4 * 1024**3):
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(directory, exist_ok=True)
+		self.size = 0 # estimated size of the cache (other processes might add entries in the meantime)
+		self.evict()
+
+
+	@staticmethod
+	def key(x, sourceFs, targetFs, converter):
+		h = hashlib.sha256(np.ascontiguousarray(x).tobytes())
+		h.update('{}:{}:{}:{}:{}'.format(x.dtype.str, x.shape, sourceFs, targetFs, converter).encode())
+		return h.hexdigest()
+
+
+	def _filename(self, key):
+		return os.path.join(self.directory, key + '.npy')
+
+
+	def get(self, key):
+		filename = self._filename(key)
+		try:
+			y = np.load(filename)
+		except (FileNotFoundError, ValueError): # missing, or evicted/written by another process in the meantime
+			self.misses += 1
+			return None
+		try:
+			os.utime(filename)
+		except FileNotFoundError:
+			pass
+		self.hits += 1
+		return y
+
+
+	def put(self, key, y):
+		# write to a temporary file first, so other processes never see a partially written entry
+		fd, tmpFilename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+		with os.fdopen(fd, 'wb') as f:
+			np.save(f, y)
+		os.replace(tmpFilename, self._filename(key))
+
+		self.size += os.path.getsize(self._filename(key))
+		if self.size > self.maxBytes:
+			self.evict()
+
+
+	def evict(self):
+		"""Delete the least recently used entries if the cache is larger than maxBytes, until it uses at most 90 % of it.
+		Stale temporary files are always deleted."""
+		self._removeStale()
+		entries = sorted(self._entries())
+		self.size = sum(size for _, size, _ in entries)
+		if self.size <= self.maxBytes:
+			return
+		for mtime, size, filename in entries:
+			if self.size <= 0.9 * self.maxBytes:
+				break
+			try:
+				os.remove(filename)
+			except FileNotFoundError:
+				pass
+			self.size -= size
+
+
+	def _removeStale(self):
+		# entries that are written at the moment are younger, they are not touched
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith('.tmp'):
+				try:
+					if time.time() - entry.stat().st_mtime > ResampleCache.StaleSeconds:
+						os.remove(entry.path)
+				except FileNotFoundError:
+					pass
+
+
+	def _entries(self):
+		entries = []
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith('.npy'):
+				try:
+					st = entry.stat()
+				except FileNotFoundError:
+					continue
+				entries.append((st.st_mtime, st.st_size, entry.path))
+		return entries
+
+
+	def resample(self, x, sourceFs, targetFs, converter, resampleF):
+		"""Returns resampleF(x) from the cache, or computes and stores it"""
+		key = ResampleCache.key(x, sourceFs, targetFs, converter)
+		y = self.get(key)
+		if y is None:
+			y = resampleF(x)
+			self.put(key, y)
+		return y
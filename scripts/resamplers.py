@@ -0,0 +1,72 @@
+from fractions import Fraction
+import numpy as np
+
+"""
+Resampling backends; libsamplerate and polyphase have three quality tiers ('best', 'medium', 'fast').
+
+- libsamplerate: band-limited sinc interpolation of libsamplerate (sinc_best, sinc_medium, sinc_fastest), via
+  scikits.samplerate or the samplerate package
+- polyphase: scipy.signal.resample_poly with a Kaiser windowed FIR filter; the rates must have a rational ratio (e.g.
+  48 kHz -> 16 kHz = 1/3), which is always the case for integer rates. Quality determines the filter length.
+- fft: scipy.signal.resample, i.e. zero padding/truncation of the spectrum (the signal is assumed to be periodic). It has
+  only one tier, the quality is ignored.
+
+The backends are imported when they are used the first time.
+"""
+
+Backends = ['libsamplerate', 'polyphase', 'fft']
+Qualities = ['best', 'medium', 'fast']
+
+LibsamplerateConverters = {
+	'best': 'sinc_best',
+	'medium': 'sinc_medium',
+	'fast': 'sinc_fastest',
+}
+# (filter half length in samples of the lower rate, beta of the kaiser window)
+PolyphaseFilters = {
+	'best': (32, 12.0),
+	'medium': (16, 9.0),
+	'fast': (8, 6.0),
+}
+
+def resample(x, sourceFs, targetFs, backend='libsamplerate', quality='best'):
+	if backend not in Backends:
+		raise ValueError('Unknown resampler backend {} (available: {})'.format(backend, ', '.join(Backends)))
+	if quality not in Qualities:
+		raise ValueError('Unknown resampler quality {} (available: {})'.format(quality, ', '.join(Qualities)))
+	if sourceFs == targetFs:
+		return x
+
+	if backend == 'libsamplerate':
+		y = _libsamplerate()(x, targetFs / sourceFs, LibsamplerateConverters[quality])
+	elif backend == 'polyphase':
+		y = _resamplePolyphase(x, sourceFs, targetFs, quality)
+	else:
+		import scipy.signal
+		y = scipy.signal.resample(x, int(round(len(x) * targetFs / sourceFs)))
+	return y.astype(x.dtype, copy=False)
+
+
+def converterName(backend, quality):
+	"""Identifies backend and quality, e.g. for caching resampled signals"""
+	if backend == 'fft': # the quality makes no difference
+		return backend
+	return '{}:{}'.format(backend, quality)
+
+
+def _libsamplerate():
+	try:
+		from scikits.samplerate import resample
+	except ImportError:
+		from samplerate import resample
+	return resample
+
+
+def _resamplePolyphase(x, sourceFs, targetFs, quality):
+	import scipy.signal
+	ratio = Fraction(int(targetFs), int(sourceFs))
+	up, down = ratio.numerator, ratio.denominator
+	halfLength, beta = PolyphaseFilters[quality]
+	maxRate = max(up, down)
+	h = scipy.signal.firwin(2 * halfLength * maxRate + 1, 1 / maxRate, window=('kaiser', beta))
+	return scipy.signal.resample_poly(x, up, down, window=h)
@@ -0,0 +1,135 @@
+import os
+import json
+import argparse
+import numpy as np
+import audioFormats
+import util
+import database
+import instrument
+
+"""
+RIR bank: all RIRs of a list (lists/*.rirs) packed into one contiguous binary file plus an index with the offset, length
+and sampling rate of every RIR. Reading a RIR from the bank returns a view into a numpy.memmap, so no file has to be
+opened or decoded per RIR and all processes that use the same bank share the page cache.
+
+Files for a list <name>.rirs:
+	<name>.bank          samples of all RIRs (float32 or int16), every RIR starts at a 64 byte boundary
+	<name>.bank.json     index: dtype and for every RIR (in the order of the list) id, offset, length (in frames), channels and fs
+
+Multichannel RIRs are stored interleaved and returned as (length x channels) arrays.
+"""
+
+BankDir = 'bank'
+ListDir = 'lists'
+Alignment = 64 # bytes
+Dtypes = ['float32', 'int16']
+
+class RirBank:
+	def __init__(self, filename):
+		"""Open a bank, filename is the .bank file (e.g. bank/train.bank)"""
+		with open(filename + '.json') as f:
+			index = json.load(f)
+		self.dtype = np.dtype(index['dtype'])
+		self.index = {rir['id']: rir for rir in index['rirs']}
+		self.ids = [rir['id'] for rir in index['rirs']]
+		self.data = np.memmap(filename, dtype=self.dtype, mode='r') if os.path.getsize(filename) else np.zeros(0, self.dtype)
+
+
+	def __getitem__(self, rirId):
+		"""Samples of a RIR as read-only view into the bank"""
+		rir = self.index[rirId]
+		channels = rir.get('channels', 1)
+		x = self.data[rir['offset']:rir['offset'] + rir['length'] * channels]
+		return x.reshape(-1, channels) if channels > 1 else x
+
+
+	def fs(self, rirId):
+		return self.index[rirId]['fs']
+
+
+	def __contains__(self, rirId):
+		return rirId in self.index
+
+
+	def __len__(self):
+		return len(self.ids)
+
+
+	def __iter__(self):
+		return iter(self.ids)
+
+
+def writeBank(filename, rirDb, rirIds, dtype='float32'):
+	dtype = np.dtype(dtype)
+	align = Alignment // dtype.itemsize
+	index = []
+	offset = 0
+	# bank and index are renamed into place when complete, so a killed export never leaves a truncated bank
+	with util.atomicFile(filename) as tmpFilename, open(tmpFilename, 'wb') as f:
+		for rirId in rirIds:
+			rir = rirDb[rirId]
+			x, fs = audioFormats.read(rir['filename'], dtype=dtype.name)
+			instrument.count('files_decoded')
+			with instrument.timed('write_seconds'):
+				f.write(x.tobytes())
+			index.append({'id': rirId, 'offset': offset, 'length': len(x), 'channels': x.size // len(x), 'fs': fs})
+			padding = -x.size % align
+			f.write(np.zeros(padding, dtype).tobytes())
+			offset += x.size + padding
+
+	with util.atomicFile(filename + '.json') as tmpFilename, open(tmpFilename, 'w') as f:
+		json.dump({'dtype': dtype.name, 'rirs': index}, f, indent=4)
+
+
+def collapseDuplicates(rirDb, rirIds):
+	"""Only the first RIR of the list of every duplicate cluster (see dedup.py)"""
+	clusters = set()
+	collapsed = []
+	for rirId in rirIds:
+		cluster = rirDb[rirId].get('duplicateCluster')
+		if cluster is None or cluster not in clusters:
+			collapsed.append(rirId)
+			clusters.add(cluster)
+	return collapsed
+
+
+def main(dbFilename, listDir=ListDir, bankDir=BankDir, dtype='float32', collapse=False):
+	"""Create a bank for every list file in listDir (including subdirectories like lists/omni/classroom.train.rirs).
+	With collapse only one RIR of every duplicate cluster is written to a bank."""
+	rirDb = database.openDb(dbFilename)
+
+	listFiles = []
+	for root, dirnames, filenames in os.walk(listDir):
+		for filename in filenames:
+			if filename.endswith('.rirs'):
+				listFiles.append(os.path.relpath(os.path.join(root, filename), listDir))
+
+	bar = util.ConsoleProgressBar()
+	bar.start('Export RIR banks', len(listFiles), 'lists')
+	for i, listFile in enumerate(sorted(listFiles)):
+		with open(os.path.join(listDir, listFile)) as f:
+			rirIds = [line.strip() for line in f if line.strip()]
+		if collapse:
+			rirIds = collapseDuplicates(rirDb, rirIds)
+		filename = os.path.join(bankDir, os.path.splitext(listFile)[0] + '.bank')
+		util.createDirectory(os.path.dirname(filename))
+		writeBank(filename, rirDb, rirIds, dtype)
+		bar.progress((i + 1) / len(listFiles), listFile)
+	bar.end()
+
+
+def cli(argv=None, prog=None):
+	parser = argparse.ArgumentParser(prog=prog, description='Pack the normalized RIRs of every list into one memory-mappable file per list')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('--lists', type=str, default=ListDir, help='Directory with the .rirs list files')
+	parser.add_argument('-o', '--output', type=str, default=BankDir, help='Directory for the banks')
+	parser.add_argument('--dtype', type=str, default='float32', choices=Dtypes)
+	parser.add_argument('--collapseDuplicates', action='store_true', help='Write only one RIR of every duplicate cluster (see dedup.py)')
+	instrument.addArguments(parser)
+	args = parser.parse_args(argv)
+	with instrument.session(args, 'rirBank'):
+		main(args.database, args.lists, args.output, args.dtype, args.collapseDuplicates)
+
+
+if __name__ == '__main__':
+	cli()
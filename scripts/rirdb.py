@@ -0,0 +1,44 @@
+import sys
+import argparse
+import importlib
+
+"""
+One command for the whole pipeline:
+
+	python3 scripts/rirdb.py import --sources=all      (createDb.py)
+	python3 scripts/rirdb.py normalize -fs 16000       (normalize.py)
+	python3 scripts/rirdb.py split                     (splitIntoSets.py)
+	python3 scripts/rirdb.py export --dtype float32    (rirBank.py)
+	python3 scripts/rirdb.py spectra -fs 16000         (spectrumBank.py)
+	python3 scripts/rirdb.py stats                     (stats.py)
+
+The arguments after the subcommand are those of the script (see rirdb.py <subcommand> --help). Only the module of the
+subcommand is imported, and the modules import the importers and the DSP backends (scipy, libsamplerate) only when they
+are used, so e.g. split and stats start without loading numpy. benchStartup.py measures the start time of every
+subcommand.
+"""
+
+# subcommand -> (module, description)
+Commands = {
+	'import': ('createDb', 'Download the collections and import their RIRs into the database'),
+	'normalize': ('normalize', 'Resample, trim and normalize the RIRs'),
+	'split': ('splitIntoSets', 'Split the RIRs into train, test and dev lists'),
+	'export': ('rirBank', 'Pack the RIRs of every list into a memory-mappable bank'),
+	'spectra': ('spectrumBank', 'Precompute the partitioned spectra of the RIRs of every list for fast convolution'),
+	'stats': ('stats', 'Print a summary of the database and the lists'),
+}
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='rirdb', description='Download, import and organize RIRs',
+		formatter_class=argparse.RawDescriptionHelpFormatter,
+		epilog='subcommands:\n' + '\n'.join('  {:10s} {}'.format(name, description) for name, (_, description) in Commands.items()))
+	parser.add_argument('command', choices=list(Commands), metavar='subcommand')
+	parser.add_argument('arguments', nargs=argparse.REMAINDER, help='Arguments of the subcommand (see rirdb <subcommand> --help)')
+	args = parser.parse_args(argv)
+
+	module, _ = Commands[args.command]
+	importlib.import_module(module).cli(args.arguments, prog='rirdb ' + args.command)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
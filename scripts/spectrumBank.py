@@ -0,0 +1,209 @@
+import os
+import json
+import argparse
+import contextlib
+import numpy as np
+import audioFormats
+import util
+import database
+import instrument
+from augment import rirFilename
+from rirBank import Alignment, BankDir, ListDir, collapseDuplicates
+
+"""
+Spectrum bank: the RIRs of a list (lists/*.rirs) as precomputed spectra for uniformly partitioned overlap-save convolution,
+so consumers convolve without transforming the RIRs again (augment.py transforms every RIR once per process and FFT size).
+
+A RIR of length M is cut into P = ceil(M / B) partitions of B samples (the block size). Every partition is zero-padded to
+2B samples and transformed, giving B + 1 bins. A signal is convolved block by block: the spectrum of the last 2B input
+samples is computed once per block and kept for P blocks, the output block is the sum of the products of the last P input
+spectra with the P partition spectra, transformed back, of which the last B samples are kept. The latency is B samples and
+the cost per output sample does not depend on the RIR length but on P, so small blocks suit short RIRs and streaming, large
+blocks long RIRs and offline processing (compare them with benchConvolve.py).
+
+	bank = SpectrumBank('bank/train.b2048.spectra')
+	reverberated = bank.convolve(signals, rirIds)
+
+Files for a list <name>.rirs and block size B:
+	<name>.b<B>.spectra          complex64 spectra of all RIRs (channels x partitions x B + 1 each), every RIR starts at a
+	                             64 byte boundary
+	<name>.b<B>.spectra.json     index: dtype, blockSize and for every RIR (in the order of the list) id, offset (in complex
+	                             values), length (in samples), channels, partitions and fs
+
+The spectra take about twice the space of the float32 samples (B + 1 complex64 values per B samples), plus the zero
+padding of the last partition. Convolution with the bank saves the transform of the RIRs that augment.convolve does per
+call; with B >= 512 it is faster (about 1.1x with B = 512 to 1.6x with B = 2048 for synthetic RIRs of 0.2-1 s and signals
+of 4 s, see benchConvolve.py), with small blocks like B = 128 the many partitions make it slower.
+"""
+
+DefaultBlockSizes = [2048]
+
+def bankFilename(bankDir, listFile, blockSize):
+	return os.path.join(bankDir, '{}.b{}.spectra'.format(os.path.splitext(listFile)[0], blockSize))
+
+
+def partitionSpectra(h, blockSize):
+	"""Spectra of the partitions of a RIR (1-D, or samples x channels) as channels x partitions x (blockSize + 1) array"""
+	h = h.reshape(len(h), -1).T
+	partitions = -(-h.shape[1] // blockSize)
+	padded = np.zeros((len(h), partitions * blockSize), dtype=np.float32)
+	padded[:, :h.shape[1]] = h
+	return np.fft.rfft(padded.reshape(len(h), partitions, blockSize), n=2 * blockSize).astype(np.complex64)
+
+
+def inputSpectra(x, blockSize, blocks):
+	"""Spectra of the first blocks input blocks of a 1-D signal (blocks x blockSize + 1); block k covers the input samples
+	[(k - 1)B, (k + 1)B)"""
+	padded = np.zeros((blocks + 1) * blockSize, dtype=np.float32)
+	padded[blockSize:blockSize + min(len(x), blocks * blockSize)] = x[:blocks * blockSize]
+	# transformed per signal: the frames of one signal stay in the cache, which is faster than one transform for the batch
+	frames = np.lib.stride_tricks.sliding_window_view(padded, 2 * blockSize)[::blockSize]
+	return np.fft.rfft(frames, axis=-1)
+
+
+def convolveBatch(signals, spectra, rirLengths, blockSize, *, tail=False):
+	"""Convolve every 1-D signal with its RIR (given by its partition spectra, see partitionSpectra, and length) with
+	uniformly partitioned overlap-save.
+
+	The partition spectra are read where they are (e.g. from the memory-mapped bank), they are not copied into a batch.
+	The input spectra of a signal are computed once and used for all channels of its RIR, and for all RIRs of the batch the
+	same signal (object) is convolved with. Output block k is the sum over the partitions p of input block k - p times
+	partition p; a RIR with one partition (not longer than the block size) takes a single product.
+	"""
+	outLengths = [len(x) + m - 1 if tail else len(x) for x, m in zip(signals, rirLengths)]
+	inputs = {} # id of the signal -> spectra of its input blocks
+	results = []
+	for x, H, n in zip(signals, spectra, outLengths):
+		if n == 0:
+			results.append(np.zeros((0, len(H)) if len(H) > 1 else 0, dtype=np.float32))
+			continue
+		blocks = -(-n // blockSize)
+		X = inputs.get(id(x))
+		if X is None or len(X) < blocks:
+			X = inputs[id(x)] = inputSpectra(x, blockSize, blocks)
+		X = X[:blocks]
+
+		Y = X * H[:, 0, None, :]
+		for p in range(1, min(H.shape[1], blocks)):
+			Y[:, p:] += X[:blocks - p] * H[:, p, None, :]
+		y = np.fft.irfft(Y, n=2 * blockSize)[:, :, blockSize:].reshape(len(H), blocks * blockSize)[:, :n]
+		results.append(y[0] if len(H) == 1 else y.T.copy())
+	return results
+
+
+class SpectrumBank:
+	def __init__(self, filename):
+		"""Open a spectrum bank, filename is the .spectra file (e.g. bank/train.b2048.spectra)"""
+		with open(filename + '.json') as f:
+			index = json.load(f)
+		self.blockSize = index['blockSize']
+		self.index = {rir['id']: rir for rir in index['rirs']}
+		self.ids = [rir['id'] for rir in index['rirs']]
+		dtype = np.dtype(index['dtype'])
+		self.data = np.memmap(filename, dtype=dtype, mode='r') if os.path.getsize(filename) else np.zeros(0, dtype)
+
+
+	def __getitem__(self, rirId):
+		"""Partition spectra of a RIR (channels x partitions x blockSize + 1) as read-only view into the bank"""
+		rir = self.index[rirId]
+		shape = (rir['channels'], rir['partitions'], self.blockSize + 1)
+		return self.data[rir['offset']:rir['offset'] + np.prod(shape)].reshape(shape)
+
+
+	def length(self, rirId):
+		return self.index[rirId]['length']
+
+
+	def fs(self, rirId):
+		return self.index[rirId]['fs']
+
+
+	def convolve(self, signals, rirIds, *, tail=False):
+		"""Convolve every signal of a list with the RIR with the id at the same position"""
+		return convolveBatch(signals, [self[rirId] for rirId in rirIds], [self.length(rirId) for rirId in rirIds], self.blockSize, tail=tail)
+
+
+	def __contains__(self, rirId):
+		return rirId in self.index
+
+
+	def __len__(self):
+		return len(self.ids)
+
+
+	def __iter__(self):
+		return iter(self.ids)
+
+
+def writeBanks(filenames, blockSizes, rirs):
+	"""Write one bank per block size (filenames[i] for blockSizes[i]); rirs yields (id, samples, fs), every RIR is read once"""
+	align = Alignment // np.dtype(np.complex64).itemsize
+	indexes = [[] for _ in blockSizes]
+	offsets = [0] * len(blockSizes)
+	# banks and indexes are renamed into place when complete, so a killed export never leaves a truncated bank
+	with contextlib.ExitStack() as stack:
+		files = [stack.enter_context(open(stack.enter_context(util.atomicFile(filename)), 'wb')) for filename in filenames]
+		for rirId, h, fs in rirs:
+			for i, (f, blockSize) in enumerate(zip(files, blockSizes)):
+				with instrument.timed('fft_seconds'):
+					H = partitionSpectra(h, blockSize)
+				with instrument.timed('write_seconds'):
+					f.write(H.tobytes())
+				indexes[i].append({'id': rirId, 'offset': offsets[i], 'length': len(h), 'channels': len(H), 'partitions': H.shape[1], 'fs': fs})
+				padding = -H.size % align
+				f.write(np.zeros(padding, np.complex64).tobytes())
+				offsets[i] += H.size + padding
+
+	for filename, blockSize, index in zip(filenames, blockSizes, indexes):
+		with util.atomicFile(filename + '.json') as tmpFilename, open(tmpFilename, 'w') as f:
+			json.dump({'dtype': 'complex64', 'blockSize': blockSize, 'rirs': index}, f, indent=4)
+
+
+def main(dbFilename, listDir=ListDir, bankDir=BankDir, fs=16000, blockSizes=DefaultBlockSizes, collapse=False):
+	"""Create a spectrum bank per block size for every list file in listDir from the RIRs normalized to fs.
+	With collapse only one RIR of every duplicate cluster is written to a bank."""
+	rirDb = database.openDb(dbFilename)
+
+	listFiles = []
+	for root, dirnames, filenames in os.walk(listDir):
+		for filename in filenames:
+			if filename.endswith('.rirs'):
+				listFiles.append(os.path.relpath(os.path.join(root, filename), listDir))
+
+	def readRirs(rirIds):
+		for rirId in rirIds:
+			h, fs_h = audioFormats.read(rirFilename(rirDb[rirId], fs), dtype='float32')
+			assert fs_h == fs, 'Sampling rate of {} is {} Hz, not {} Hz'.format(rirId, fs_h, fs)
+			instrument.count('files_decoded')
+			yield rirId, h, fs_h
+
+	bar = util.ConsoleProgressBar()
+	bar.start('Export spectrum banks', len(listFiles), 'lists')
+	for i, listFile in enumerate(sorted(listFiles)):
+		with open(os.path.join(listDir, listFile)) as f:
+			rirIds = [line.strip() for line in f if line.strip()]
+		if collapse:
+			rirIds = collapseDuplicates(rirDb, rirIds)
+		filenames = [bankFilename(bankDir, listFile, blockSize) for blockSize in blockSizes]
+		util.createDirectory(os.path.dirname(filenames[0]))
+		writeBanks(filenames, blockSizes, readRirs(rirIds))
+		bar.progress((i + 1) / len(listFiles), listFile)
+	bar.end()
+
+
+def cli(argv=None, prog=None):
+	parser = argparse.ArgumentParser(prog=prog, description='Precompute the partitioned spectra of the RIRs of every list for fast convolution')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('--lists', type=str, default=ListDir, help='Directory with the .rirs list files')
+	parser.add_argument('-o', '--output', type=str, default=BankDir, help='Directory for the banks')
+	parser.add_argument('-fs', '--samplingrate', type=int, default=16000, help='Sampling rate, the RIRs have to be normalized to it')
+	parser.add_argument('--blockSizes', type=str, default=','.join(str(b) for b in DefaultBlockSizes), help='Comma separated list of block sizes (in samples), one bank is written per block size')
+	parser.add_argument('--collapseDuplicates', action='store_true', help='Write only one RIR of every duplicate cluster (see dedup.py)')
+	instrument.addArguments(parser)
+	args = parser.parse_args(argv)
+	with instrument.session(args, 'spectrumBank'):
+		main(args.database, args.lists, args.output, args.samplingrate, [int(b) for b in args.blockSizes.split(',')], args.collapseDuplicates)
+
+
+if __name__ == '__main__':
+	cli()
@@ -1,8 +1,11 @@
 import os
 import json
+import heapq
+import bisect
+import random
 import argparse
-import numpy as np
-import util
+import database
+import instrument
 import re
 
 ListDir = 'lists'
@@ -12,14 +15,12 @@ class RirSet(set):
 		self.name = name
 		self.share = share
 
-	def missing(self, totalRirs):
-		return len(self) / totalRirs - self.share
-
 	def save(self, folder, silent=False):
 		if not silent: print('{} set: {} RIRs'.format(self.name, len(self)))
 		filename = os.path.join(folder, self.name + '.rirs')
-		with open(filename, 'w') as f:
+		with open(filename + '.partial', 'w') as f:
 			f.write('\n'.join(sorted(list(self))))
+		os.replace(filename + '.partial', filename) # a killed split never leaves a truncated list
 
 	def load(self, folder):
 		filename = os.path.join(folder, self.name + '.rirs')
@@ -28,35 +29,247 @@ class RirSet(set):
 				self.add(line.strip())
 
 
-def createLists(dbFilename):
+DefaultShares = [('train', 0.8), ('test', 0.1), ('dev', 0.1)]
+GroupModes = ['room', 'session', 'none'] # from coarse to fine
+MaxShareDeviation = 0.5 # a set that misses its share by more than this fraction of it is refused
+StratifyFields = ['source', 'room', 'distance']
+DistanceBuckets = [1, 2, 4] # meters, edges of the distance strata
+DuplicateModes = ['colocate', 'collapse', 'ignore']
+
+def groupKey(rir, groupBy):
+	"""RIRs with the same group key always end up in the same set.
+
+	room: all RIRs recorded in the same room (sources without rooms, like MARDY, form one group)
+	session: all RIRs of the same measurement, i.e. same room and position (e.g. the left and right channel of AIR)
+	none: every RIR is its own group
+	"""
+	if groupBy == 'none':
+		return rir['id']
+	room = (rir['source'], rir.get('room'))
+	if groupBy == 'room':
+		return room
+	measurement = re.sub(r'^[a-z]+_\d+_', '', rir['id']) # id without source and running index
+	return room + tuple(rir.get(field) for field in ['rir_type', 'rir_no', 'azimuth', 'phone_pos', 'mock_up_type']) + (measurement,)
+
+
+def mergeDuplicates(groups):
+	"""Merge the groups that contain RIRs of the same duplicate cluster (see dedup.py)"""
+	target = {} # group key -> key of the group it is merged into
+	def root(key):
+		while target.get(key, key) != key:
+			key = target[key]
+		return key
+
+	clusterGroup = {}
+	for key in sorted(groups, key=repr):
+		for rir in groups[key]:
+			cluster = rir.get('duplicateCluster')
+			if cluster is None:
+				continue
+			a, b = root(clusterGroup.setdefault(cluster, key)), root(key)
+			if a != b:
+				target[b] = a
+
+	merged = {}
+	for key in sorted(groups, key=repr):
+		merged.setdefault(root(key), []).extend(groups[key])
+	return merged
+
+
+def stratumKey(rir, stratifyBy):
+	key = []
+	for field in stratifyBy:
+		if field == 'distance':
+			distance = rir.get('distanceInMeter')
+			key.append(None if distance is None else bisect.bisect_right(DistanceBuckets, distance))
+		else:
+			key.append(rir.get(field))
+	return tuple(key)
+
+
+def allocateGroups(groups, shares, rng, sizes=None):
+	"""Distribute groups (list of (key, size)) to the sets according to their shares.
+
+	The groups are assigned from large to small (ties in random order) to the set that misses the most RIRs, which is
+	found with a heap, so this is O(n log k) for n groups and k sets. sizes are the numbers of RIRs that are already in the
+	sets (e.g. from other strata), so what a set missed there is made up here. Returns the set index for every group key.
+	"""
+	sizes = sizes or [0] * len(shares)
+	total = sum(size for _, size in groups) + sum(sizes)
+	order = list(groups)
+	rng.shuffle(order)
+	order.sort(key=lambda group: -group[1])
+	heap = [(size - share * total, i) for i, (share, size) in enumerate(zip(shares, sizes))] # (-missing RIRs, set index)
+	heapq.heapify(heap)
+	assignment = {}
+	for key, size in order:
+		missing, i = heapq.heappop(heap)
+		assignment[key] = i
+		heapq.heappush(heap, (missing + size, i))
+	return assignment
+
+
+def shareErrors(sets):
+	"""Descriptions of the sets that are empty or miss their share by more than MaxShareDeviation"""
+	total = sum(len(s) for s in sets)
+	errors = []
+	for s in sets:
+		share = len(s) / total if total else 0
+		if s.share > 0 and (len(s) == 0 or abs(share - s.share) > MaxShareDeviation * s.share):
+			errors.append('{} has {} RIRs ({:.1f} %, target {:.1f} %)'.format(s.name, len(s), 100 * share, 100 * s.share))
+	return errors
+
+
+def createLists(dbFilename, shares=DefaultShares, groupBy='room', stratifyBy=['source'], seed=0, duplicates='colocate', strictGroups=False, fallbackGroupBy='session'):
+	"""Split the RIRs into sets, e.g. train/test/dev.
+
+	All RIRs of a group (see groupKey) are put into the same set, so no room (or measurement) appears in more than one set.
+	The groups are distributed separately for every stratum (e.g. every source), so each set gets its share of every
+	stratum; what a set misses in a small stratum is made up in the next ones. The result only depends on the database
+	and the seed.
+
+	With few large groups (e.g. a source with only three rooms) the shares cannot be met. If a set is empty or misses its
+	share by more than MaxShareDeviation, the split is repeated with the next finer grouping, down to fallbackGroupBy (by
+	default session: every RIR its own group is only used if it is asked for); with strictGroups a RuntimeError is raised
+	instead, as well as if a set stays empty. If a finer grouping is used, the groups of groupBy that are spread over
+	several sets are reported (and saved in the statistics).
+
+	If the database contains duplicate clusters (see dedup.py), the RIRs of a cluster are put into the same set
+	(duplicates='colocate'), or only the representative of every cluster is used (duplicates='collapse').
+	"""
+	if any(share < 0 for _, share in shares) or abs(sum(share for _, share in shares) - 1) > 1e-6:
+		raise ValueError('The shares of the sets must not be negative and sum to 1 ({})'.format(
+			', '.join('{}={}'.format(name, share) for name, share in shares)))
+
 	print('Splitting RIRs into sets...')
-	sets = [
-		RirSet('train', 0.8),
-		RirSet('test', 0.1),
-		RirSet('dev', 0.1),
-	]
 
 	# open database
-	rirDb = json.load(open(dbFilename))
-	rirs = sorted(list(rirDb.keys()))
+	rirDb = database.openDb(dbFilename)
+
+	modes = GroupModes[GroupModes.index(groupBy):max(GroupModes.index(groupBy), GroupModes.index(fallbackGroupBy)) + 1]
+	for mode in modes:
+		sets, groups = splitGroups(rirDb, shares, mode, stratifyBy, seed, duplicates)
+		errors = shareErrors(sets)
+		if not errors:
+			break
+		message = 'Grouping by {}: {}'.format(mode, '; '.join(errors))
+		if strictGroups or mode == modes[-1]:
+			if strictGroups or any(len(s) == 0 for s in sets if s.share > 0):
+				if not strictGroups and mode != GroupModes[-1]:
+					message += ' (a finer fallbackGroupBy than {} could meet the shares)'.format(mode)
+				raise RuntimeError(message)
+			print('Warning: {}'.format(message))
+		else:
+			print('Warning: {}; grouping by {} instead'.format(message, modes[modes.index(mode) + 1]))
 
-	# to distribute the RIRs to the set we could to a shuffle, but as they are in alphabetical order and just going over them guaranties that we distribute the different conditions (mostly) equally on the different sets
-	sets[0].add(rirs[0])
-	for i in range(1, len(rirs)):
-		si = np.argmin([s.missing(i) for s in sets])
-		sets[si].add(rirs[i])
+	validateLists(sets, groups)
+	violations = []
+	if mode != groupBy:
+		violations = spreadGroups(sets, makeGroups(rirDb, groupBy, duplicates))
+		print('Warning: {} of the groups by {} are spread over several sets:'.format(len(violations), groupBy))
+		for key, names in violations[:10]:
+			print('  {} is in {}'.format(key, ', '.join(names)))
+		if len(violations) > 10:
+			print('  ...')
 
 	# safe set files
-	util.createDirectory(ListDir)
+	os.makedirs(ListDir, exist_ok=True)
 	for s in sets:
 		s.save(ListDir)
+	saveStatistics(sets, rirDb, groups, os.path.join(ListDir, 'statistics.json'), {
+		'groupBy': groupBy,
+		'usedGroupBy': mode,
+		'spreadGroups': [{'group': repr(key), 'sets': names} for key, names in violations],
+	})
+
+
+def makeGroups(rirDb, groupBy, duplicates):
+	"""The RIRs of every group key (see groupKey), with the duplicate clusters merged or collapsed (see createLists)"""
+	groups = {}
+	for rirId, rir in rirDb.items():
+		if duplicates == 'collapse' and rir.get('duplicateCluster', rirId) != rirId:
+			continue
+		groups.setdefault(groupKey(rir, groupBy), []).append(rir)
+	if duplicates == 'colocate':
+		groups = mergeDuplicates(groups)
+	return groups
+
+
+def splitGroups(rirDb, shares, groupBy, stratifyBy, seed, duplicates):
+	"""Assign the groups of RIRs to the sets (see createLists). Returns the sets and the groups"""
+	sets = [RirSet(name, share) for name, share in shares]
+	groups = makeGroups(rirDb, groupBy, duplicates)
+
+	strata = {}
+	for key, rirs in groups.items():
+		# the stratum of a group is the one of most of its RIRs
+		keys = [stratumKey(rir, stratifyBy) for rir in rirs]
+		stratum = max(sorted(set(keys), key=repr), key=keys.count)
+		strata.setdefault(stratum, []).append((key, len(rirs)))
+
+	rng = random.Random(seed)
+	for stratum in sorted(strata, key=repr):
+		assignment = allocateGroups(sorted(strata[stratum], key=repr), [s.share for s in sets], rng, [len(s) for s in sets])
+		for key, i in assignment.items():
+			sets[i].update(rir['id'] for rir in groups[key])
+	return sets, groups
+
+
+def spreadGroups(sets, groups):
+	"""Groups whose RIRs are in more than one set, as list of (group key, set names); RIRs in no set are ignored"""
+	setOf = {rirId: s.name for s in sets for rirId in s}
+	spread = []
+	for key in sorted(groups, key=repr):
+		names = sorted(set(setOf[rir['id']] for rir in groups[key] if rir['id'] in setOf))
+		if len(names) > 1:
+			spread.append((key, names))
+	return spread
+
+
+def validateLists(sets, groups):
+	"""Make sure that every RIR is in exactly one set and no group is spread over several sets"""
+	setOf = {}
+	for i, s in enumerate(sets):
+		for rirId in s:
+			if rirId in setOf:
+				raise RuntimeError('{} is in {} and {}'.format(rirId, sets[setOf[rirId]].name, s.name))
+			setOf[rirId] = i
+	for key, names in spreadGroups(sets, groups):
+		raise RuntimeError('Group {} is in more than one set: {}'.format(key, ', '.join(names)))
+
+
+def saveStatistics(sets, rirDb, groups, filename, grouping=None):
+	"""Save the size, share, number of groups and RIRs per source of every set to filename; grouping (e.g. the groupBy that
+	was used, see createLists) is saved as 'grouping'"""
+	total = sum(len(s) for s in sets)
+	groupOf = {rir['id']: key for key, rirs in groups.items() for rir in rirs}
+	statistics = {}
+	for s in sets:
+		sources = {}
+		for rirId in s:
+			source = rirDb[rirId]['source']
+			sources[source] = sources.get(source, 0) + 1
+		statistics[s.name] = {
+			'rirs': len(s),
+			'share': len(s) / total if total else 0,
+			'targetShare': s.share,
+			'groups': len(set(groupOf[rirId] for rirId in s)),
+			'sources': sources,
+		}
+		print('{} set: {} RIRs ({:.1f} %, target {:.1f} %) in {} groups'.format(s.name, len(s),
+			100 * statistics[s.name]['share'], 100 * s.share, statistics[s.name]['groups']))
+	if grouping is not None:
+		statistics['grouping'] = grouping
+	with open(filename + '.partial', 'w') as f:
+		json.dump(statistics, f, sort_keys=True, indent=4)
+	os.replace(filename + '.partial', filename)
 
 
 def createMoreLists(dbFilename, regex=r'omni_\d+_classroom', prefix='omni/classroom'):
 	print('Creating additional lists...')
 
 	# open database
-	rirDb = json.load(open(dbFilename))
+	rirDb = database.openDb(dbFilename)
 	rirs = sorted(list(rirDb.keys()))
 	
 	train = RirSet('train')
@@ -66,19 +279,6 @@ def createMoreLists(dbFilename, regex=r'omni_\d+_classroom', prefix='omni/classr
 	test.load(ListDir)
 	dev.load(ListDir)
 
-	# old, but maybe useful once I found a better way to separate hard and easy RIRs
-	# print('Splitting train set into hard and easy RIRs according to length.') # TODO: use reverberation time (RT60)
-	# easy = RirSet('train.easy')
-	# hard = RirSet('train.hard')
-	# for rir in rirs:
-	# 	if rir in train:
-	# 		if rirDb[rir]['length'] > 2.5:
-	# 			hard.add(rir)
-	# 		else:
-	# 			easy.add(rir)
-	# easy.save(ListDir)
-	# hard.save(ListDir)
-
 	print('Creating subsets with room impulse responses matching \'{}\' in {}'.format(regex, prefix))
 	mustMatch = re.compile(regex)
 	subdir, filenamePrefix = os.path.split(prefix)
@@ -97,20 +297,60 @@ def createMoreLists(dbFilename, regex=r'omni_\d+_classroom', prefix='omni/classr
 				assert rir in dev
 				subDev.add(rir)
 
-	util.createDirectory(subdir)
+	os.makedirs(subdir, exist_ok=True)
 	subTrain.save(subdir)
 	subTest.save(subdir)
 	subDev.save(subdir)
 
 
-if __name__ == '__main__':
-	parser = argparse.ArgumentParser(description='Split RIRs into different sets and create a text file with the RIR IDs for each set')
-	parser.add_argument('-db', '--database', type=str, default='db.json')
+def createRt60Lists(dbFilename, hardRt60):
+	"""Split the train set into hard and easy RIRs according to the reverberation time (see acoustics.py)"""
+	print('Splitting train set into hard (RT60 > {} s) and easy RIRs...'.format(hardRt60))
+	rirDb = database.openDb(dbFilename)
+
+	train = RirSet('train')
+	train.load(ListDir)
+	easy = RirSet('train.easy')
+	hard = RirSet('train.hard')
+	for rir in sorted(train):
+		rt60 = rirDb[rir].get('rt60')
+		if rt60 is None:
+			continue
+		if rt60 > hardRt60:
+			hard.add(rir)
+		else:
+			easy.add(rir)
+	easy.save(ListDir)
+	hard.save(ListDir)
+
+
+def cli(argv=None, prog=None):
+	parser = argparse.ArgumentParser(prog=prog, description='Split RIRs into different sets and create a text file with the RIR IDs for each set')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('--sets', type=str, default=','.join('{}={}'.format(name, share) for name, share in DefaultShares), help='Names and shares of the sets')
+	parser.add_argument('--groupBy', type=str, default='room', choices=GroupModes, help='RIRs of the same room/measurement are kept in the same set (a finer grouping is used if the shares cannot be met)')
+	parser.add_argument('--fallbackGroupBy', type=str, default='session', choices=GroupModes, help='Finest grouping that is used if the shares cannot be met with --groupBy (none: RIRs of the same measurement can end up in different sets)')
+	parser.add_argument('--strictGroups', action='store_true', help='Fail instead of using a finer grouping if the shares cannot be met with --groupBy')
+	parser.add_argument('--stratifyBy', type=str, default='source', help='Comma separated fields ({}) for which each set gets its share, or "none"'.format(', '.join(StratifyFields)))
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--duplicates', type=str, default='colocate', choices=DuplicateModes, help='Put duplicate RIRs (see dedup.py) into the same set, keep only one RIR of every duplicate cluster, or ignore them')
 	parser.add_argument('--regex', type=str)
 	parser.add_argument('--prefix', type=str)
-	args = parser.parse_args()
+	parser.add_argument('--hardRt60', type=float, help='Additionally split the train set into train.hard and train.easy at this RT60 (in seconds, requires acoustics.py)')
+	instrument.addArguments(parser)
+	args = parser.parse_args(argv)
 	
-	createLists(args.database)
-	if args.regex and args.prefix:
-		createMoreLists(args.database, args.regex, args.prefix)
+	shares = [(name, float(share)) for name, share in (s.split('=') for s in args.sets.split(','))]
+	if abs(sum(share for _, share in shares) - 1) > 1e-6 or any(share < 0 for _, share in shares):
+		parser.error('the shares of --sets must not be negative and sum to 1')
+	stratifyBy = [] if args.stratifyBy == 'none' else args.stratifyBy.split(',')
+	with instrument.session(args, 'split'):
+		createLists(args.database, shares, args.groupBy, stratifyBy, args.seed, args.duplicates, args.strictGroups, args.fallbackGroupBy)
+		if args.regex and args.prefix:
+			createMoreLists(args.database, args.regex, args.prefix)
+		if args.hardRt60:
+			createRt60Lists(args.database, args.hardRt60)
 
+
+if __name__ == '__main__':
+	cli()
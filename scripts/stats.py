@@ -0,0 +1,88 @@
+import os
+import json
+import argparse
+import statistics
+import database
+
+"""
+Summary of a database: number of RIRs per source, sampling rate, RIR type and channels, the normalized rates, the
+distribution of the length and the acoustic parameters, duplicate clusters and the sizes of the lists.
+
+Uses only the standard library and the database, so it starts fast.
+"""
+
+ListDir = 'lists'
+CountedFields = ['source', 'fs', 'rir_type', 'channels']
+NumericFields = ['length', 'rt60', 'drr', 'distanceInMeter']
+
+def summary(rirDb, listDir=ListDir):
+	counts = {field: {} for field in CountedFields}
+	values = {field: [] for field in NumericFields}
+	rates = {}
+	clusters = set()
+	clustered = 0
+	for rir in rirDb.values():
+		for field in CountedFields:
+			value = str(rir.get(field, 1 if field == 'channels' else None))
+			counts[field][value] = counts[field].get(value, 0) + 1
+		for field in NumericFields:
+			if isinstance(rir.get(field), (int, float)):
+				values[field].append(rir[field])
+		for fs in rir.get('normalized', {}):
+			rates[fs] = rates.get(fs, 0) + 1
+		if rir.get('duplicateCluster') is not None:
+			clusters.add(rir['duplicateCluster'])
+			clustered += 1
+
+	distributions = {}
+	for field, v in values.items():
+		if v:
+			distributions[field] = {'count': len(v), 'min': min(v), 'median': statistics.median(v), 'max': max(v)}
+
+	lists = {}
+	if os.path.isdir(listDir):
+		for root, dirnames, filenames in os.walk(listDir):
+			for filename in sorted(filenames):
+				if filename.endswith('.rirs'):
+					with open(os.path.join(root, filename)) as f:
+						lists[os.path.relpath(os.path.join(root, filename), listDir)] = sum(1 for line in f if line.strip())
+
+	return {
+		'rirs': len(rirDb),
+		'counts': counts,
+		'normalized': rates,
+		'distributions': distributions,
+		'duplicates': {'clusters': len(clusters), 'rirs': clustered},
+		'lists': lists,
+	}
+
+
+def printSummary(s):
+	print('{} RIRs'.format(s['rirs']))
+	for field, counts in s['counts'].items():
+		print('  {:15s} {}'.format(field, ', '.join('{}: {}'.format(value, n) for value, n in sorted(counts.items(), key=lambda item: -item[1]))))
+	if s['normalized']:
+		print('  {:15s} {}'.format('normalized', ', '.join('{} Hz: {}'.format(fs, n) for fs, n in sorted(s['normalized'].items(), key=lambda item: int(item[0])))))
+	for field, d in s['distributions'].items():
+		print('  {:15s} min {:.3g}, median {:.3g}, max {:.3g} ({} RIRs)'.format(field, d['min'], d['median'], d['max'], d['count']))
+	if s['duplicates']['clusters']:
+		print('  {:15s} {} clusters with {} RIRs'.format('duplicates', s['duplicates']['clusters'], s['duplicates']['rirs']))
+	for name, n in sorted(s['lists'].items()):
+		print('  list {}: {} RIRs'.format(name, n))
+
+
+def cli(argv=None, prog=None):
+	parser = argparse.ArgumentParser(prog=prog, description='Print a summary of the RIR database and the lists')
+	parser.add_argument('-db', '--database', type=str, default='db.json', help='Database file (.json or .sqlite)')
+	parser.add_argument('--lists', type=str, default=ListDir, help='Directory with the .rirs list files')
+	parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+	args = parser.parse_args(argv)
+	s = summary(database.openDb(args.database), args.lists)
+	if args.json:
+		print(json.dumps(s, sort_keys=True, indent=4))
+	else:
+		printSummary(s)
+
+
+if __name__ == '__main__':
+	cli()
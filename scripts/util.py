@@ -1,77 +1,366 @@
 import os
+import re
+import io
+import json
 import sys
+import tarfile
+import zipfile
+import time
+import socket
+import http.client
+import hashlib
+import threading
+import contextlib
+import urllib.error
 import urllib.request
-import patoolib
+from concurrent.futures import ThreadPoolExecutor
 import shutil
 import numpy as np
-from scikits.samplerate import resample
-
-class ConsoleProgressBar:
-	def __init__(self):
-		self.lastMsgLength = 0
+import instrument
+import resamplers
 
+BatchSamples = 2**17 # samples per channel of a padded batch (see signalBatches), so it stays in the CPU cache
 
-	def start(self, title):
-		"""Creates a progress bar 50 chars long on the console and moves cursor back to beginning with BS character"""
-		sys.stdout.write(title + ' [' + ' ' * 50 + ']' + chr(8) * 52)
-		sys.stdout.flush()
+class ConsoleProgressBar:
+	"""Progress of a stage of the instrumentation (see instrument.py), rendered as progress bar on a terminal"""
+	def start(self, title, total=None, unit=None):
+		"""total is the number of items (with the unit, e.g. 'files') processed in this stage, to show the rate"""
+		instrument.Default.beginStage(title, total, unit)
 
 
 	def progress(self, progress, msg=None):
-		x = int(50 * progress)
-		y = 50 - x - 1
-		s = '[{}>{}] {:.1f} %'.format('=' * x, ' ' * y, 100 * progress)
-		if msg is not None:
-			msg = str(msg)
-			if len(msg) > self.lastMsgLength:
-				self.lastMsgLength = len(msg)
-			else:
-				msg = msg + ' ' * (self.lastMsgLength - len(msg))
-			s += ' ' + msg
-		sys.stdout.write(s + chr(8) * len(s))
-		sys.stdout.flush()
+		instrument.progress(progress, msg)
 
 
 	def end(self):
-		"""End of progress bar;	Write full bar, then move to next line"""
-		sys.stdout.write('[' + '=' * 50 + '] 100.0 %  \n')
-		sys.stdout.flush()
+		instrument.Default.endStage()
+
+
+class RateLimiter:
+	"""Token bucket to limit the bandwidth of all downloads that share the same limiter (thread-safe)"""
+	def __init__(self, bytesPerSecond):
+		self.bytesPerSecond = bytesPerSecond
+		self.available = bytesPerSecond
+		self.lastRefill = time.monotonic()
+		self.lock = threading.Lock()
+
+
+	def consume(self, numBytes):
+		with self.lock:
+			now = time.monotonic()
+			self.available = min(self.bytesPerSecond, self.available + (now - self.lastRefill) * self.bytesPerSecond)
+			self.lastRefill = now
+			self.available -= numBytes
+			wait = -self.available / self.bytesPerSecond
+		if wait > 0:
+			time.sleep(wait)
 
 
 class FileDownloader:
-	def __init__(self, url, filename):
+	BlockSize = 64 * 1024
+	Timeout = 60
+
+	def __init__(self, url, filename, sha256=None):
 		self.url = url
 		self.filename = filename
 		self.title = os.path.basename(filename)
+		self.sha256 = sha256
 
 
-	def download(self, *, showProgress=True, useCache=True):
+	def download(self, *, showProgress=True, useCache=True, retries=5, rateLimiter=None):
+		"""Download the file to self.filename.
+
+		Data is first written to a '.part' file. If the connection drops, the download is retried and resumed with an HTTP
+		Range request where the previous attempt stopped; If-Range with the ETag (or Last-Modified) of the first response
+		makes sure the resumed part belongs to the same file, otherwise the download starts over. The file is verified
+		against the SHA-256 checksum if it is known, and moved to its final location. The checksum of every download is
+		stored in a '.sha256' file next to it, so a cached file is verified again before it is used (and downloaded again if
+		it changed).
+		"""
 		if useCache and os.path.isfile(self.filename):
-			print('Using cached %s' % self.title)
-			return
+			if self._verifyCached():
+				print('Using cached %s' % self.title)
+				return
+			print('Cached %s is corrupt, downloading it again' % self.title)
+
+		bar = ConsoleProgressBar() if showProgress else None
+		if bar: bar.start('Download %s' % self.title)
+		partFilename = self.filename + '.part'
+		for attempt in range(retries + 1):
+			try:
+				self._fetch(partFilename, bar, rateLimiter)
+				break
+			except (urllib.error.URLError, http.client.IncompleteRead, ConnectionError, socket.timeout) as e:
+				if attempt == retries or (isinstance(e, urllib.error.HTTPError) and e.code < 500):
+					raise
+				time.sleep(min(2**attempt, 30))
+		if bar: bar.end()
+
+		checksum = fileChecksum(partFilename)
+		if self.sha256 is not None and checksum != self.sha256:
+			self._removePart(partFilename)
+			raise RuntimeError('Checksum mismatch for {} (expected {}, got {})'.format(self.url, self.sha256, checksum))
+		with atomicFile(self.filename + '.sha256') as tmpFilename:
+			with open(tmpFilename, 'w') as f:
+				f.write('{}  {}\n'.format(checksum, self.title)) # format of sha256sum
+		os.replace(partFilename, self.filename)
+		self._removePart(partFilename)
 
-		bar = ConsoleProgressBar()
-		def reportProgress(blocksTransfered, blockSize, totalSize):
-			bar.progress((blocksTransfered * blockSize) / totalSize)
 
-		bar.start('Download %s' % self.title)
-		urllib.request.urlretrieve(self.url, self.filename, reporthook=reportProgress)
-		bar.end()
+	def _verifyCached(self):
+		"""Whether the cached file matches the known checksum, or the one stored when it was downloaded. The checksum of a
+		file that was downloaded before the checksums were stored is stored now."""
+		checksumFilename = self.filename + '.sha256'
+		stored = None
+		if os.path.isfile(checksumFilename):
+			with open(checksumFilename) as f:
+				stored = f.read().split()[0]
+		checksum = fileChecksum(self.filename)
+		if stored is None and self.sha256 is None:
+			with atomicFile(checksumFilename) as tmpFilename:
+				with open(tmpFilename, 'w') as f:
+					f.write('{}  {}\n'.format(checksum, self.title))
+			return True
+		return checksum == (self.sha256 if self.sha256 is not None else stored)
+
+
+	@staticmethod
+	def _removePart(partFilename):
+		"""Remove the '.part' file and the validator of its response (see _fetch)"""
+		for filename in [partFilename, partFilename + '.validator']:
+			if os.path.isfile(filename):
+				os.remove(filename)
+
+
+	def _fetch(self, partFilename, bar, rateLimiter):
+		"""Download to partFilename, resuming where it stopped. The validator of the response (ETag, or Last-Modified) is
+		stored in partFilename.validator; a part without validator is not resumed, the server could not tell whether the
+		file changed since."""
+		validatorFilename = partFilename + '.validator'
+		offset = os.path.getsize(partFilename) if os.path.isfile(partFilename) else 0
+		validator = None
+		if offset and os.path.isfile(validatorFilename):
+			with open(validatorFilename) as f:
+				stored = json.load(f)
+			if stored.get('url') == self.url:
+				validator = stored['validator']
+		if validator is None:
+			offset = 0
+
+		request = urllib.request.Request(self.url)
+		if offset:
+			request.add_header('Range', 'bytes=%d-' % offset)
+			request.add_header('If-Range', validator)
+		try:
+			response = urllib.request.urlopen(request, timeout=self.Timeout)
+		except urllib.error.HTTPError as e:
+			if e.code == 416 and offset:
+				# the requested range starts at the end: the previous attempt already got everything, if the file has the size
+				# of the part (Content-Range: bytes */<size>)
+				m = re.match(r'bytes \*/(\d+)$', e.headers.get('Content-Range', ''))
+				if m and int(m.group(1)) == offset:
+					return
+				self._removePart(partFilename)
+				raise ConnectionError('Range not satisfiable for {}, starting over'.format(self.url))
+			raise
+
+		with response:
+			if offset and response.status != 206: # the file changed (or the server does not support ranges), start over
+				offset = 0
+			if not offset:
+				# a strong ETag is preferred, If-Range does not accept weak ones
+				etag = response.headers.get('ETag')
+				validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+				if validator:
+					with atomicFile(validatorFilename) as tmpFilename:
+						with open(tmpFilename, 'w') as f:
+							json.dump({'url': self.url, 'validator': validator}, f)
+				elif os.path.isfile(validatorFilename):
+					os.remove(validatorFilename)
+			totalSize = response.headers.get('Content-Length')
+			totalSize = int(totalSize) + offset if totalSize is not None else None
+
+			received = offset
+			with open(partFilename, 'ab' if offset else 'wb') as f:
+				while True:
+					block = response.read(self.BlockSize)
+					if not block:
+						break
+					if rateLimiter: rateLimiter.consume(len(block))
+					f.write(block)
+					received += len(block)
+					instrument.count('bytes_downloaded', len(block))
+					if bar and totalSize: bar.progress(received / totalSize)
+
+		if totalSize is not None and received < totalSize:
+			raise ConnectionError('Connection closed after {} of {} bytes'.format(received, totalSize))
 
 
 	def unpackTo(self, outdir):
-		# if directory exists and has files we assume that we already successfully extracted the archive
-		if os.path.isdir(outdir):
-			for dirpath, dirnames, files in os.walk(outdir):
-				if len(files): return
+		"""Extract the archive to outdir, unless that was already done completely.
 
-		# make sure the outdir exists, but is empty
-		createDirectory(outdir, deleteBefore=True)
+		The archive is extracted to outdir.partial first and renamed when extraction succeeded; then a marker file
+		(outdir.extracted, with size and mtime of the archive) is written. Without the marker (extraction was killed, or done
+		before the markers existed) or if the archive changed, it is extracted again.
+		"""
+		markerFilename = outdir + '.extracted'
+		st = os.stat(self.filename)
+		marker = {'archive': os.path.basename(self.filename), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+		if os.path.isdir(outdir) and os.path.isfile(markerFilename):
+			with open(markerFilename) as f:
+				if json.load(f) == marker:
+					return
+
+		import patoolib # imported here, it is only needed to extract archives
+
+		# make sure the partial outdir exists, but is empty
+		partialDir = outdir + '.partial'
+		createDirectory(partialDir, deleteBefore=True)
 		try:
-			patoolib.extract_archive(self.filename, outdir=outdir)
+			with instrument.timed('extract_seconds'):
+				patoolib.extract_archive(self.filename, outdir=partialDir)
 		except:
-			shutil.rmtree(outdir)
+			shutil.rmtree(partialDir)
 			raise
+		if os.path.isdir(outdir):
+			shutil.rmtree(outdir)
+		os.replace(partialDir, outdir)
+		with atomicFile(markerFilename) as tmpFilename:
+			with open(tmpFilename, 'w') as f:
+				json.dump(marker, f)
+		instrument.count('members_extracted', sum(len(files) for _, _, files in os.walk(outdir)))
+
+
+	def open(self, unpackDir, stream=False, manifest=None):
+		"""Returns a reader for the files of the archive.
+
+		With stream=True tar and zip archives are read directly, without extracting them to unpackDir. Other formats (e.g.
+		rar) are always extracted to unpackDir first.
+		If an ImportManifest is given, the reader only returns members that were not imported before.
+		"""
+		def makeReader():
+			if stream and ArchiveReader.supports(self.filename):
+				return ArchiveReader(self.filename)
+			self.unpackTo(unpackDir)
+			return DirectoryReader(unpackDir)
+		if manifest is not None:
+			return manifest.track(self.filename, makeReader)
+		return makeReader()
+
+
+class DirectoryReader:
+	"""Access the files below a directory by their relative path (with '/' as separator)"""
+	def __init__(self, directory):
+		self.directory = directory
+
+
+	def names(self):
+		names = []
+		for root, dirnames, filenames in os.walk(self.directory):
+			for filename in filenames:
+				names.append(os.path.relpath(os.path.join(root, filename), self.directory).replace(os.sep, '/'))
+		return names
+
+
+	def stat(self, name):
+		"""Returns (size, mtime) of a file"""
+		st = os.stat(os.path.join(self.directory, *name.split('/')))
+		return st.st_size, int(st.st_mtime)
+
+
+	def open(self, names, groups=None):
+		"""Yields (name, path) for the given names (groups is only used by the import manifest, see manifest.ManifestReader)"""
+		for name in names:
+			yield name, os.path.join(self.directory, *name.split('/'))
+
+
+class ArchiveReader:
+	"""Access the members of a tar or zip archive by their path without extracting the archive"""
+	def __init__(self, filename):
+		self.filename = filename
+		self.isZip = zipfile.is_zipfile(filename)
+		self._names = None
+		self._stats = {}
+
+
+	@staticmethod
+	def supports(filename):
+		return zipfile.is_zipfile(filename) or tarfile.is_tarfile(filename)
+
+
+	def names(self):
+		if self._names is None:
+			if self.isZip:
+				with zipfile.ZipFile(self.filename) as archive:
+					for m in archive.infolist():
+						if m.is_dir(): continue
+						self._stats[ArchiveReader._memberName(m.filename)] = (m.file_size, int(time.mktime(m.date_time + (0, 0, -1))))
+			else:
+				with tarfile.open(self.filename, 'r|*') as archive:
+					for m in archive:
+						if not m.isfile(): continue
+						self._stats[ArchiveReader._memberName(m.name)] = (m.size, int(m.mtime))
+			self._names = list(self._stats.keys())
+		return self._names
+
+
+	def stat(self, name):
+		"""Returns (size, mtime) of a member"""
+		self.names()
+		return self._stats[name]
+
+
+	def open(self, names, groups=None):
+		"""Yields (name, file object) for the given names.
+
+		The members are returned in the order in which they are stored in the archive, so compressed tar archives are read in
+		a single pass. groups is only used by the import manifest (see manifest.ManifestReader).
+		"""
+		names = set(names)
+		if self.isZip:
+			with zipfile.ZipFile(self.filename) as archive:
+				for member in archive.infolist():
+					name = ArchiveReader._memberName(member.filename)
+					if name in names:
+						instrument.count('members_extracted')
+						yield name, io.BytesIO(archive.read(member))
+		else:
+			with tarfile.open(self.filename, 'r|*') as archive:
+				for member in archive:
+					name = ArchiveReader._memberName(member.name)
+					if member.isfile() and name in names:
+						instrument.count('members_extracted')
+						yield name, io.BytesIO(archive.extractfile(member).read())
+
+
+	@staticmethod
+	def _memberName(name):
+		return name[2:] if name.startswith('./') else name
+
+
+def downloadAll(downloaders, *, maxConnections=4, bytesPerSecond=None, useCache=True):
+	"""Download the files of multiple FileDownloader at the same time.
+
+	At most maxConnections downloads run in parallel, and if bytesPerSecond is given the total bandwidth of all downloads is
+	limited to it. With a single connection the usual progress bar is shown.
+	"""
+	rateLimiter = RateLimiter(bytesPerSecond) if bytesPerSecond else None
+	def download(dl):
+		dl.download(showProgress=maxConnections == 1, useCache=useCache, rateLimiter=rateLimiter)
+		if maxConnections > 1: print('Downloaded %s' % dl.title)
+
+	with ThreadPoolExecutor(max_workers=maxConnections) as executor:
+		for _ in executor.map(download, downloaders): # iterate to get exceptions raised
+			pass
+
+
+def fileChecksum(filename, blockSize=1024 * 1024):
+	"""SHA-256 hex digest of a file"""
+	h = hashlib.sha256()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(blockSize), b''):
+			h.update(block)
+	return h.hexdigest()
 
 
 def baseFilename(path):
@@ -88,6 +377,22 @@ def pathParts(path):
 			return parts[::-1]
 
 
+@contextlib.contextmanager
+def atomicFile(filename):
+	"""Yields a temporary filename next to filename (with the same extension, so writers can infer the format from it)
+	which is renamed to filename at the end of the block. If the process is killed or the block fails, filename still has
+	its previous content (or does not exist), it is never partially written."""
+	base, ext = os.path.splitext(filename)
+	tmpFilename = '{}.{}.partial{}'.format(base, os.getpid(), ext)
+	try:
+		yield tmpFilename
+		os.replace(tmpFilename, filename)
+	except BaseException:
+		if os.path.exists(tmpFilename):
+			os.remove(tmpFilename)
+		raise
+
+
 def createDirectory(dir, deleteBefore=False):
 	if deleteBefore and os.path.isdir(dir):
 		shutil.rmtree(dir)
@@ -95,27 +400,198 @@ def createDirectory(dir, deleteBefore=False):
 		os.makedirs(dir)
 
 
-def adjustSampling(x, SourceFs, TargetFs):
+def adjustSampling(x, SourceFs, TargetFs, backend='libsamplerate', quality='best'):
 	if SourceFs != TargetFs:
-		x = resample(x, TargetFs / SourceFs, 'sinc_best')
+		x = resamplers.resample(x, SourceFs, TargetFs, backend, quality)
 	return (x, TargetFs)
 
 
 def trimSilence(x, relMaxSilentAmplitude=0.005, *, trimLeft=True, trimRight=True):
-	maxSilentAmplitude = max(abs(x)) * relMaxSilentAmplitude
-	indices = np.where(abs(x) > maxSilentAmplitude)[0]
-	assert len(indices) > 1
-	l = indices[0] if trimLeft else 0
-	r = indices[-1] if trimRight else len(x) - 1
+	"""x is a mono signal or a multichannel signal (samples x channels); all channels are trimmed at the same points"""
+	absX = np.abs(x)
+	if absX.ndim > 1:
+		absX = absX.max(axis=1)
+	loud = absX > absX.max() * relMaxSilentAmplitude
+	first = loud.argmax()
+	last = len(x) - 1 - loud[::-1].argmax()
+	assert loud[first] and first < last
+	l = first if trimLeft else 0
+	r = last if trimRight else len(x) - 1
 	return x[l:r]
 
 
-def normalizeAmplitude(x):
+def normalizeAmplitude(x, gain=None):
+	"""Scale x to full scale; gain is the factor for it if it is already known (see trimSilenceBatch)"""
+	if gain is None:
+		gain = normalizationGains(np.abs(x).max(), x.dtype)
 	if x.dtype == np.int16:
-		x = x.astype(np.float32) / max(abs(x))
-		return (2**15 * x).astype(np.int16)
-	elif x.dtype == np.float32:
-		return x / max(abs(x))
+		return (x.astype(np.float32) * gain).astype(np.int16)
+	return x * x.dtype.type(gain)
+
+
+def normalizationGains(peaks, dtype):
+	"""Factors that scale signals with the maximum absolute amplitudes peaks to full scale (1, or 2**15 for int16)"""
+	if dtype == np.int16:
+		return 2**15 / np.asarray(peaks, dtype=np.float32)
+	elif dtype == np.float32:
+		return 1 / np.asarray(peaks, dtype=np.float32)
 	else:
-		raise ValueError('Unsupported dtype %s', np.dtype)
+		raise ValueError('Unsupported dtype %s' % dtype)
+
+
+def readChannelGroups(reader, groups, loadF):
+	"""Read the members of a reader that belong together, e.g. all channels of a multichannel measurement.
+
+	groups maps a group key to the names of its members (in channel order). loadF(name, file) loads a single member. Yields
+	(key, list of the loaded members) as soon as all members of a group were read; only incomplete groups are kept in memory.
+	"""
+	groupOf = {name: key for key, names in groups.items() for name in names}
+	pending = {}
+	for name, file in reader.open(groupOf, groups=groupOf):
+		key = groupOf[name]
+		loaded = pending.setdefault(key, {})
+		loaded[name] = loadF(name, file)
+		instrument.count('files_decoded')
+		if len(loaded) == len(groups[key]):
+			del pending[key]
+			yield key, [loaded[name] for name in groups[key]]
+
+
+def stackChannels(channels):
+	"""Combine mono signals to one multichannel signal (samples x channels), shorter channels are padded with zeros"""
+	x = np.zeros((max(len(c) for c in channels), len(channels)), dtype=channels[0].dtype)
+	for i, c in enumerate(channels):
+		x[:len(c), i] = c
+	return x
+
+
+def signalBatches(signals, maxSamples=BatchSamples):
+	"""Split signals into batches for padSignals: lists of indices of signals with the same number of channels and similar
+	lengths, whose padded batch has at most maxSamples samples per channel (a longer signal gets a batch of its own)"""
+	groups = {}
+	for i in sorted(range(len(signals)), key=lambda i: len(signals[i])):
+		groups.setdefault(signals[i].shape[1:], []).append(i)
+	batches = []
+	for indices in groups.values():
+		batch = []
+		for i in indices: # sorted by length, so the last signal is the longest one
+			if batch and len(signals[i]) * (len(batch) + 1) > maxSamples:
+				batches.append(batch)
+				batch = []
+			batch.append(i)
+		batches.append(batch)
+	return batches
+
+
+def padSignals(signals, buffer=None):
+	"""Zero padded batch of signals (signals x samples, or signals x samples x channels if the signals are multichannel with
+	the same number of channels) and the lengths of the signals.
+
+	buffer is an optional 1-d array that the batch is written to if it is large enough and has the dtype of the signals:
+	reused for all batches, the memory of the batch does not have to be allocated (and paged in) every time.
+	"""
+	lengths = np.array([len(x) for x in signals])
+	if len(signals) == 1: # e.g. a long signal that has a batch of its own, it is not copied
+		return signals[0][None], lengths
+	shape = (len(signals), lengths.max()) + signals[0].shape[1:]
+	if buffer is not None and buffer.dtype == signals[0].dtype and buffer.size >= np.prod(shape):
+		X = buffer[:np.prod(shape)].reshape(shape)
+	else:
+		X = np.empty(shape, dtype=signals[0].dtype)
+	for i, x in enumerate(signals):
+		X[i, :len(x)] = x
+		X[i, len(x):] = 0
+	return X, lengths
+
+
+def paddedBatches(signals, maxSamples=BatchSamples):
+	"""Yields (indices, X, lengths) for the batches of signalBatches, padded by padSignals. The batches are written to the
+	same buffer, so X is only valid until the next batch."""
+	buffers = {} # (channels, dtype) -> buffer
+	for batch in signalBatches(signals, maxSamples):
+		x = signals[batch[0]]
+		key = (x.shape[1:], x.dtype)
+		if key not in buffers:
+			buffers[key] = np.empty(maxSamples * int(np.prod(x.shape[1:])), dtype=x.dtype)
+		yield (batch,) + padSignals([signals[i] for i in batch], buffers[key])
+
+
+def peakAmplitudes(X):
+	"""Maximum absolute amplitude of every signal (float32) in a zero padded batch, see padSignals"""
+	# max and -min instead of abs: the batch is not copied (and -2**15 does not overflow for int16)
+	axes = tuple(range(1, X.ndim))
+	return np.maximum(X.max(axis=axes).astype(np.float32), -X.min(axis=axes).astype(np.float32))
+
+
+def _firstLoud(X, lengths, thresholds, *, reverse=False):
+	"""Index of the first sample louder than the threshold of every signal in a zero padded batch (the last one with
+	reverse), from argmax on the threshold mask.
+
+	The signals are scanned from their beginning (end) in blocks of growing size until the loud part is reached, so
+	usually only the silent parts are read. -1 for signals without loud samples.
+	"""
+	found = np.full(len(X), -1)
+	thresholds = thresholds.reshape((-1,) + (1,) * (X.ndim - 1)) # one threshold for all channels of a signal
+	rows = np.arange(len(X))
+	start, blockSize = 0, 1024
+	while len(rows) and start < X.shape[1]:
+		if reverse: # the signals end at different positions, positions before the beginning are masked
+			positions = lengths[rows, None] - 1 - start - np.arange(blockSize)
+			loud = np.abs(X[rows[:, None], np.maximum(positions, 0)]) > thresholds[rows]
+			loud &= (positions >= 0).reshape(loud.shape[:2] + (1,) * (X.ndim - 2))
+		else: # the zero padding is never louder than the threshold
+			block = X[:, start:start + blockSize] if len(rows) == len(X) else X[rows, start:start + blockSize]
+			loud = np.abs(block) > thresholds[rows]
+		if loud.ndim > 2:
+			loud = loud.any(axis=2)
+		hit = loud.any(axis=1)
+		offsets = start + loud[hit].argmax(axis=1)
+		found[rows[hit]] = lengths[rows[hit]] - 1 - offsets if reverse else offsets
+		rows = rows[~hit]
+		start += blockSize
+		blockSize *= 4
+	return found
+
+
+def trimBounds(X, lengths, relMaxSilentAmplitude=0.005, *, trimLeft=True, trimRight=True, peaks=None):
+	"""Bounds of trimSilence for every signal in a zero padded batch (see padSignals): trimSilence(x_i) is
+	X[i, left[i]:right[i]]. peaks are the peakAmplitudes of the batch if they are already known."""
+	if peaks is None:
+		peaks = peakAmplitudes(X)
+	thresholds = peaks * relMaxSilentAmplitude
+	left = _firstLoud(X, lengths, thresholds)
+	right = _firstLoud(X, lengths, thresholds, reverse=True) if trimRight else lengths - 1
+	assert (left >= 0).all() and (left < right).all()
+	if not trimLeft:
+		left[:] = 0
+	return left, right
+
+
+def trimSilenceBatch(X, lengths, relMaxSilentAmplitude=0.005, *, trimLeft=True, trimRight=True):
+	"""trimSilence and normalizeAmplitude for a zero padded batch of signals (see padSignals), without copying the batch.
+
+	Returns the arrays (left, right, gains): trimSilence(x_i) is X[i, left[i]:right[i]] and normalizeAmplitude of it is
+	normalizeAmplitude(X[i, left[i]:right[i]], gains[i]).
+	"""
+	peaks = peakAmplitudes(X)
+	left, right = trimBounds(X, lengths, relMaxSilentAmplitude, trimLeft=trimLeft, trimRight=trimRight, peaks=peaks)
+
+	# trimSilence excludes the sample at right, the peak has to be determined again if it is that sample
+	edge = np.abs(X[np.arange(len(X)), right].astype(np.float32))
+	for i in np.flatnonzero(edge.reshape(len(X), -1).max(axis=1) >= peaks):
+		peaks[i] = np.abs(X[i, left[i]:right[i]].astype(np.float32)).max()
+	return left, right, normalizationGains(peaks, X.dtype)
+
+
+def normalizeAmplitudeBatch(X):
+	"""Gains of normalizeAmplitude for every signal in a padded batch (see padSignals)"""
+	return normalizationGains(peakAmplitudes(X), X.dtype)
+
 
+def normalizeAmplitudes(signals):
+	"""normalizeAmplitude for a list of signals, computed in batches (see normalizeAmplitudeBatch)"""
+	normalized = [None] * len(signals)
+	for batch, X, lengths in paddedBatches(signals):
+		for k, (i, gain) in enumerate(zip(batch, normalizeAmplitudeBatch(X))):
+			normalized[i] = normalizeAmplitude(X[k, :lengths[k]], gain)
+	return normalized